@@ -0,0 +1,786 @@
+# analysis_service.py
+import base64
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from cache_service import get_analysis_cache, get_image_cache, image_digest, normalize_food_name, perceptual_hash
+from config_service import get_config
+from food_database import get_fallback_nutrition
+from gemini_client import GeminiAPIError, classify_error, estimate_tokens, get_gemini_client, has_image
+from image_service import load_image, prepare_image_payload
+from meal_service import (
+    build_meal_payload, combine_meal, parse_meal_description, parse_meal_response, scale_nutrition
+)
+from metrics_service import get_metrics_registry
+from model_router import get_model_router
+from nutrition_parser import (
+    NUTRITION_RESPONSE_SCHEMA, IncrementalNutritionParser, NutritionRecord, NutritionValidationError,
+    parse_nutrition_response, schema_generation_config
+)
+from resilience import (
+    CircuitOpenError, FlightTimeout, RateLimitExceeded, get_circuit_breaker, get_hedger, get_rate_limiter,
+    get_single_flight
+)
+
+# How long a session waits on an identical analysis already running elsewhere
+FLIGHT_WAIT_SECONDS = 45
+# How long to stop calling Gemini after a 429 without a Retry-After header
+RATE_LIMIT_PAUSE_SECONDS = 20
+# Extra attempts when a reply is malformed or nutritionally implausible
+INVALID_RESPONSE_RETRIES = 1
+
+_metrics = get_metrics_registry()
+ANALYSES = _metrics.counter(
+    "nutrimind_analyses_total", "Completed analyses by kind and result source", ["kind", "source"])
+ANALYSIS_SECONDS = _metrics.histogram(
+    "nutrimind_analysis_seconds", "End-to-end analysis time, including cache and fallback", ["kind", "source"])
+MEAL_ITEMS = _metrics.counter(
+    "nutrimind_meal_items_total", "Meal items by where their nutrition came from", ["source"])
+GEMINI_REQUEST_SECONDS = _metrics.histogram(
+    "nutrimind_gemini_request_seconds", "Gemini request time after quota was granted", ["method", "outcome"])
+RATE_LIMIT_WAIT_SECONDS = _metrics.histogram(
+    "nutrimind_rate_limit_wait_seconds", "Time spent waiting for Gemini quota")
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the background analysis queue has no room for another job."""
+
+
+def call_gemini(payload, api_key, session_id, on_text=None, should_stop=None, max_wait=None):
+    """
+    Send one request through the circuit breaker and the shared rate limiter.
+
+    The model is chosen by model_router (fastest healthy candidate,
+    vision-capable for photos), failing over to the next one on a 429.
+    Once every model is out of quota the limiter is paused for everyone
+    (Retry-After, else RATE_LIMIT_PAUSE_SECONDS). Passing on_text / should_stop streams the
+    reply instead of waiting for the whole body. With GEMINI_HEDGE on, a
+    non-streamed call slower than usual is duplicated (see resilience.Hedger)
+    if quota is free right now.
+
+    Args:
+        payload (dict): generateContent request body.
+        api_key (str): Gemini API key.
+        session_id (str): Caller identity for fair rate limiting.
+        max_wait (float): Longest wait for quota; None for the limiter default.
+
+    Returns:
+        tuple: (response dict, timing dict) from GeminiClient.
+    """
+    # Skip quota and network entirely while the circuit is open
+    breaker = get_circuit_breaker()
+    breaker.check()
+    limiter = get_rate_limiter()
+    tokens = estimate_tokens(payload)
+    RATE_LIMIT_WAIT_SECONDS.observe(limiter.acquire(session_id, tokens, max_wait=max_wait))
+    hedge = get_config()["gemini_hedge"]
+    kind = "image" if has_image(payload) else "text"
+    method = "stream" if on_text or should_stop else "generate"
+
+    # A 429 goes straight back to the router, which tries the next model instead of waiting
+    def send_to(model):
+        if method == "stream":
+            return get_gemini_client().stream_generate_content(
+                payload, api_key, model=model, on_text=on_text, should_stop=should_stop, retry_quota=False
+            )
+        send = lambda: get_gemini_client().generate_content(payload, api_key, model=model, retry_quota=False)
+        if hedge:
+            send = _hedged(send, f"{model}:{kind}", limiter, session_id, tokens)
+        return send()
+
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        response = breaker.call(lambda: get_model_router().call(kind, send_to), classify=classify_error)
+        outcome = "ok"
+        return response
+    except GeminiAPIError as e:
+        outcome = str(e.status_code)
+        if e.status_code == 429:
+            limiter.pause(e.retry_after or RATE_LIMIT_PAUSE_SECONDS)
+        raise
+    except requests.exceptions.Timeout:
+        outcome = "timeout"
+        raise
+    finally:
+        GEMINI_REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, outcome=outcome)
+
+
+def _hedged(send, key, limiter, session_id, tokens):
+    """Wrap send() so the shared hedger may duplicate it; the duplicate never waits for quota."""
+    def can_hedge():
+        try:
+            limiter.acquire(session_id, tokens, max_wait=0)
+            return True
+        except RateLimitExceeded:
+            return False
+
+    return lambda: get_hedger().call(key, send, can_hedge=can_hedge)
+
+
+def is_meal_description(food_input):
+    """True for inputs like "2 chapati, dal and rice" that should be split into items ("200g rice" is one food)."""
+    meal_items = parse_meal_description(food_input)
+    return len(meal_items) > 1 or (bool(meal_items) and meal_items[0]['quantity'] != 1)
+
+
+def build_food_payload(food_input, image=None, image_bytes=None):
+    """
+    generateContent request for one food name or photo, as sent by the app.
+
+    Args:
+        food_input (str): Food name (ignored for photos).
+        image (PIL.Image.Image): Decoded photo (e.g. from image_service.UploadCache);
+            used instead of decoding image_bytes again.
+        image_bytes (bytes): Raw upload bytes.
+
+    Returns:
+        dict: Request body with the nutrition response schema.
+    """
+    if image is not None or image_bytes is not None:
+        # Orient, downscale and encode to a byte budget before base64
+        jpeg_bytes, image_info = prepare_image_payload(
+            image if image is not None else image_bytes,
+            input_bytes=len(image_bytes) if image_bytes is not None else None
+        )
+        img_str = base64.b64encode(jpeg_bytes).decode()
+        
+        prompt = """You are a nutrition expert. Analyze this food image and provide accurate information.
+        
+        Rules:
+        1. Identify the specific food name (e.g., "Masala Dosa", "Butter Chicken", "Cheese Pizza")
+        2. Provide realistic nutrition values for the serving shown
+        3. Keep insight brief and helpful"""
+        
+        payload = {
+            "contents": [{
+                "parts": [
+                    {"text": prompt},
+                    {
+                        "inline_data": {
+                            "mime_type": "image/jpeg",
+                            "data": img_str
+                        }
+                    }
+                ]
+            }],
+            "generationConfig": schema_generation_config(NUTRITION_RESPONSE_SCHEMA)
+        }
+    else:
+        prompt = f"""Analyze this food: {food_input}
+        
+        Provide realistic nutrition facts for one typical serving and a brief nutritional insight."""
+        
+        payload = {
+            "contents": [{
+                "parts": [{"text": prompt}]
+            }],
+            "generationConfig": schema_generation_config(NUTRITION_RESPONSE_SCHEMA)
+        }
+    return payload
+
+
+def run_food_analysis(food_input, session_id, image=None, image_bytes=None, on_partial=None, max_wait=None):
+    """
+    Analyze one food (by name or photo) with Gemini, falling back to the database.
+
+    Makes no st.* calls, so it can run on a worker thread; the caller
+    renders the returned notices.
+
+    Args:
+        food_input (str): Food name, or a scope such as "nutrition label" for images.
+        session_id (str): Caller identity for fair rate limiting.
+        image (PIL.Image.Image): Decoded photo, if already available.
+        image_bytes (bytes): Raw upload bytes.
+        on_partial (callable): Streams the reply and receives the fields parsed so far.
+        max_wait (float): Longest wait for quota; 0 for opportunistic work.
+
+    Returns:
+        dict: "nutrition", "source" ("ai", "cache" or "fallback") and
+            "notices", a list of (st function name, message) pairs.
+    """
+    started = time.perf_counter()
+    outcome = _run_food_analysis(food_input, session_id, image, image_bytes, on_partial, max_wait)
+    kind = "text" if image is None and image_bytes is None else "image"
+    ANALYSES.inc(kind=kind, source=outcome["source"])
+    ANALYSIS_SECONDS.observe(time.perf_counter() - started, kind=kind, source=outcome["source"])
+    return outcome
+
+
+def _run_food_analysis(food_input, session_id, image, image_bytes, on_partial, max_wait):
+    notices = []
+    
+    def fallback(level, message):
+        notices.append((level, message))
+        return {"nutrition": get_fallback_nutrition(food_input), "source": "fallback", "notices": notices}
+    
+    def detected(nutrition, source="ai"):
+        suffix = " (cached)" if source == "cache" else ""
+        notices.append(("success", f"✅ AI Detected: **{nutrition['food_name']}**{suffix}"))
+        return {"nutrition": nutrition, "source": source, "notices": notices}
+    
+    # Text analyses are served from the shared cache when possible
+    cache_key = None
+    digest = None
+    phash = None
+    if image is None and image_bytes is None:
+        cache_key = normalize_food_name(food_input)
+        cached = get_analysis_cache().get(cache_key)
+        if cached:
+            return detected(cached, "cache")
+    else:
+        # Exact byte match first (no decode), then near-duplicate photos
+        image_cache = get_image_cache()
+        if image_bytes is not None:
+            digest = image_digest(image_bytes)
+            cached = image_cache.get_by_digest(digest, food_input)
+            if cached:
+                return detected(cached, "cache")
+            if image is None:
+                image = load_image(image_bytes)
+        phash = perceptual_hash(image)
+        cached = image_cache.get_similar(phash, food_input)
+        if cached:
+            if digest:
+                image_cache.set(digest, phash, food_input, cached)
+            return detected(cached, "cache")
+    
+    api_key = get_config()["gemini_api_key"]
+    
+    # No key configured: explain how to set one up
+    if not api_key:
+        return fallback("warning", """
+        🔐 **API Key Required for AI Analysis**
+        
+        **For Local Development:**
+        1. Create `.env` file in project root
+        2. Add: `GEMINI_API_KEY=your_key_here`
+        
+        **For Deployment:**
+        1. Add secret in GitHub: Settings → Secrets → Actions
+        2. Name: `GEMINI_API_KEY`
+        3. Value: Your Google AI key
+        
+        Using fallback database for now.
+        """)
+    
+    try:
+        # Check if API key is valid
+        if api_key == "YOUR_API_KEY_HERE":
+            return fallback("error", "❌ API key not configured. Please contact the developer.")
+        
+        # Prepare the prompt; the response schema makes Gemini return bare JSON
+        payload = build_food_payload(food_input, image, image_bytes)
+        # Only the encoded payload is needed from here on
+        image = image_bytes = None
+        
+        # Make API request through the shared keep-alive client (retries 5xx; the
+        # model router fails over on 429)
+        # Identical concurrent requests from other sessions share one call
+        if cache_key is not None:
+            flight_key = f"text:{cache_key}"
+        else:
+            flight_key = f"image:{food_input}:{digest or format(phash, 'x')}"
+        status_code = 200
+        nutrition_data = None
+        # Malformed or implausible replies are rejected and asked for again
+        for attempt in range(1 + INVALID_RESPONSE_RETRIES):
+            try:
+                if on_partial:
+                    # Streaming shows fields as they arrive, so it is not shared between sessions
+                    parser = IncrementalNutritionParser()
+                    result, timing = call_gemini(
+                        payload,
+                        api_key,
+                        session_id,
+                        on_text=lambda text: on_partial(parser.feed(text)),
+                        should_stop=parser.is_complete
+                    )
+                    # The stream may have been cut before the closing brace
+                    if parser.is_complete():
+                        record = NutritionRecord.from_dict(parser.fields)
+                    else:
+                        record = parse_nutrition_response(result)
+                else:
+                    result, timing = get_single_flight().do(
+                        flight_key,
+                        lambda: call_gemini(payload, api_key, session_id, max_wait=max_wait),
+                        timeout=FLIGHT_WAIT_SECONDS
+                    )
+                    record = parse_nutrition_response(result)
+                nutrition_data = record.to_dict()
+                break
+            except NutritionValidationError as e:
+                print(f"Rejected AI response (attempt {attempt + 1}): {e}")
+            except RateLimitExceeded:
+                return fallback("info", "⏳ AI is busy right now. Showing an estimate from our food database.")
+            except CircuitOpenError:
+                return fallback("info", "🩺 AI service is temporarily unavailable. Showing an estimate from our food database.")
+            except GeminiAPIError as e:
+                status_code = e.status_code
+                break
+        
+        if nutrition_data:
+            if cache_key:
+                get_analysis_cache().set(cache_key, nutrition_data)
+            elif phash is not None:
+                get_image_cache().set(digest or f"phash:{phash:x}", phash, food_input, nutrition_data)
+            return detected(nutrition_data)
+        
+        # Handle API errors, then fall back to the database
+        if status_code == 200:
+            return fallback("warning", "⚠️ Could not parse AI response. Using fallback.")
+        elif status_code == 403:
+            return fallback("error", """
+            ❌ **API Error 403: Invalid API Key**
+            
+            The API key has expired or is invalid.
+            Please contact the developer for assistance.
+            """)
+        elif status_code == 429:
+            return fallback("error", "❌ API quota exceeded. Try again in a few minutes.")
+        return fallback("warning", f"⚠️ API Error {status_code}. Using fallback database.")
+        
+    except (requests.exceptions.Timeout, FlightTimeout):
+        return fallback("warning", "⚠️ AI analysis timed out. Using fallback database.")
+    except Exception as e:
+        return fallback("warning", f"⚠️ Error: {str(e)[:100]}. Using fallback.")
+
+
+def run_meal_analysis(meal_input, session_id, max_wait=None):
+    """
+    Analyze a multi-item meal, sending only unknown items to Gemini in one request.
+
+    Items are resolved from the analysis cache and the fallback database
+    first. Makes no st.* calls, so it can run on a worker thread.
+
+    Args:
+        meal_input (str or list): e.g. "2 chapati, dal tadka and rice".
+        session_id (str): Caller identity for fair rate limiting.
+        max_wait (float): Longest wait for quota; 0 for opportunistic work.
+
+    Returns:
+        dict: "nutrition" (meal totals with an "items" breakdown), "source"
+            ("meal") and "notices".
+    """
+    started = time.perf_counter()
+    outcome = _run_meal_analysis(meal_input, session_id, max_wait)
+    ANALYSES.inc(kind="meal", source=outcome["source"])
+    ANALYSIS_SECONDS.observe(time.perf_counter() - started, kind="meal", source=outcome["source"])
+    for item in outcome["nutrition"].get("items", []):
+        MEAL_ITEMS.inc(source=item.get("source", "unknown"))
+    return outcome
+
+
+def _run_meal_analysis(meal_input, session_id, max_wait):
+    notices = []
+    items = parse_meal_description(meal_input)
+    if not items:
+        return {"nutrition": get_fallback_nutrition(meal_input if isinstance(meal_input, str) else ""), "source": "fallback", "notices": notices}
+    
+    # Resolve what we can locally: analysis cache first, then the fallback database
+    analysis_cache = get_analysis_cache()
+    resolved = [None] * len(items)
+    unknown = []
+    for i, item in enumerate(items):
+        cached = analysis_cache.get(normalize_food_name(item['name']))
+        if cached:
+            resolved[i] = dict(cached, source="cache")
+            continue
+        # The database only knows typical portions; weighed items go to the AI first
+        known = None if item.get('amount') else get_fallback_nutrition(item['name'], allow_generic=False)
+        if known:
+            resolved[i] = dict(known, source="database")
+        else:
+            unknown.append(i)
+    
+    # One batched request for everything else
+    if unknown:
+        api_key = get_config()["gemini_api_key"]
+        ai_items = None
+        if api_key and api_key != "YOUR_API_KEY_HERE":
+            names = [items[i]['name'] for i in unknown]
+            try:
+                result, timing = get_single_flight().do(
+                    "meal:" + "|".join(normalize_food_name(name) for name in names),
+                    lambda: call_gemini(build_meal_payload(names), api_key, session_id, max_wait=max_wait),
+                    timeout=FLIGHT_WAIT_SECONDS
+                )
+                if result.get("candidates"):
+                    response_text = result["candidates"][0]["content"]["parts"][0]["text"]
+                    ai_items = parse_meal_response(response_text, len(names))
+                if ai_items is None:
+                    notices.append(("warning", "⚠️ Could not parse AI response. Using fallback."))
+            except RateLimitExceeded:
+                notices.append(("info", "⏳ AI is busy right now. Using estimates from our food database."))
+            except CircuitOpenError:
+                notices.append(("info", "🩺 AI service is temporarily unavailable. Using estimates from our food database."))
+            except GeminiAPIError as e:
+                notices.append(("warning", f"⚠️ API Error {e.status_code}. Using fallback database."))
+            except (requests.exceptions.RequestException, FlightTimeout):
+                notices.append(("warning", "⚠️ AI analysis timed out. Using fallback database."))
+        
+        for position, i in enumerate(unknown):
+            if ai_items:
+                analysis_cache.set(normalize_food_name(items[i]['name']), ai_items[position])
+                resolved[i] = dict(ai_items[position], source="ai")
+            else:
+                resolved[i] = dict(get_fallback_nutrition(items[i]['name']), source="fallback")
+    
+    meal_items = []
+    for item, nutrition in zip(items, resolved):
+        scaled = scale_nutrition(nutrition, item['quantity'])
+        scaled['quantity'] = item['quantity']
+        meal_items.append(scaled)
+    
+    meal = combine_meal(meal_input, meal_items)
+    local = len(items) - len(unknown)
+    notices.append(("success", f"✅ Meal analyzed: **{len(items)} items** ({local} resolved locally)"))
+    return {"nutrition": meal, "source": "meal", "notices": notices}
+
+
+
+class AnalysisQueue:
+    """
+    Bounded worker pool for analyses that should not block a Streamlit rerun.
+
+    submit() returns a job id straight away; the script keeps the id in
+    session state and looks the job up with job() on later reruns. Jobs
+    run outside the script thread, so the submitted function must not call
+    st.* itself; it returns a result that the script renders when done.
+    """
+
+    def __init__(self, max_workers=4, max_queue=16, max_finished=200):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._lock = threading.Lock()
+        self._job_finished = threading.Condition(self._lock)
+        self._jobs = {}
+        self._finished = deque()
+        self._latencies = deque(maxlen=200)
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "cancelled": 0,
+        }
+
+    def submit(self, owner, label, fn, keep_result=True):
+        """
+        Queue fn() for a worker thread.
+
+        Args:
+            owner (str): Session that submitted the job (used by pending()).
+            label (str): Short description shown while the job runs.
+            fn (callable): UI-free work to run (bind arguments with functools.partial).
+            keep_result (bool): False for fire-and-forget jobs, which are
+                dropped as soon as they finish.
+
+        Returns:
+            str: Job id.
+
+        Raises:
+            QueueFullError: Every worker is busy and the queue is at max_queue.
+        """
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+            if active >= self.max_workers + self.max_queue:
+                self._stats["rejected"] += 1
+                raise QueueFullError(f"{active} analyses already queued")
+            job = {
+                "id": uuid.uuid4().hex,
+                "owner": owner,
+                "label": label,
+                "status": "queued",
+                "submitted_at": time.monotonic(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "keep_result": keep_result,
+            }
+            self._jobs[job["id"]] = job
+            self._stats["submitted"] += 1
+        self._executor.submit(self._run, job, fn)
+        return job["id"]
+
+    def _run(self, job, fn):
+        with self._lock:
+            if job["status"] == "cancelled":
+                self._jobs.pop(job["id"], None)
+                return
+            job["status"] = "running"
+            job["started_at"] = time.monotonic()
+        try:
+            result, status, error = fn(), "done", None
+        except Exception as e:
+            print(f"Background analysis '{job['label']}' failed: {e}")
+            result, status, error = None, "failed", str(e)[:200]
+
+        with self._lock:
+            job.update(result=result, status=status, error=error, finished_at=time.monotonic())
+            self._job_finished.notify_all()
+            self._stats["completed" if status == "done" else "failed"] += 1
+            self._latencies.append((
+                (job["started_at"] - job["submitted_at"]) * 1000,
+                (job["finished_at"] - job["started_at"]) * 1000,
+            ))
+            if not job["keep_result"]:
+                self._jobs.pop(job["id"], None)
+                return
+            # Forget the oldest finished jobs nobody came back for
+            self._finished.append(job["id"])
+            while len(self._finished) > self.max_finished:
+                self._jobs.pop(self._finished.popleft(), None)
+
+    def job(self, job_id):
+        """Snapshot of a job (None once it has been discarded), with its latency so far."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+        end = snapshot["finished_at"] or time.monotonic()
+        snapshot["elapsed_ms"] = (end - snapshot["submitted_at"]) * 1000
+        return snapshot
+
+    def wait(self, job_id, timeout):
+        """
+        Wait up to timeout seconds for a job to finish.
+
+        Returns:
+            dict or None: job() snapshot; its status is still "queued" or
+                "running" if the deadline passed first.
+        """
+        with self._job_finished:
+            self._job_finished.wait_for(
+                lambda: self._jobs.get(job_id) is None or self._jobs[job_id]["status"] not in ("queued", "running"),
+                timeout
+            )
+        return self.job(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job that has not started yet.
+
+        Returns:
+            bool: True if the job was still queued and will now never run.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != "queued":
+                return False
+            job["status"] = "cancelled"
+            self._stats["cancelled"] += 1
+            return True
+
+    def discard(self, job_id):
+        """Drop a finished job once its result has been used."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job["status"] in ("done", "failed"):
+                del self._jobs[job_id]
+
+    def pending(self, owner=None):
+        """Number of queued or running jobs, optionally for one session only."""
+        with self._lock:
+            return sum(
+                1 for job in self._jobs.values()
+                if job["status"] in ("queued", "running") and (owner is None or job["owner"] == owner)
+            )
+
+    def stats(self):
+        """Pool size, queue depth, outcomes and queue-wait / run latencies."""
+        with self._lock:
+            stats = dict(self._stats)
+            statuses = [job["status"] for job in self._jobs.values()]
+            latencies = list(self._latencies)
+
+        totals = sorted(wait + run for wait, run in latencies)
+        stats.update(
+            workers=self.max_workers,
+            max_queue=self.max_queue,
+            queued=statuses.count("queued"),
+            running=statuses.count("running"),
+            avg_wait_ms=sum(wait for wait, _ in latencies) / len(latencies) if latencies else 0.0,
+            avg_run_ms=sum(run for _, run in latencies) / len(latencies) if latencies else 0.0,
+            p95_total_ms=totals[min(len(totals) - 1, int(len(totals) * 0.95))] if totals else 0.0,
+        )
+        return stats
+
+
+class Prefetcher:
+    """
+    Debounced, low-priority speculative analyses that warm the caches.
+
+    Each session has at most one pending prefetch: scheduling a new one
+    supersedes the previous timer and cancels its job if it is still
+    queued. A prefetch only starts when a worker is idle (it never queues
+    behind or ahead of real analyses) and each session may start at most
+    max_per_hour of them, so speculation cannot burn the quota.
+    """
+
+    def __init__(self, queue, debounce_seconds=0.2, max_per_hour=20):
+        self.queue = queue
+        self.debounce_seconds = debounce_seconds
+        self.max_per_hour = max_per_hour
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._history = {}
+        self._stats = {
+            "scheduled": 0,
+            "superseded": 0,
+            "started": 0,
+            "skipped_busy": 0,
+            "skipped_cap": 0,
+        }
+
+    def schedule(self, owner, label, fn):
+        """Start fn() for this session once debounce_seconds pass without a newer schedule()."""
+        timer = threading.Timer(self.debounce_seconds, self._start, (owner, label, fn))
+        timer.daemon = True
+        with self._lock:
+            self._cancel_locked(owner)
+            self._pending[owner] = {"timer": timer, "job_id": None}
+            self._stats["scheduled"] += 1
+        timer.start()
+
+    def cancel(self, owner):
+        """Drop this session's pending prefetch, if any."""
+        with self._lock:
+            self._cancel_locked(owner)
+
+    def _cancel_locked(self, owner):
+        entry = self._pending.pop(owner, None)
+        if entry is None:
+            return
+        if entry["job_id"] is None:
+            entry["timer"].cancel()
+            self._stats["superseded"] += 1
+        elif self.queue.cancel(entry["job_id"]):
+            self._stats["superseded"] += 1
+
+    def _start(self, owner, label, fn):
+        with self._lock:
+            entry = self._pending.get(owner)
+            if entry is None or entry["timer"] is not threading.current_thread():
+                return
+
+            now = time.monotonic()
+            history = self._history.setdefault(owner, deque())
+            while history and now - history[0] > 3600:
+                history.popleft()
+            if len(history) >= self.max_per_hour:
+                self._stats["skipped_cap"] += 1
+                del self._pending[owner]
+                return
+            if self.queue.pending() >= self.queue.max_workers:
+                self._stats["skipped_busy"] += 1
+                del self._pending[owner]
+                return
+
+            try:
+                entry["job_id"] = self.queue.submit(owner, f"prefetch: {label}", fn, keep_result=False)
+            except QueueFullError:
+                self._stats["skipped_busy"] += 1
+                del self._pending[owner]
+                return
+            history.append(now)
+            self._stats["started"] += 1
+
+    def stats(self):
+        """Counters plus the number of sessions with a prefetch pending."""
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending))
+
+
+_queue = None
+_prefetcher = None
+_queue_lock = threading.Lock()
+
+
+def get_analysis_queue():
+    """
+    Return the process-wide analysis queue, creating it on first use.
+
+    Sized from ANALYSIS_WORKERS / ANALYSIS_QUEUE_LENGTH; changing those
+    takes effect on the next server start.
+    """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                config = get_config()
+                _queue = AnalysisQueue(
+                    max_workers=config["analysis_workers"],
+                    max_queue=config["analysis_queue_length"]
+                )
+    return _queue
+
+
+def get_prefetcher():
+    """Return the process-wide prefetcher (PREFETCH_DEBOUNCE_SECONDS / PREFETCH_MAX_PER_HOUR)."""
+    global _prefetcher
+    queue = get_analysis_queue()
+    if _prefetcher is None:
+        with _queue_lock:
+            if _prefetcher is None:
+                config = get_config()
+                _prefetcher = Prefetcher(
+                    queue,
+                    debounce_seconds=config["prefetch_debounce_seconds"],
+                    max_per_hour=config["prefetch_max_per_hour"]
+                )
+    return _prefetcher
+
+
+def _cache_samples():
+    text, image = get_analysis_cache().stats(), get_image_cache().stats()
+    samples = [({"cache": "text", "result": name}, text[name]) for name in ("memory_hits", "disk_hits", "misses")]
+    samples += [({"cache": "image", "result": name}, image[name]) for name in ("exact_hits", "perceptual_hits", "misses")]
+    return samples
+
+
+def _queue_samples():
+    stats = get_analysis_queue().stats()
+    return [({"state": "queued"}, stats["queued"]), ({"state": "running"}, stats["running"])]
+
+
+def _hedge_samples():
+    stats = get_hedger().stats()
+    return [({"result": "sent"}, stats["hedged"]), ({"result": "won"}, stats["hedge_wins"])]
+
+
+def _model_samples():
+    return [
+        ({"model": model}, stats["median_ms"] / 1000)
+        for model, stats in get_model_router().stats().items() if stats["median_ms"] is not None
+    ]
+
+
+def _breaker_samples():
+    state = get_circuit_breaker().stats()["state"]
+    return [({"state": name}, int(name == state)) for name in ("closed", "open", "half_open")]
+
+
+_metrics.register_callback(
+    "nutrimind_cache_lookups_total", "Analysis and image cache lookups by tier and result", _cache_samples, "counter")
+_metrics.register_callback("nutrimind_analysis_queue_jobs", "Background analyses waiting or running", _queue_samples)
+_metrics.register_callback("nutrimind_circuit_breaker_state", "1 for the breaker's current state", _breaker_samples)
+_metrics.register_callback(
+    "nutrimind_hedged_requests_total", "Duplicate Gemini requests sent, and how many answered first",
+    _hedge_samples, "counter")
+_metrics.register_callback(
+    "nutrimind_model_median_latency_seconds", "Median recent latency per Gemini model, as used for routing",
+    _model_samples)
+_metrics.register_callback(
+    "nutrimind_rate_limiter_queue_depth", "Requests waiting for Gemini quota",
+    lambda: [({}, get_rate_limiter().stats()["queue_depth"])])
@@ -4,14 +4,22 @@ import pandas as pd
 import plotly.express as px
 from datetime import datetime, timedelta
 import time
-from PIL import Image
-import io
-import random
-import json
-import base64
-import requests
 import re
-import os
+import uuid
+from functools import partial
+
+from analysis_service import (
+    QueueFullError, get_analysis_queue, get_prefetcher, is_meal_description, run_food_analysis,
+    run_meal_analysis
+)
+from cache_service import get_analysis_cache, get_image_cache, normalize_food_name
+from config_service import get_config, reload_config
+from food_database import get_fallback_nutrition, get_food, get_food_knowledge, search_foods
+from gemini_client import get_gemini_client
+from image_service import get_upload_cache
+from metrics_service import get_metrics_registry, start_metrics_exporter
+from model_router import get_model_router
+from resilience import get_circuit_breaker, get_hedger, get_rate_limiter, get_single_flight
 
 # ========== CRITICAL: Initialize ALL session state at TOP ==========
 if 'app_initialized' not in st.session_state:
@@ -40,6 +48,24 @@ if 'app_initialized' not in st.session_state:
     st.session_state.show_success = False
     st.session_state.success_message = ""
 
+# Identifies this browser session for fair sharing of the AI quota
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# Background analyses this session is waiting on (job ids in the shared queue)
+if 'analysis_jobs' not in st.session_state:
+    st.session_state.analysis_jobs = []
+
+# Provisional estimates waiting for their AI result ({"id"})
+if 'provisional_jobs' not in st.session_state:
+    st.session_state.provisional_jobs = []
+
+# Prometheus metrics on METRICS_PORT / METRICS_FILE, if configured (once per process)
+start_metrics_exporter()
+
+# Food lookup indexes: loaded from their snapshot (or built) once per process, before the first search
+get_food_knowledge()
+
 # Configure the page
 st.set_page_config(
     page_title="NutriMind - AI Nutrition Assistant",
@@ -636,298 +662,226 @@ st.markdown('<h1 class="main-header">NutriMind</h1>', unsafe_allow_html=True)
 st.markdown('<p class="slogan">Scan • Track • Grow</p>', unsafe_allow_html=True)
 
 # ========== PROPER GEMINI AI FUNCTION ==========
-def analyze_food_with_gemini(food_input, image=None):
-    """PROPER Gemini AI Analysis"""
-    
-    # Try multiple secure sources
-    api_key = None
-    
-    # 1. GitHub Actions injected secret (for deployment)
-    try:
-        if hasattr(st, 'secrets') and 'GEMINI_API_KEY' in st.secrets:
-            api_key = st.secrets["GEMINI_API_KEY"]
-    except:
-        pass
-    
-    # 2. Environment variable (for local/dev)
-    if not api_key:
-        import os
-        api_key = os.environ.get("GEMINI_API_KEY")
-        
-        # If env var not set, try to load from .env file
-        if not api_key:
-            try:
-                from dotenv import load_dotenv
-                load_dotenv()
-                api_key = os.environ.get("GEMINI_API_KEY")
-            except:
-                pass
-    
-    # 3. If still not found, show user how to set it up
-    if not api_key:
-        st.warning("""
-        🔐 **API Key Required for AI Analysis**
-        
-        **For Local Development:**
-        1. Create `.env` file in project root
-        2. Add: `GEMINI_API_KEY=your_key_here`
-        
-        **For Deployment:**
-        1. Add secret in GitHub: Settings → Secrets → Actions
-        2. Name: `GEMINI_API_KEY`
-        3. Value: Your Google AI key
-        
-        Using fallback database for now.
-        """)
-        return get_fallback_nutrition(food_input)
+# How often the background results area refreshes while analyses are pending
+BACKGROUND_POLL_SECONDS = 1.0
+
+def get_gemini_api_key():
+    """Gemini API key from secrets, the environment or a .env file (resolved once per process)"""
+    return get_config()["gemini_api_key"]
+
+def show_partial_nutrition(placeholder, fields):
+    """Render whatever fields a streaming analysis has produced so far"""
+    if not fields:
+        return
+    name = fields.get('food_name', '...')
+    macros = " | ".join(
+        f"{label} {fields[key]}{unit}" if key in fields else f"{label} …"
+        for key, label, unit in [('calories', '🔥', ' cal'), ('protein', '💪🏼', 'g'), ('carbs', '🌾', 'g'), ('fats', '🥑', 'g')]
+    )
+    placeholder.markdown(f'<div class="ai-thinking">🤖 Detected <strong>{name}</strong><br><small>{macros}</small></div>', unsafe_allow_html=True)
+
+def show_notices(notices):
+    """Render the (level, message) pairs collected by an analysis"""
+    for level, message in notices:
+        getattr(st, level)(message)
+
+def analyze_food_with_gemini(food_input, image=None, image_bytes=None, budget=None):
+    """PROPER Gemini AI Analysis; with a budget (seconds) a slow text answer is replaced by a provisional estimate"""
+    if budget is None and st.session_state.get('deadline_ai'):
+        budget = get_config()['analysis_budget_seconds']
     
     # Show AI thinking message
     thinking_placeholder = st.empty()
     thinking_placeholder.markdown('<div class="ai-thinking">🤖 AI is analyzing your food... Please wait</div>', unsafe_allow_html=True)
     
-    try:
-        # Check if API key is valid
-        if not api_key or api_key == "YOUR_API_KEY_HERE":
+    # Photos and labels wait for the AI: a name-based estimate of "uploaded food image" says nothing
+    if budget is not None and image is None and image_bytes is None:
+        nutrition = analyze_within_budget(food_input, image, image_bytes, budget)
+        if nutrition is not None:
             thinking_placeholder.empty()
-            st.error("❌ API key not configured. Please contact the developer.")
-            return get_fallback_nutrition(food_input)
-        
-        # Prepare the prompt
-        if image:
-            # Convert image to base64
-            buffered = io.BytesIO()
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            image.save(buffered, format="JPEG", quality=90)
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            
-            prompt = """You are a nutrition expert. Analyze this food image and provide accurate information.
-            
-            IMPORTANT: Return ONLY a JSON object in this exact format:
-            {
-                "food_name": "Exact name of the food dish",
-                "calories": number,
-                "protein": number,
-                "carbs": number,
-                "fats": number,
-                "insight": "Brief nutritional insight"
-            }
-            
-            Rules:
-            1. Identify the specific food name (e.g., "Masala Dosa", "Butter Chicken", "Cheese Pizza")
-            2. Provide realistic nutrition values
-            3. Keep insight brief and helpful
-            4. Return ONLY the JSON, no other text"""
-            
-            payload = {
-                "contents": [{
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": img_str
-                            }
-                        }
-                    ]
-                }],
-                "generationConfig": {
-                    "temperature": 0.1,
-                    "maxOutputTokens": 500,
-                }
-            }
-        else:
-            prompt = f"""Analyze this food: {food_input}
-            
-            Provide nutrition facts in this EXACT JSON format:
-            {{
-                "food_name": "Specific name of the food",
-                "calories": number,
-                "protein": number,
-                "carbs": number,
-                "fats": number,
-                "insight": "Brief nutritional insight"
-            }}
-            
-            IMPORTANT: Return ONLY the JSON object, no additional text."""
-            
-            payload = {
-                "contents": [{
-                    "parts": [{"text": prompt}]
-                }],
-                "generationConfig": {
-                    "temperature": 0.1,
-                    "maxOutputTokens": 500,
-                }
-            }
-        
-        # Make API request
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-lite:generateContent?key={api_key}",
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=30
+            return nutrition
+    
+    on_partial = None
+    if st.session_state.get('stream_ai'):
+        on_partial = lambda fields: show_partial_nutrition(thinking_placeholder, fields)
+    outcome = run_food_analysis(food_input, st.session_state.session_id, image, image_bytes, on_partial=on_partial)
+    
+    thinking_placeholder.empty()
+    show_notices(outcome["notices"])
+    return outcome["nutrition"]
+
+def analyze_within_budget(food_input, image, image_bytes, budget):
+    """Run the analysis on the worker pool; past the budget return a provisional estimate that is upgraded later (None if the pool is full)"""
+    queue = get_analysis_queue()
+    try:
+        job_id = queue.submit(
+            st.session_state.session_id, food_input,
+            partial(run_food_analysis, food_input, st.session_state.session_id, image, image_bytes)
         )
+    except QueueFullError:
+        return None
+    
+    job = queue.wait(job_id, budget)
+    if job is not None and job["status"] == "done":
+        queue.discard(job_id)
+        show_notices(job["result"]["notices"])
+        return job["result"]["nutrition"]
+    if job is None or job["status"] == "failed":
+        queue.discard(job_id)
+        return get_fallback_nutrition(food_input)
+    
+    estimate = dict(get_fallback_nutrition(food_input), provisional=True, provisional_id=job_id)
+    st.session_state.provisional_jobs.append({"id": job_id})
+    st.info("⏱️ Showing a quick estimate. The AI result will replace it automatically, even if you save it first.")
+    return estimate
+
+def apply_provisional_results():
+    """Swap finished AI results in for provisional estimates, in the current analysis and in saved logs; True if anything changed"""
+    queue = get_analysis_queue()
+    changed = False
+    for entry in list(st.session_state.provisional_jobs):
+        job = queue.job(entry["id"])
+        if job is not None and job["status"] in ("queued", "running"):
+            continue
+        st.session_state.provisional_jobs.remove(entry)
+        queue.discard(entry["id"])
+        if job is None or job["status"] == "failed" or job["result"]["source"] == "fallback":
+            # No better answer is coming; the estimate stands
+            for log in st.session_state.food_logs:
+                if log.get('provisional_id') == entry["id"]:
+                    log.pop('provisional', None)
+                    log.pop('provisional_id', None)
+            continue
         
-        thinking_placeholder.empty()
+        result = job["result"]["nutrition"]
+        upgraded_any = False
+        current = st.session_state.current_analyzed_food
+        if current and current.get('provisional_id') == entry["id"]:
+            st.session_state.current_analyzed_food = dict(result, scan_type=current.get('scan_type'))
+            upgraded_any = True
         
-        if response.status_code == 200:
-            result = response.json()
-            
-            if "candidates" in result and len(result["candidates"]) > 0:
-                response_text = result["candidates"][0]["content"]["parts"][0]["text"]
-                
-                # Clean the response
-                response_text = response_text.strip()
-                
-                # Remove markdown code blocks
-                if response_text.startswith("```json"):
-                    response_text = response_text[7:]
-                if response_text.endswith("```"):
-                    response_text = response_text[:-3]
-                response_text = response_text.strip()
-                
-                # Extract JSON using regex
-                json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                
-                if json_match:
-                    try:
-                        nutrition_data = json.loads(json_match.group())
-                        
-                        # Validate required fields
-                        if "food_name" in nutrition_data:
-                            # Ensure all fields exist
-                            required_fields = ["calories", "protein", "carbs", "fats", "insight"]
-                            for field in required_fields:
-                                if field not in nutrition_data:
-                                    if field == "insight":
-                                        nutrition_data[field] = "Nutrition information provided by AI analysis"
-                                    else:
-                                        nutrition_data[field] = 0
-                            
-                            # Convert to integers
-                            for field in ["calories", "protein", "carbs", "fats"]:
-                                try:
-                                    nutrition_data[field] = int(float(nutrition_data[field]))
-                                except:
-                                    nutrition_data[field] = 0
-                            
-                            st.success(f"✅ AI Detected: **{nutrition_data['food_name']}**")
-                            return nutrition_data
-                    except json.JSONDecodeError as e:
-                        st.warning("⚠️ Could not parse AI response. Using fallback.")
+        for log in st.session_state.food_logs:
+            if log.get('provisional_id') != entry["id"]:
+                continue
+            # Keep the portion size the estimate was saved with
+            portion = log.get('portion_multiplier', 1.0)
+            for key in ['calories', 'protein', 'carbs', 'fats']:
+                upgraded = int(result[key] * portion)
+                st.session_state.daily_totals[key] += upgraded - log.get(key, 0)
+                log[key] = upgraded
+            log.update(food_name=result['food_name'], insight=result['insight'])
+            log.pop('provisional', None)
+            log.pop('provisional_id', None)
+            log.pop('confidence', None)
+            upgraded_any = True
         
-        # Handle API errors
-        if response.status_code == 403:
-            st.error("""
-            ❌ **API Error 403: Invalid API Key**
-            
-            The API key has expired or is invalid.
-            Please contact the developer for assistance.
-            """)
-        elif response.status_code == 429:
-            st.error("❌ API quota exceeded. Try again in a few minutes.")
-        else:
-            st.warning(f"⚠️ API Error {response.status_code}. Using fallback database.")
+        if upgraded_any:
+            changed = True
+            st.toast(f"✨ AI result ready: {result['food_name']} ({result['calories']} cal)")
+    return changed
+
+@st.fragment(run_every=BACKGROUND_POLL_SECONDS)
+def poll_provisional_results():
+    """Checks pending provisional estimates and refreshes the page once they are resolved"""
+    if apply_provisional_results() or not st.session_state.provisional_jobs:
+        st.rerun()
+
+def analyze_meal_with_gemini(meal_input):
+    """Analyze a multi-item meal, sending only unknown items to Gemini in one request"""
+    thinking_placeholder = st.empty()
+    thinking_placeholder.markdown('<div class="ai-thinking">🤖 AI is analyzing your meal... Please wait</div>', unsafe_allow_html=True)
+    outcome = run_meal_analysis(meal_input, st.session_state.session_id)
+    thinking_placeholder.empty()
+    show_notices(outcome["notices"])
+    return outcome["nutrition"]
+
+def queue_analysis(label, scan_type, fn, *args):
+    """Submit a UI-free analysis to the shared worker pool and remember the job in this session"""
+    try:
+        job_id = get_analysis_queue().submit(st.session_state.session_id, label, partial(fn, *args))
+    except QueueFullError:
+        st.warning("⏳ Too many analyses are queued right now. Please wait for one to finish.")
+        return
+    st.session_state.analysis_jobs.append({"id": job_id, "scan_type": scan_type})
+    st.success(f"🧵 Queued **{label}**. Keep logging - the result will appear below.")
+
+def schedule_prefetch():
+    """on_change for the food name box (fired on Enter or blur, not per keystroke): warm the caches while the user reaches for Analyze"""
+    prefetcher = get_prefetcher()
+    session_id = st.session_state.session_id
+    food_input = (st.session_state.get('manual_food_input') or "").strip()
+    if not st.session_state.get('prefetch_ai') or not food_input or not get_gemini_api_key():
+        prefetcher.cancel(session_id)
+        return
+    if is_meal_description(food_input):
+        job = run_meal_analysis
+    elif get_analysis_cache().get(normalize_food_name(food_input)):
+        prefetcher.cancel(session_id)
+        return
+    else:
+        job = run_food_analysis
+    # max_wait=0: only use quota that is free right now, never queue for it
+    prefetcher.schedule(session_id, food_input, partial(job, food_input, session_id, max_wait=0))
+
+def use_food_suggestion(key):
+    """on_click for a database suggestion: take its nutrition as the result, no AI call"""
+    nutrition = get_food(key)
+    nutrition['scan_type'] = "Manual"
+    st.session_state.current_analyzed_food = nutrition
+    st.session_state.manual_food_input = nutrition['food_name']
+    get_prefetcher().cancel(st.session_state.session_id)
+
+def forget_analysis(job_id):
+    """Drop a background job from this session and from the queue"""
+    get_analysis_queue().discard(job_id)
+    st.session_state.analysis_jobs = [job for job in st.session_state.analysis_jobs if job["id"] != job_id]
+
+def show_background_analyses():
+    """Result area for queued analyses: progress while running, then Log / Dismiss"""
+    queue = get_analysis_queue()
+    st.markdown("### 🧵 Background Analyses")
+    for entry in list(st.session_state.analysis_jobs):
+        job = queue.job(entry["id"])
+        if job is None:
+            forget_analysis(entry["id"])
+            continue
         
-        # Fallback to database
-        return get_fallback_nutrition(food_input)
+        if job["status"] in ("queued", "running"):
+            st.write(f"⏳ **{job['label']}** - {job['status']} ({job['elapsed_ms'] / 1000:.1f}s)")
+            continue
         
-    except requests.exceptions.Timeout:
-        thinking_placeholder.empty()
-        st.warning("⚠️ AI analysis timed out. Using fallback database.")
-        return get_fallback_nutrition(food_input)
-    except Exception as e:
-        thinking_placeholder.empty()
-        st.warning(f"⚠️ Error: {str(e)[:100]}. Using fallback.")
-        return get_fallback_nutrition(food_input)
+        if job["status"] == "failed":
+            st.error(f"❌ **{job['label']}** failed: {job['error']}")
+            if st.button("✖ Dismiss", key=f"dismiss_{job['id']}"):
+                forget_analysis(job["id"])
+                st.rerun()
+            continue
+        
+        nutrition = job["result"]["nutrition"]
+        st.markdown(
+            f"**🍽️ {nutrition['food_name']}** - {nutrition['calories']} cal | {nutrition['protein']}g protein | "
+            f"{nutrition['carbs']}g carbs | {nutrition['fats']}g fats"
+        )
+        st.caption(f"From \"{job['label']}\" in {job['elapsed_ms'] / 1000:.1f}s")
+        show_notices([(level, message) for level, message in job["result"]["notices"] if level != "success"])
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("✅ Log", key=f"log_{job['id']}", use_container_width=True):
+                nutrition = dict(nutrition, scan_type=entry["scan_type"])
+                if save_food_to_session(nutrition):
+                    forget_analysis(job["id"])
+                    st.rerun()
+        with col2:
+            if st.button("✖ Dismiss", key=f"dismiss_{job['id']}", use_container_width=True):
+                forget_analysis(job["id"])
+                st.rerun()
 
-def get_fallback_nutrition(food_name):
-    """Fallback nutrition database when API fails"""
-    food_db = {
-        "dosa": {"food_name": "Masala Dosa", "calories": 200, "protein": 4, "carbs": 30, "fats": 6, "insight": "South Indian fermented crepe with potato filling"},
-        "idli": {"food_name": "Idli", "calories": 60, "protein": 2, "carbs": 12, "fats": 0.5, "insight": "Steamed rice cake, easily digestible"},
-        "vada": {"food_name": "Medu Vada", "calories": 150, "protein": 3, "carbs": 20, "fats": 7, "insight": "Lentil doughnut, deep fried"},
-        "poha": {"food_name": "Poha", "calories": 250, "protein": 6, "carbs": 45, "fats": 5, "insight": "Flattened rice breakfast dish"},
-        "upma": {"food_name": "Upma", "calories": 200, "protein": 5, "carbs": 35, "fats": 6, "insight": "Semolina breakfast porridge"},
-        "chapati": {"food_name": "Chapati", "calories": 70, "protein": 3, "carbs": 15, "fats": 0.4, "insight": "Whole wheat Indian flatbread"},
-        "roti": {"food_name": "Roti", "calories": 70, "protein": 3, "carbs": 15, "fats": 0.4, "insight": "Indian flatbread made from whole wheat"},
-        "paratha": {"food_name": "Aloo Paratha", "calories": 300, "protein": 8, "carbs": 45, "fats": 10, "insight": "Stuffed flatbread with potatoes"},
-        "rice": {"food_name": "Steamed Rice", "calories": 205, "protein": 4.3, "carbs": 45, "fats": 0.4, "insight": "Good source of carbohydrates"},
-        "biryani": {"food_name": "Chicken Biryani", "calories": 500, "protein": 25, "carbs": 60, "fats": 20, "insight": "Flavorful rice dish with meat and spices"},
-        "pulao": {"food_name": "Vegetable Pulao", "calories": 300, "protein": 6, "carbs": 55, "fats": 8, "insight": "Vegetable rice pilaf"},
-        "butter chicken": {"food_name": "Butter Chicken", "calories": 450, "protein": 30, "carbs": 15, "fats": 30, "insight": "Creamy tomato-based chicken curry"},
-        "paneer butter": {"food_name": "Paneer Butter Masala", "calories": 400, "protein": 22, "carbs": 20, "fats": 25, "insight": "Creamy cottage cheese curry"},
-        "chicken curry": {"food_name": "Chicken Curry", "calories": 350, "protein": 25, "carbs": 10, "fats": 20, "insight": "Spicy chicken in gravy"},
-        "dal": {"food_name": "Dal Tadka", "calories": 150, "protein": 9, "carbs": 22, "fats": 4, "insight": "Tempered lentil soup, rich in protein"},
-        "sambar": {"food_name": "Sambar", "calories": 100, "protein": 5, "carbs": 18, "fats": 3, "insight": "South Indian lentil stew with vegetables"},
-        "banana": {"food_name": "Banana", "calories": 105, "protein": 1.3, "carbs": 27, "fats": 0.3, "insight": "Rich in potassium and quick energy"},
-        "apple": {"food_name": "Apple", "calories": 95, "protein": 0.5, "carbs": 25, "fats": 0.3, "insight": "High in fiber and antioxidants"},
-        "orange": {"food_name": "Orange", "calories": 62, "protein": 1.2, "carbs": 15, "fats": 0.2, "insight": "Excellent source of Vitamin C"},
-        "mango": {"food_name": "Mango", "calories": 150, "protein": 1.1, "carbs": 40, "fats": 0.6, "insight": "Rich in Vitamin A and C"},
-        "grapes": {"food_name": "Grapes", "calories": 69, "protein": 0.7, "carbs": 18, "fats": 0.2, "insight": "Natural sugars with antioxidants"},
-        "egg": {"food_name": "Egg (Boiled)", "calories": 78, "protein": 6, "carbs": 0.6, "fats": 5, "insight": "Complete protein with all essential amino acids"},
-        "chicken": {"food_name": "Chicken Breast", "calories": 165, "protein": 31, "carbs": 0, "fats": 3.6, "insight": "Lean protein for muscle building"},
-        "fish": {"food_name": "Fish (Grilled)", "calories": 206, "protein": 22, "carbs": 0, "fats": 12, "insight": "Rich in Omega-3 fatty acids"},
-        "paneer": {"food_name": "Paneer", "calories": 265, "protein": 18, "carbs": 1.2, "fats": 20, "insight": "Indian cottage cheese, high in calcium"},
-        "tofu": {"food_name": "Tofu", "calories": 76, "protein": 8, "carbs": 2, "fats": 4, "insight": "Plant-based protein from soy"},
-        "pizza": {"food_name": "Pizza Slice", "calories": 285, "protein": 12, "carbs": 36, "fats": 10, "insight": "Contains carbs, protein and fats"},
-        "burger": {"food_name": "Cheese Burger", "calories": 354, "protein": 15, "carbs": 29, "fats": 20, "insight": "Fast food with moderate protein"},
-        "samosa": {"food_name": "Samosa", "calories": 300, "protein": 4, "carbs": 35, "fats": 16, "insight": "Fried pastry with potato filling"},
-        "pakora": {"food_name": "Pakora", "calories": 200, "protein": 5, "carbs": 20, "fats": 10, "insight": "Vegetable fritters, deep fried"},
-        "milk": {"food_name": "Milk (1 cup)", "calories": 150, "protein": 8, "carbs": 12, "fats": 8, "insight": "Rich in calcium and protein"},
-        "curd": {"food_name": "Curd/Yogurt", "calories": 150, "protein": 8, "carbs": 11, "fats": 8, "insight": "Probiotic-rich for gut health"},
-        "cheese": {"food_name": "Cheese", "calories": 113, "protein": 7, "carbs": 1, "fats": 9, "insight": "High in calcium and protein"},
-        "smoothie": {"food_name": "Fruit Smoothie", "calories": 200, "protein": 8, "carbs": 30, "fats": 5, "insight": "Blended fruits with nutrients"},
-        "juice": {"food_name": "Orange Juice", "calories": 112, "protein": 2, "carbs": 26, "fats": 0.5, "insight": "Vitamin C rich beverage"},
-        "coffee": {"food_name": "Coffee", "calories": 2, "protein": 0.3, "carbs": 0, "fats": 0, "insight": "Low calorie caffeine source"},
-        "tea": {"food_name": "Tea", "calories": 2, "protein": 0, "carbs": 0.5, "fats": 0, "insight": "Low calorie beverage with antioxidants"},
-        "bread": {"food_name": "Bread Slice", "calories": 79, "protein": 3, "carbs": 15, "fats": 1, "insight": "Basic carbohydrate source"},
-        "pasta": {"food_name": "Pasta", "calories": 220, "protein": 8, "carbs": 43, "fats": 1, "insight": "Carb-rich Italian dish"},
-        "sandwich": {"food_name": "Vegetable Sandwich", "calories": 250, "protein": 8, "carbs": 40, "fats": 6, "insight": "Quick meal with vegetables"},
-        "salad": {"food_name": "Green Salad", "calories": 100, "protein": 4, "carbs": 15, "fats": 3, "insight": "Healthy vegetable mix"},
-        "rice bowl": {"food_name": "Steamed Rice Bowl", "calories": 240, "protein": 4.5, "carbs": 53, "fats": 0.5, "insight": "Simple carbohydrates for energy"},
-        "chicken salad": {"food_name": "Chicken Salad", "calories": 320, "protein": 35, "carbs": 12, "fats": 15, "insight": "Lean protein with vegetables"},
-        "protein shake": {"food_name": "Protein Shake", "calories": 180, "protein": 25, "carbs": 12, "fats": 3, "insight": "Quick protein supplement"},
-        "oatmeal": {"food_name": "Oatmeal", "calories": 150, "protein": 5, "carbs": 27, "fats": 3, "insight": "High fiber breakfast"},
-        "fried rice": {"food_name": "Vegetable Fried Rice", "calories": 380, "protein": 8, "carbs": 60, "fats": 12, "insight": "Stir-fried rice with vegetables"},
-    }
-    
-    if not food_name or food_name == "":
-        return {
-            "food_name": "Food Item",
-            "calories": 250,
-            "protein": 12,
-            "carbs": 30,
-            "fats": 8,
-            "insight": "General food item with moderate nutrition"
-        }
-    
-    food_lower = food_name.lower()
-    
-    # Check for exact or partial matches
-    for key in food_db:
-        if key in food_lower:
-            return food_db[key]
-    
-    # Check for specific Indian food terms
-    if any(term in food_lower for term in ["curry", "masala", "tikka", "korma"]):
-        if "chicken" in food_lower:
-            return food_db["chicken curry"]
-        elif "paneer" in food_lower:
-            return food_db["paneer butter"]
-        elif "egg" in food_lower:
-            return {"food_name": "Egg Curry", "calories": 200, "protein": 15, "carbs": 8, "fats": 12, "insight": "Eggs cooked in spicy gravy"}
-    
-    # Generic fallback
-    return {
-        "food_name": food_name.title(),
-        "calories": random.randint(150, 400),
-        "protein": random.randint(5, 25),
-        "carbs": random.randint(15, 50),
-        "fats": random.randint(5, 20),
-        "insight": "General food item with moderate nutrition"
-    }
+@st.fragment(run_every=BACKGROUND_POLL_SECONDS)
+def poll_background_analyses():
+    """Re-runs only the result area until this session has nothing pending, then refreshes the page"""
+    show_background_analyses()
+    if not get_analysis_queue().pending(st.session_state.session_id):
+        st.rerun()
 
 def get_exercise_suggestions(calories_consumed):
     """Get exercise suggestions based on calories consumed"""
@@ -1016,7 +970,11 @@ def get_meal_suggestions(meal_time, diet_preference, calories_needed, protein_ne
         else:
             return ["🧀 Palak paneer with roti (380 cal, 20g protein)", "🥘 Mixed vegetable curry with rice (350 cal, 12g protein)", "🍛 Sambar rice with papad (320 cal, 10g protein)"]
 
+FOOD_LOG_SAVE_SECONDS = get_metrics_registry().histogram(
+    "nutrimind_food_log_save_seconds", "Time to record a food log entry in the session", ["outcome"])
+
 def save_food_to_session(food_data):
+    started = time.perf_counter()
     try:
         food_data['timestamp'] = datetime.now().isoformat()
         food_data['time'] = datetime.now().strftime("%H:%M")
@@ -1035,8 +993,10 @@ def save_food_to_session(food_data):
         st.session_state.show_success = True
         st.session_state.success_message = f"✅ {food_data.get('food_name', 'Food')} saved successfully!"
         
+        FOOD_LOG_SAVE_SECONDS.observe(time.perf_counter() - started, outcome="ok")
         return True
     except Exception as e:
+        FOOD_LOG_SAVE_SECONDS.observe(time.perf_counter() - started, outcome="error")
         st.error(f"Error saving food: {e}")
         return False
 
@@ -1181,6 +1141,83 @@ with st.sidebar:
             st.success(f"Added {water_to_add}ml water!")
             time.sleep(0.5)
             st.rerun()
+    
+    st.divider()
+    st.markdown("## ⚙️ AI Settings")
+    st.toggle(
+        "⚡ Stream AI responses",
+        key="stream_ai",
+        help="Show the detected food and macros while the AI is still answering"
+    )
+    st.toggle(
+        "🧵 Analyze in background",
+        key="background_ai",
+        help="Queue analyses and keep logging; results appear at the bottom of the Log Food tab"
+    )
+    st.toggle(
+        "⏱️ Quick estimate first",
+        key="deadline_ai",
+        help="If the AI takes longer than a moment, show a database estimate right away and upgrade it when the AI answers"
+    )
+    st.toggle(
+        "🔮 Prefetch on Enter",
+        key="prefetch_ai",
+        help="Start analyzing a food name when you press Enter in the box, so the result is ready (or on its way) when you click Analyze"
+    )
+    if st.button("🔄 Reload AI configuration", use_container_width=True, help="Re-read the API key, model and timeouts"):
+        config = reload_config()
+        st.success(f"Configuration reloaded (model: {config['gemini_model']}, key from {config['api_key_source'] or 'nowhere'})")
+    
+    st.divider()
+    with st.expander("🩺 Diagnostics"):
+        breaker_stats = get_circuit_breaker().stats()
+        breaker_labels = {"closed": "🟢 Closed", "half_open": "🟡 Half-open (probing)", "open": "🔴 Open"}
+        st.markdown("**Gemini Circuit Breaker**")
+        st.write(f"State: {breaker_labels[breaker_stats['state']]}")
+        if breaker_stats['state'] == "open":
+            st.write(f"Next probe in {breaker_stats['retry_in']:.0f}s")
+        st.write(f"Window: {breaker_stats['failure_rate']:.0%} errors, {breaker_stats['slow_rate']:.0%} slow over {breaker_stats['window_calls']} calls")
+        st.write(f"Opened {breaker_stats['opened']}x, short-circuited {breaker_stats['short_circuited']} calls")
+        cache_stats = get_analysis_cache().stats()
+        st.markdown("**AI Analysis Cache**")
+        st.write(f"Hit rate: {cache_stats['hit_rate']:.0%} ({cache_stats['hits']} hits / {cache_stats['misses']} misses)")
+        st.write(f"Entries: {cache_stats['memory_entries']} in memory, {cache_stats['disk_entries']} on disk")
+        image_stats = get_image_cache().stats()
+        st.markdown("**Image Scan Cache**")
+        st.write(f"Hit rate: {image_stats['hit_rate']:.0%} ({image_stats['exact_hits']} exact, {image_stats['perceptual_hits']} similar, {image_stats['misses']} misses)")
+        st.write(f"Memory: {image_stats['memory_bytes'] / 1024:.1f} KB, Disk: {image_stats['disk_bytes'] / 1024:.1f} KB")
+        upload_stats = get_upload_cache().stats()
+        st.write(f"Uploads: {upload_stats['entries']} cached ({upload_stats['bytes'] / 1024:.0f} KB), {upload_stats['decodes']} decodes, {upload_stats['hits']} reuses")
+        client_stats = get_gemini_client().stats()
+        st.markdown("**Gemini Client**")
+        for model, model_stats in get_model_router().stats().items():
+            latency = "not measured" if model_stats['median_ms'] is None else f"{model_stats['median_ms']:.0f} ms median"
+            cooldown = f", skipped for {model_stats['cooldown']:.0f}s" if model_stats['cooldown'] else ""
+            st.write(f"Model {model}: {model_stats['requests']} requests, {latency}, {model_stats['error_rate']:.0%} errors{cooldown}")
+        st.write(f"Requests: {client_stats['requests']} ({client_stats['retries']} retries, {client_stats['errors']} errors)")
+        st.write(f"Avg latency: {client_stats['avg_total_ms']:.0f} ms")
+        st.write(f"First byte: {client_stats['avg_ttfb_new_connection_ms']:.0f} ms new connection, {client_stats['avg_ttfb_reused_connection_ms']:.0f} ms reused")
+        if get_config()['gemini_hedge']:
+            hedge_stats = get_hedger().stats()
+            st.write(f"Hedged: {hedge_stats['hedged']} of {hedge_stats['calls']} requests ({hedge_stats['hedge_wins']} answered first)")
+        flight_stats = get_single_flight().stats()
+        st.write(f"Coalesced requests: {flight_stats['coalesced']} ({flight_stats['in_flight']} in flight)")
+        limiter_stats = get_rate_limiter().stats()
+        st.markdown("**Rate Limiter**")
+        st.write(f"Queue depth: {limiter_stats['queue_depth']} (max {limiter_stats['max_queue_depth']})")
+        st.write(f"Wait: {limiter_stats['avg_wait_ms']:.0f} ms avg, {limiter_stats['max_wait_ms']:.0f} ms max")
+        st.write(f"Granted {limiter_stats['granted']}, rejected {limiter_stats['rejected'] + limiter_stats['timeouts']}")
+        queue_stats = get_analysis_queue().stats()
+        st.markdown("**Background Analyses**")
+        st.write(f"Workers: {queue_stats['workers']}, queue: {queue_stats['queued']}/{queue_stats['max_queue']} waiting, {queue_stats['running']} running")
+        st.write(f"Done {queue_stats['completed']}, failed {queue_stats['failed']}, rejected {queue_stats['rejected']}")
+        st.write(f"Latency: {queue_stats['avg_wait_ms']:.0f} ms queued + {queue_stats['avg_run_ms']:.0f} ms running (p95 total {queue_stats['p95_total_ms']:.0f} ms)")
+        prefetch_stats = get_prefetcher().stats()
+        st.write(f"Prefetches: {prefetch_stats['started']} started, {prefetch_stats['superseded']} superseded, {prefetch_stats['skipped_busy'] + prefetch_stats['skipped_cap']} skipped")
+        metrics_config = get_config()
+        if metrics_config["metrics_port"]:
+            st.write(f"Metrics: http://{metrics_config['metrics_host']}:{metrics_config['metrics_port']}/metrics")
+        st.download_button("⬇️ Download metrics", get_metrics_registry().render(), file_name="nutrimind.prom", mime="text/plain")
 
 # ========== MAIN APP ==========
 if st.session_state.user is None:
@@ -1305,7 +1342,7 @@ else:
                     with st.container():
                         st.markdown(f"""
                         <div class="food-log-item">
-                            <strong>🍽️ {log.get('food_name', 'Food')}</strong><br>
+                            <strong>🍽️ {log.get('food_name', 'Food')}{' ⏱️ estimate' if log.get('provisional') else ''}</strong><br>
                             <small>🔥 {log.get('calories', 0)} cal | 💪🏼 {log.get('protein', 0)}g protein</small><br>
                             <em>💡 {log.get('insight', '')}</em><br>
                             <small style="color: #BBF7D0;">📅 {log.get('date', 'Today')} {log.get('time', '')}</small>
@@ -1355,36 +1392,46 @@ else:
             )
             
             if uploaded_image is not None:
-                image = Image.open(uploaded_image)
+                # Decoded once per upload; reruns reuse the details and the small display copy
+                upload_cache = get_upload_cache()
+                image_info = upload_cache.info(uploaded_image.file_id, uploaded_image.getvalue)
                 col1, col2 = st.columns([1, 2])
                 with col1:
-                    st.image(image, caption="Your Food Image", width=250)
+                    st.image(upload_cache.thumbnail(uploaded_image.file_id, uploaded_image.getvalue, 250), caption="Your Food Image", width=250)
                 with col2:
                     st.markdown("**Image Details:**")
-                    st.write(f"Format: {image.format}")
-                    st.write(f"Size: {image.size[0]}x{image.size[1]} pixels")
-                    st.write(f"Mode: {image.mode}")
+                    st.write(f"Format: {image_info['format']}")
+                    st.write(f"Size: {image_info['size'][0]}x{image_info['size'][1]} pixels")
+                    st.write(f"Mode: {image_info['mode']}")
                 
                 if st.button("Analyze with AI 🔍", type="primary", use_container_width=True):
-                    # Use the PROPER food analysis function
-                    nutrition = analyze_food_with_gemini("uploaded food image", image)
-                    nutrition['scan_type'] = "Image"
-                    
-                    # Store for saving
-                    st.session_state.current_analyzed_food = nutrition
-                    
-                    st.markdown(f"### 🍽️ {nutrition['food_name']}")
-                    nutri_cols = st.columns(4)
-                    with nutri_cols[0]:
-                        st.metric("Calories", nutrition['calories'])
-                    with nutri_cols[1]:
-                        st.metric("Protein", f"{nutrition['protein']}g")
-                    with nutri_cols[2]:
-                        st.metric("Carbs", f"{nutrition['carbs']}g")
-                    with nutri_cols[3]:
-                        st.metric("Fats", f"{nutrition['fats']}g")
-                    
-                    st.info(f"💡 **Insight:** {nutrition['insight']}")
+                    image = upload_cache.image(uploaded_image.file_id, uploaded_image.getvalue)
+                    upload_cache.release_image(uploaded_image.file_id)
+                    if st.session_state.get('background_ai'):
+                        queue_analysis(
+                            f"Photo {uploaded_image.name}", "Image",
+                            run_food_analysis, "uploaded food image", st.session_state.session_id, image, uploaded_image.getvalue()
+                        )
+                    else:
+                        # Use the PROPER food analysis function
+                        nutrition = analyze_food_with_gemini("uploaded food image", image, uploaded_image.getvalue())
+                        nutrition['scan_type'] = "Image"
+                        
+                        # Store for saving
+                        st.session_state.current_analyzed_food = nutrition
+                        
+                        st.markdown(f"### 🍽️ {nutrition['food_name']}")
+                        nutri_cols = st.columns(4)
+                        with nutri_cols[0]:
+                            st.metric("Calories", nutrition['calories'])
+                        with nutri_cols[1]:
+                            st.metric("Protein", f"{nutrition['protein']}g")
+                        with nutri_cols[2]:
+                            st.metric("Carbs", f"{nutrition['carbs']}g")
+                        with nutri_cols[3]:
+                            st.metric("Fats", f"{nutrition['fats']}g")
+                        
+                        st.info(f"💡 **Insight:** {nutrition['insight']}")
             
             # Save button
             if st.session_state.current_analyzed_food:
@@ -1408,6 +1455,7 @@ else:
                 for key in ['calories', 'protein', 'carbs', 'fats']:
                     if key in adjusted_nutrition:
                         adjusted_nutrition[key] = int(adjusted_nutrition[key] * multiplier)
+                adjusted_nutrition['portion_multiplier'] = multiplier
                 
                 st.info(f"**{portion} Portion:** {adjusted_nutrition['calories']} calories, {adjusted_nutrition['protein']}g protein")
                 
@@ -1433,14 +1481,16 @@ else:
             )
             
             if uploaded_label is not None:
-                label_image = Image.open(uploaded_label)
-                st.image(label_image, caption="Food Label", width=300)
+                upload_cache = get_upload_cache()
+                st.image(upload_cache.thumbnail(uploaded_label.file_id, uploaded_label.getvalue, 300), caption="Food Label", width=300)
                 
                 if st.button("Extract Nutrition Facts", type="primary"):
                     with st.spinner("📊 Extracting nutrition facts from label..."):
                         time.sleep(2)
                         
-                        label_nutrition = analyze_food_with_gemini("nutrition label", label_image)
+                        label_image = upload_cache.image(uploaded_label.file_id, uploaded_label.getvalue)
+                        upload_cache.release_image(uploaded_label.file_id)
+                        label_nutrition = analyze_food_with_gemini("nutrition label", label_image, uploaded_label.getvalue())
                         label_nutrition['scan_type'] = "Label"
                         
                         st.session_state.current_analyzed_food = label_nutrition
@@ -1475,9 +1525,26 @@ else:
             food_input = st.text_input(
                 "Enter food name:",
                 placeholder="e.g., Masala Dosa, Butter Chicken, Apple, Chapati...",
-                key="manual_food_input"
+                key="manual_food_input",
+                on_change=schedule_prefetch
             )
             
+            # Typo-tolerant suggestions from the food database resolve without an API call
+            suggestions = search_foods(food_input, limit=4) if food_input and not is_meal_description(food_input) else []
+            if suggestions:
+                st.caption("📚 From our food database (no AI needed):")
+                suggestion_cols = st.columns(len(suggestions))
+                for col, suggestion in zip(suggestion_cols, suggestions):
+                    with col:
+                        st.button(
+                            f"{suggestion['food_name']} · {suggestion['calories']} kcal",
+                            key=f"suggest_{suggestion['key']}",
+                            help=f"Matched \"{suggestion['matched']}\"",
+                            on_click=use_food_suggestion,
+                            args=(suggestion['key'],),
+                            use_container_width=True
+                        )
+            
             # Quick log buttons
             st.markdown("### Quick Log Common Foods")
             quick_foods = ["Banana", "Apple", "Chapati", "Rice Bowl", "Egg", "Milk", "Curd", "Poha"]
@@ -1496,25 +1563,40 @@ else:
             
             if food_input:
                 if st.button("Analyze with AI 🔍", type="primary", use_container_width=True):
-                    with st.spinner(f"Analyzing {food_input}..."):
-                        # Use food analysis function
-                        nutrition = analyze_food_with_gemini(food_input)
-                        nutrition['scan_type'] = "Manual"
-                        
-                        st.session_state.current_analyzed_food = nutrition
-                        
-                        st.markdown(f"### 🍽️ {nutrition['food_name']}")
-                        nutri_cols = st.columns(4)
-                        with nutri_cols[0]:
-                            st.metric("Calories", nutrition['calories'])
-                        with nutri_cols[1]:
-                            st.metric("Protein", f"{nutrition['protein']}g")
-                        with nutri_cols[2]:
-                            st.metric("Carbs", f"{nutrition['carbs']}g")
-                        with nutri_cols[3]:
-                            st.metric("Fats", f"{nutrition['fats']}g")
-                        
-                        st.info(f"💡 **Insight:** {nutrition['insight']}")
+                    if st.session_state.get('background_ai'):
+                        job = run_meal_analysis if is_meal_description(food_input) else run_food_analysis
+                        queue_analysis(food_input, "Manual", job, food_input, st.session_state.session_id)
+                    else:
+                        with st.spinner(f"Analyzing {food_input}..."):
+                            # Meals like "2 chapati, dal and rice" are split and batched
+                            if is_meal_description(food_input):
+                                nutrition = analyze_meal_with_gemini(food_input)
+                            else:
+                                nutrition = analyze_food_with_gemini(food_input)
+                            nutrition['scan_type'] = "Manual"
+                            
+                            st.session_state.current_analyzed_food = nutrition
+                            
+                            st.markdown(f"### 🍽️ {nutrition['food_name']}")
+                            nutri_cols = st.columns(4)
+                            with nutri_cols[0]:
+                                st.metric("Calories", nutrition['calories'])
+                            with nutri_cols[1]:
+                                st.metric("Protein", f"{nutrition['protein']}g")
+                            with nutri_cols[2]:
+                                st.metric("Carbs", f"{nutrition['carbs']}g")
+                            with nutri_cols[3]:
+                                st.metric("Fats", f"{nutrition['fats']}g")
+                            
+                            st.info(f"💡 **Insight:** {nutrition['insight']}")
+                            
+                            if nutrition.get('items'):
+                                items_df = pd.DataFrame(nutrition['items'])
+                                st.dataframe(
+                                    items_df[['quantity', 'food_name', 'calories', 'protein', 'carbs', 'fats', 'source']],
+                                    hide_index=True,
+                                    use_container_width=True
+                                )
                 
                 # Save button
                 if st.session_state.current_analyzed_food:
@@ -1538,6 +1620,7 @@ else:
                     for key in ['calories', 'protein', 'carbs', 'fats']:
                         if key in adjusted_nutrition:
                             adjusted_nutrition[key] = int(adjusted_nutrition[key] * multiplier)
+                    adjusted_nutrition['portion_multiplier'] = multiplier
                     
                     st.info(f"**{portion} Portion:** {adjusted_nutrition['calories']} calories, {adjusted_nutrition['protein']}g protein")
                     
@@ -1549,6 +1632,18 @@ else:
                             st.rerun()
             
             st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Provisional estimates are upgraded in place when their AI result arrives
+        if st.session_state.provisional_jobs:
+            poll_provisional_results()
+        
+        # Results of analyses queued in the background
+        if st.session_state.analysis_jobs:
+            st.divider()
+            if get_analysis_queue().pending(st.session_state.session_id):
+                poll_background_analyses()
+            else:
+                show_background_analyses()
     
     with tab3:
         # ========== EXERCISE TRACKER ==========
@@ -0,0 +1,103 @@
+# benchmarks/fallback_benchmark.py
+"""
+Compare the legacy fallback-database scan with the compiled FoodMatcher.
+
+The legacy lookup tested `key in food_name` for every key in insertion
+order and returned the first hit; FoodMatcher walks the name once and
+returns the longest whole-word key. The database is padded with
+synthetic dish names to show how both scale:
+
+    python -m benchmarks.fallback_benchmark [--sizes 45,1000,5000,20000] [--lookups 2000]
+
+For each size it reports the automaton build time, the time per lookup
+and how often the two disagree (the legacy scan picking a shorter key,
+or a key inside another word).
+"""
+import argparse
+import random
+import time
+
+from food_database import FOOD_DB, FoodMatcher
+
+QUERIES = [
+    "masala dosa", "2 idli with sambar", "vegetable fried rice", "rice bowl", "chicken salad",
+    "butter chicken", "paneer butter masala", "dal tadka", "aloo paratha", "banana smoothie",
+    "protein shake", "grilled fish", "egg curry", "quinoa salad", "greek yogurt", "pav bhaji",
+]
+
+SYLLABLES = ["al", "ba", "chi", "da", "ka", "la", "ma", "na", "pa", "ra", "sa", "ta", "va", "ya", "ko", "mu"]
+
+
+def legacy_scan(database, food_lower):
+    """The pre-index lookup: first key (in insertion order) contained in the name."""
+    for key in database:
+        if key in food_lower:
+            return key
+    return None
+
+
+def synthetic_database(size, rng):
+    """FOOD_DB keys padded with made-up one- and two-word dish names up to size entries."""
+    database = dict.fromkeys(FOOD_DB)
+    while len(database) < size:
+        words = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 2))]
+        database[" ".join(words)] = None
+    return database
+
+
+def synthetic_queries(database, count, rng):
+    """Mix of QUERIES and names built around random database keys."""
+    keys = list(database)
+    queries = []
+    for index in range(count):
+        if index % 2:
+            queries.append(rng.choice(QUERIES))
+        else:
+            queries.append(f"{rng.choice(['spicy', 'home made', '1 plate', 'leftover'])} {rng.choice(keys)} curry")
+    return queries
+
+
+def bench(size, lookups, seed):
+    rng = random.Random(seed)
+    database = synthetic_database(size, rng)
+    queries = synthetic_queries(database, lookups, rng)
+
+    started = time.perf_counter()
+    matcher = FoodMatcher(database)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    legacy = [legacy_scan(database, query) for query in queries]
+    legacy_us = (time.perf_counter() - started) / len(queries) * 1e6
+
+    started = time.perf_counter()
+    compiled = [matcher.find(query) for query in queries]
+    compiled_us = (time.perf_counter() - started) / len(queries) * 1e6
+
+    disagreements = sum(old != new for old, new in zip(legacy, compiled))
+    return {
+        "entries": len(database),
+        "build_ms": build_ms,
+        "legacy_us": legacy_us,
+        "compiled_us": compiled_us,
+        "disagreements": disagreements / len(queries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Legacy fallback scan vs compiled FoodMatcher")
+    parser.add_argument("--sizes", default=f"{len(FOOD_DB)},1000,5000,20000", help="comma-separated database sizes")
+    parser.add_argument("--lookups", type=int, default=2000, help="lookups timed per size")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} {'build':>10} {'legacy':>12} {'compiled':>12} {'speedup':>8} {'differ':>7}")
+    for size in (int(value) for value in args.sizes.split(",")):
+        row = bench(size, args.lookups, args.seed)
+        print(f"{row['entries']:>8} {row['build_ms']:>8.1f}ms {row['legacy_us']:>10.1f}us "
+              f"{row['compiled_us']:>10.1f}us {row['legacy_us'] / row['compiled_us']:>7.1f}x "
+              f"{row['disagreements']:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# benchmarks/food_store_benchmark.py
+"""
+Compare the memory-mapped food store with an in-memory dict of dicts.
+
+Builds a synthetic catalog (default 5000 foods x 40 nutrients) with
+food_store.build_food_store in a temporary directory, then times:
+
+    open      opening the store vs parsing the CSV into dicts
+    lookup    resolving names one at a time, and as one lookup_many() call
+    scale     all nutrients of every looked-up food at a given portion
+
+    python -m benchmarks.food_store_benchmark [--foods 5000] [--nutrients 40] [--lookups 2000]
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+from food_store import FoodStore, build_food_store
+from nutrition_parser import NUTRIENT_FIELDS
+
+
+def write_catalog(path, foods, nutrients, rng):
+    columns = list(NUTRIENT_FIELDS) + [f"nutrient_{index}" for index in range(nutrients - len(NUTRIENT_FIELDS))]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "portion_g"] + columns)
+        for index in range(foods):
+            writer.writerow([f"food {index}", rng.choice([30, 50, 100, 150, 250])]
+                            + [round(rng.uniform(0, 400), 2) for _ in columns])
+    return columns
+
+
+def load_dicts(path):
+    """The dict-of-dicts alternative: every process parses and holds the whole catalog."""
+    with open(path, newline="") as f:
+        return {row["name"]: {name: float(value) for name, value in row.items() if name != "name"}
+                for row in csv.DictReader(f)}
+
+
+def timed(fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped food store vs dict of dicts")
+    parser.add_argument("--foods", type=int, default=5000)
+    parser.add_argument("--nutrients", type=int, default=40)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "catalog.csv")
+        columns = write_catalog(csv_path, args.foods, max(args.nutrients, len(NUTRIENT_FIELDS)), rng)
+        store_path = os.path.join(temp_dir, "store")
+        build_seconds, _ = timed(lambda: build_food_store([csv_path], store_path))
+
+        open_store, store = timed(lambda: FoodStore(store_path), repeat=20)
+        open_dicts, catalog = timed(lambda: load_dicts(csv_path), repeat=3)
+        names = [f"food {rng.randrange(args.foods)}" for _ in range(args.lookups)]
+        grams = [rng.choice([50, 100, 200]) for _ in names]
+
+        lookup_dicts, _ = timed(lambda: [catalog[name] for name in names])
+        lookup_store, _ = timed(lambda: [store.lookup(name) for name in names])
+        lookup_many, rows = timed(lambda: store.lookup_many(names))
+
+        def scale_dicts():
+            return [{column: catalog[name][column] * gram / 100 for column in columns} for name, gram in zip(names, grams)]
+
+        scale_loop, _ = timed(scale_dicts)
+        scale_store, _ = timed(lambda: store.scale(rows, grams))
+
+        store_bytes = sum(os.path.getsize(os.path.join(store_path, name)) for name in os.listdir(store_path))
+        print(f"catalog  {args.foods} foods x {len(columns)} nutrients; store {store_bytes / 1e6:.1f} MB "
+              f"on disk (shared via page cache), built in {build_seconds:.2f}s")
+        print(f"open     store {open_store * 1000:.2f} ms   dicts {open_dicts * 1000:.1f} ms")
+        print(f"lookup   dict {lookup_dicts / len(names) * 1e6:.2f} us/name   store {lookup_store / len(names) * 1e6:.2f} "
+              f"us/name   lookup_many {lookup_many / len(names) * 1e6:.2f} us/name")
+        print(f"scale    dict loop {scale_loop * 1000:.1f} ms   vectorized {scale_store * 1000:.2f} ms "
+              f"for {len(names)} foods")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# benchmarks/load_test.py
+"""
+End-to-end latency benchmark for the analysis pipeline.
+
+Simulates N concurrent users, each running analyses back to back through
+the same code as the "Analyze with AI" button (analysis_service) or
+through gemini_service.analyze_food_text, against the local Gemini mock
+(started in-process) or any --base-url. Reports p50/p95/p99 latency,
+throughput and fallback rate.
+
+    python -m benchmarks.load_test --users 16 --requests 25 --error-429 0.05
+    python -m benchmarks.load_test --mode image --users 4 --stream
+    python -m benchmarks.load_test --unique --jitter 0.8 --hedge
+"""
+import argparse
+import io
+import json
+import os
+import random
+import threading
+import time
+
+from benchmarks.mock_gemini import add_mock_arguments, settings_from_args, start_mock_server
+
+FOODS = [
+    "dal tadka", "masala dosa", "chicken biryani", "paneer tikka", "aloo gobi", "rajma chawal",
+    "chole bhature", "idli sambar", "poha", "upma", "butter chicken", "palak paneer",
+    "vegetable pulao", "egg curry", "fish curry", "pav bhaji", "vada pav", "misal pav",
+    "dhokla", "khichdi", "quinoa salad", "greek yogurt", "avocado toast", "oatmeal",
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def noise_jpeg(edge, rng):
+    """A random-noise JPEG, so every upload misses the exact and perceptual caches."""
+    from PIL import Image
+    image = Image.frombytes("RGB", (edge, edge), rng.randbytes(edge * edge * 3))
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+
+def configure(args, base_url):
+    """Point the app's configuration at the target before any client is built."""
+    os.environ["GEMINI_API_BASE"] = base_url
+    os.environ["GEMINI_API_KEY"] = args.api_key or os.environ.get("GEMINI_API_KEY") or "mock-key"
+    os.environ["GEMINI_REQUESTS_PER_MINUTE"] = str(args.rpm)
+    os.environ["GEMINI_POOL_SIZE"] = str(max(1, args.users))
+    os.environ["GEMINI_HEDGE"] = "1" if args.hedge else "0"
+    # Keep the benchmark out of the real on-disk cache
+    os.environ["CACHE_DB_PATH"] = ":memory:"
+
+    from config_service import reload_config
+    reload_config()
+
+
+def make_request(args, user, index, rng):
+    """Build one zero-argument analysis call and a label for it."""
+    from analysis_service import run_food_analysis, run_meal_analysis
+
+    session_id = f"bench-user-{user}"
+    food = rng.choice(FOODS)
+    if args.unique:
+        food = f"{food} {user} {index}"
+    mode = rng.choice(["text", "meal", "image"]) if args.mode == "mixed" else args.mode
+    on_partial = (lambda fields: None) if args.stream else None
+
+    if args.target == "service":
+        from gemini_service import analyze_food_text
+        return lambda: {"source": "unknown", "nutrition": analyze_food_text(food)}
+    if mode == "meal":
+        meal = f"2 {food}, {rng.choice(FOODS)} and {rng.choice(FOODS)}"
+        return lambda: run_meal_analysis(meal, session_id)
+    if mode == "image":
+        image_bytes = noise_jpeg(args.image_edge, rng)
+        return lambda: run_food_analysis("uploaded food image", session_id, image_bytes=image_bytes, on_partial=on_partial)
+    return lambda: run_food_analysis(food, session_id, on_partial=on_partial)
+
+
+def is_fallback(outcome):
+    """True when the user got database estimates instead of an AI (or cached AI) answer."""
+    if outcome["source"] == "meal":
+        return any(item.get("source") == "fallback" for item in outcome["nutrition"].get("items", []))
+    return outcome["source"] == "fallback"
+
+
+def run_user(args, user, results, lock):
+    rng = random.Random(args.seed * 1000 + user if args.seed is not None else None)
+    for index in range(args.requests):
+        call = make_request(args, user, index, rng)
+        started = time.perf_counter()
+        try:
+            outcome = call()
+            error = None
+        except Exception as e:
+            outcome, error = {"source": "error"}, str(e)[:200]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            results.append({
+                "user": user,
+                "latency_ms": elapsed_ms,
+                "source": outcome["source"],
+                "fallback": outcome["source"] != "error" and outcome["source"] != "unknown" and is_fallback(outcome),
+                "error": error,
+            })
+        if args.think_ms:
+            time.sleep(args.think_ms / 1000)
+
+
+def summarize(results, wall_seconds):
+    latencies = sorted(result["latency_ms"] for result in results)
+    sources = {}
+    for result in results:
+        sources[result["source"]] = sources.get(result["source"], 0) + 1
+    known = [result for result in results if result["source"] not in ("unknown", "error")]
+    return {
+        "requests": len(results),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(results) / wall_seconds if wall_seconds else 0.0,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1] if latencies else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+        "fallback_rate": sum(result["fallback"] for result in known) / len(known) if known else None,
+        "errors": sum(1 for result in results if result["error"]),
+        "sources": sources,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent end-to-end analysis benchmark")
+    parser.add_argument("--users", type=int, default=8, help="concurrent simulated users")
+    parser.add_argument("--requests", type=int, default=20, help="analyses per user")
+    parser.add_argument("--mode", choices=["text", "meal", "image", "mixed"], default="text")
+    parser.add_argument("--target", choices=["app", "service"], default="app",
+                        help="app: analysis_service pipeline; service: gemini_service.analyze_food_text")
+    parser.add_argument("--stream", action="store_true", help="use streamGenerateContent")
+    parser.add_argument("--unique", action="store_true", help="make every food name unique (no cache hits)")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pause between a user's analyses")
+    parser.add_argument("--image-edge", type=int, default=1200, help="edge of generated test photos, px")
+    parser.add_argument("--hedge", action="store_true", help="enable hedged requests (GEMINI_HEDGE)")
+    parser.add_argument("--rpm", type=int, default=100000, help="requests per minute allowed by the rate limiter")
+    parser.add_argument("--base-url", help="benchmark this endpoint instead of an in-process mock")
+    parser.add_argument("--api-key", help="key sent to --base-url (defaults to GEMINI_API_KEY)")
+    parser.add_argument("--json", help="write the full report to this file")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server = start_mock_server(**settings_from_args(args))
+        base_url = server.base_url
+    configure(args, base_url)
+
+    results, lock = [], threading.Lock()
+    threads = [threading.Thread(target=run_user, args=(args, user, results, lock)) for user in range(args.users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+
+    from gemini_client import get_gemini_client
+    from model_router import get_model_router
+    from resilience import get_circuit_breaker, get_hedger, get_rate_limiter, get_single_flight
+    report = {
+        "config": {name: value for name, value in vars(args).items() if name not in ("api_key",)},
+        "base_url": base_url,
+        "summary": summarize(results, wall_seconds),
+        "client": get_gemini_client().stats(),
+        "rate_limiter": get_rate_limiter().stats(),
+        "circuit_breaker": get_circuit_breaker().stats(),
+        "single_flight": get_single_flight().stats(),
+        "hedger": get_hedger().stats(),
+        "models": get_model_router().stats(),
+        "mock": server.stats() if server else None,
+    }
+    if server:
+        server.shutdown()
+
+    summary = report["summary"]
+    fallback = "n/a" if summary["fallback_rate"] is None else f"{summary['fallback_rate']:.1%}"
+    print(f"{summary['requests']} analyses by {args.users} users in {wall_seconds:.1f}s "
+          f"({summary['throughput_rps']:.1f}/s) against {base_url}")
+    print(f"latency  p50 {summary['p50_ms']:.0f} ms  p95 {summary['p95_ms']:.0f} ms  "
+          f"p99 {summary['p99_ms']:.0f} ms  max {summary['max_ms']:.0f} ms")
+    print(f"fallback {fallback}  errors {summary['errors']}  sources {summary['sources']}")
+    print(f"gemini   {report['client']['requests']} requests, {report['client']['retries']} retries, "
+          f"{report['client']['new_connections']} new connections; breaker {report['circuit_breaker']['state']}")
+    if args.hedge:
+        print(f"hedged   {report['hedger']['hedged']} of {report['hedger']['calls']} calls, "
+              f"{report['hedger']['hedge_wins']} answered first")
+    if server:
+        print(f"mock     {report['mock']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# benchmarks/mock_gemini.py
+"""
+Local stand-in for the Gemini generateContent REST endpoints.
+
+Serves POST .../models/<model>:generateContent and :streamGenerateContent
+(?alt=sse) with configurable latency, error rates, malformed bodies and
+response sizes, so the analysis pipeline can be load-tested without
+spending quota. Point the app at it with
+
+    python -m benchmarks.mock_gemini --port 8765 --latency-ms 400 --error-429 0.02
+    GEMINI_API_BASE=http://127.0.0.1:8765/v1beta GEMINI_API_KEY=mock streamlit run app.py
+
+GET /stats returns request counters as JSON; GET /v1beta/models lists MOCK_MODELS.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SETTINGS = {
+    "latency_ms": 400.0,
+    # "fixed", "uniform" (latency_ms +/- jitter) or "lognormal" (median latency_ms, sigma jitter)
+    "latency_dist": "lognormal",
+    "jitter": 0.5,
+    "error_403": 0.0,
+    "error_429": 0.0,
+    "error_500": 0.0,
+    "retry_after": None,
+    "malformed": 0.0,
+    "pad_bytes": 0,
+    "chunk_chars": 24,
+    # Comma-separated models that always answer 429, to exercise model failover
+    "exhausted_models": "",
+    "seed": None,
+}
+
+FOOD_PROMPT = re.compile(r"Analyze this food:\s*(.+)")
+MEAL_ITEM = re.compile(r"^\s*\d+\.\s*(.+)$", re.MULTILINE)
+# Answered by GET /v1beta/models (any model name is accepted for generateContent)
+MOCK_MODELS = ("gemini-2.5-flash-lite", "gemini-2.5-flash", "gemini-2.0-flash")
+MODEL_PATH = re.compile(r"/models/([^:/?]+):")
+
+
+def sample_latency(settings, rng):
+    """Seconds to wait before answering, drawn from the configured distribution."""
+    latency = settings["latency_ms"] / 1000
+    if settings["latency_dist"] == "uniform":
+        spread = latency * settings["jitter"]
+        return max(0.0, rng.uniform(latency - spread, latency + spread))
+    if settings["latency_dist"] == "lognormal":
+        return latency * rng.lognormvariate(0, settings["jitter"])
+    return latency
+
+
+def fake_nutrition(name):
+    """Deterministic, internally consistent nutrition for a food name."""
+    digest = hashlib.sha256(name.lower().encode()).digest()
+    protein, carbs, fats = 2 + digest[0] % 30, 5 + digest[1] % 60, 1 + digest[2] % 25
+    return {
+        "food_name": name.strip().title()[:60],
+        "calories": 4 * protein + 4 * carbs + 9 * fats,
+        "protein": protein,
+        "carbs": carbs,
+        "fats": fats,
+        "insight": f"Mock analysis of {name.strip()[:40]}",
+    }
+
+
+def answer_text(payload):
+    """JSON text Gemini would return for this request (object, or array for meals)."""
+    parts = payload.get("contents", [{}])[0].get("parts", [])
+    prompt = " ".join(part.get("text", "") for part in parts)
+    if any("inline_data" in part for part in parts):
+        return json.dumps(fake_nutrition("Photographed Dish"))
+    items = MEAL_ITEM.findall(prompt)
+    if items:
+        return json.dumps([fake_nutrition(item) for item in items])
+    match = FOOD_PROMPT.search(prompt)
+    return json.dumps(fake_nutrition(match.group(1).splitlines()[0] if match else "Food Item"))
+
+
+def response_body(text, pad_bytes=0):
+    """generateContent response wrapping text, optionally padded to a larger size."""
+    body = {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": 100, "candidatesTokenCount": len(text) // 4},
+        "modelVersion": "mock",
+    }
+    if pad_bytes:
+        body["padding"] = "x" * pad_bytes
+    return body
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockGemini/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode() if not isinstance(body, bytes) else body
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/stats":
+            self._send_json(200, self.server.stats())
+        elif path.endswith("/models"):
+            self._send_json(200, {"models": [{
+                "name": f"models/{name}",
+                "displayName": f"{name} (mock)",
+                "inputTokenLimit": 1048576,
+                "outputTokenLimit": 65536,
+                "supportedGenerationMethods": ["generateContent", "streamGenerateContent"],
+            } for name in MOCK_MODELS]})
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        settings, rng = self.server.settings, self.server.rng
+        streaming = ":streamGenerateContent" in self.path
+
+        with self.server.lock:
+            roll = rng.random()
+            delay = sample_latency(settings, rng)
+            malformed = rng.random() < settings["malformed"]
+            malformed_kind = rng.choice(["body", "text"])
+        self.server.count("requests", request_bytes=len(raw))
+
+        if ":generateContent" not in self.path and not streaming:
+            self._send_json(404, {"error": {"code": 404, "message": "Unknown method"}})
+            return
+        if not (self.headers.get("x-goog-api-key") or "key=" in self.path):
+            self.server.count("status_403")
+            self._send_json(403, {"error": {"code": 403, "message": "API key missing"}})
+            return
+
+        model = MODEL_PATH.search(self.path)
+        exhausted = [name.strip() for name in settings["exhausted_models"].split(",") if name.strip()]
+        if model and model.group(1) in exhausted:
+            self.server.count("status_429")
+            self._send_json(429, {"error": {"code": 429, "message": f"Quota exhausted for {model.group(1)}"}},
+                            {"Retry-After": "60"})
+            return
+
+        for status in (403, 429, 500):
+            roll -= settings[f"error_{status}"]
+            if roll < 0:
+                time.sleep(delay / 4)
+                self.server.count(f"status_{status}")
+                headers = {"Retry-After": str(settings["retry_after"])} if status == 429 and settings["retry_after"] else None
+                self._send_json(status, {"error": {"code": status, "message": "Mock error"}}, headers)
+                return
+
+        try:
+            payload = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON payload"}})
+            return
+
+        text = answer_text(payload)
+        if malformed:
+            self.server.count("malformed")
+            if malformed_kind == "text":
+                text = text[: len(text) // 2] + " ...sorry, I could not finish"
+
+        if streaming and "alt=sse" in self.path:
+            self._stream(text, delay, truncate=malformed and malformed_kind == "body")
+            return
+
+        time.sleep(delay)
+        body = response_body(text, settings["pad_bytes"])
+        if streaming:
+            body = [body]
+        data = json.dumps(body).encode()
+        if malformed and malformed_kind == "body":
+            data = data[: len(data) // 2]
+        self.server.count("status_200")
+        self._send_json(200, data)
+
+    def _stream(self, text, delay, truncate=False):
+        """Server-sent events: first chunk after ~1/3 of the latency, the rest spread evenly."""
+        chunk_chars = max(1, self.server.settings["chunk_chars"])
+        chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(delay / 3)
+        gap = (delay * 2 / 3) / len(chunks)
+        try:
+            for index, chunk in enumerate(chunks):
+                event = ("data: " + json.dumps(response_body(chunk)) + "\r\n\r\n").encode()
+                if truncate and index == len(chunks) // 2:
+                    event = event[: len(event) // 2]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+                self.wfile.flush()
+                if truncate and index == len(chunks) // 2:
+                    break
+                time.sleep(gap)
+            self.wfile.write(b"0\r\n\r\n")
+            self.server.count("status_200")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stops reading once it has every field it needs
+            self.server.count("cancelled_streams")
+
+
+class MockGeminiServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the mock settings and counters."""
+
+    daemon_threads = True
+
+    def __init__(self, address, settings=None):
+        super().__init__(address, MockGeminiHandler)
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.rng = random.Random(self.settings["seed"])
+        self.lock = threading.Lock()
+        self._stats = {"requests": 0, "request_bytes": 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def count(self, name, request_bytes=0):
+        with self.lock:
+            self._stats[name] = self._stats.get(name, 0) + 1
+            self._stats["request_bytes"] += request_bytes
+
+    def stats(self):
+        with self.lock:
+            return dict(self._stats)
+
+
+def start_mock_server(host="127.0.0.1", port=0, **settings):
+    """
+    Run the mock on a background thread.
+
+    Args:
+        host (str): Interface to bind.
+        port (int): Port, 0 for any free port.
+        **settings: Overrides for DEFAULT_SETTINGS.
+
+    Returns:
+        MockGeminiServer: Running server; use .base_url and .shutdown().
+    """
+    server = MockGeminiServer((host, port), settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_mock_arguments(parser):
+    """Add the mock's behaviour flags to an argparse parser (shared with the load test)."""
+    group = parser.add_argument_group("mock server")
+    group.add_argument("--latency-ms", type=float, default=DEFAULT_SETTINGS["latency_ms"])
+    group.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default=DEFAULT_SETTINGS["latency_dist"])
+    group.add_argument("--jitter", type=float, default=DEFAULT_SETTINGS["jitter"],
+                       help="uniform: +/- fraction of latency; lognormal: sigma")
+    group.add_argument("--error-403", type=float, default=0.0, help="fraction of requests answered 403")
+    group.add_argument("--error-429", type=float, default=0.0, help="fraction of requests answered 429")
+    group.add_argument("--error-500", type=float, default=0.0, help="fraction of requests answered 500")
+    group.add_argument("--retry-after", type=int, default=None, help="Retry-After seconds sent with 429s")
+    group.add_argument("--malformed", type=float, default=0.0, help="fraction of truncated or non-JSON replies")
+    group.add_argument("--pad-bytes", type=int, default=0, help="extra bytes added to every response body")
+    group.add_argument("--chunk-chars", type=int, default=DEFAULT_SETTINGS["chunk_chars"], help="characters per streamed chunk")
+    group.add_argument("--exhausted-models", default="", help="comma-separated models that always answer 429")
+    group.add_argument("--seed", type=int, default=None)
+
+
+def settings_from_args(args):
+    """Mock settings dict from parsed add_mock_arguments() flags."""
+    return {name: getattr(args, name) for name in DEFAULT_SETTINGS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Gemini generateContent stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockGeminiServer((args.host, args.port), settings_from_args(args))
+    print(f"Mock Gemini listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
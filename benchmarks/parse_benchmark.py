@@ -0,0 +1,116 @@
+# benchmarks/parse_benchmark.py
+"""
+Compare the legacy regex parse of Gemini replies with the schema-constrained
+strict parse in nutrition_parser.
+
+Run from the project root:
+
+    python -m benchmarks.parse_benchmark [--iterations 20000]
+
+For each kind of reply it reports the time per parse, how often the reply
+was accepted, and how often an implausible record got through.
+"""
+import argparse
+import json
+import re
+import time
+
+from nutrition_parser import NutritionValidationError, parse_nutrition_json
+
+GOOD = {"food_name": "Dal Tadka", "calories": 150, "protein": 9, "carbs": 22, "fats": 4,
+        "insight": "Good source of plant protein"}
+
+# (kind, reply text, is the record plausible?)
+CORPUS = [
+    ("schema_json", json.dumps(GOOD), True),
+    ("schema_json_float", json.dumps(dict(GOOD, protein=9.5, fats=4.2)), True),
+    ("fenced", "```json\n" + json.dumps(GOOD, indent=4) + "\n```", True),
+    ("trailing_prose", json.dumps(GOOD) + "\n\nNote: values are approximate.", True),
+    ("string_numbers", json.dumps({k: str(v) for k, v in GOOD.items()}), True),
+    ("truncated", json.dumps(GOOD)[:60], False),
+    ("missing_macros", json.dumps({"food_name": "Dal Tadka", "calories": 150}), False),
+    ("all_zero", json.dumps(dict(GOOD, calories=0, protein=0, carbs=0, fats=0)), False),
+    ("zero_macros", json.dumps(dict(GOOD, protein=0, carbs=0, fats=0)), False),
+    ("absurd_calories", json.dumps(dict(GOOD, calories=45000)), False),
+    ("negative", json.dumps(dict(GOOD, fats=-4)), False),
+    ("prose_only", "I'm sorry, I can't identify that food.", False),
+]
+
+
+def legacy_parse(response_text):
+    """The pre-schema parse path from app.py: strip fences, regex, coerce, default to 0."""
+    response_text = response_text.strip()
+    if response_text.startswith("```json"):
+        response_text = response_text[7:]
+    if response_text.endswith("```"):
+        response_text = response_text[:-3]
+    response_text = response_text.strip()
+
+    json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+    if not json_match:
+        return None
+    try:
+        nutrition_data = json.loads(json_match.group())
+    except json.JSONDecodeError:
+        return None
+    if "food_name" not in nutrition_data:
+        return None
+    for field in ["calories", "protein", "carbs", "fats", "insight"]:
+        if field not in nutrition_data:
+            nutrition_data[field] = "Nutrition information provided by AI analysis" if field == "insight" else 0
+    for field in ["calories", "protein", "carbs", "fats"]:
+        try:
+            nutrition_data[field] = int(float(nutrition_data[field]))
+        except (TypeError, ValueError):
+            nutrition_data[field] = 0
+    return nutrition_data
+
+
+def schema_parse(response_text):
+    """The new path: one json.loads plus typed, range-checked validation."""
+    try:
+        return parse_nutrition_json(response_text).to_dict()
+    except NutritionValidationError:
+        return None
+
+
+def time_parser(parser, text, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        parser(text)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--iterations", type=int, default=20000, help="parses per reply kind")
+    args = arg_parser.parse_args()
+
+    print(f"{'reply':<18} {'plausible':>9} | {'legacy us':>9} {'accepted':>8} | {'schema us':>9} {'accepted':>8}")
+    totals = {"legacy": [0, 0, 0.0], "schema": [0, 0, 0.0]}
+    for kind, text, plausible in CORPUS:
+        row = [f"{kind:<18} {str(plausible):>9}"]
+        for name, parser in (("legacy", legacy_parse), ("schema", schema_parse)):
+            accepted = parser(text) is not None
+            micros = time_parser(parser, text, args.iterations)
+            totals[name][0] += accepted
+            totals[name][1] += accepted and not plausible
+            totals[name][2] += micros
+            row.append(f"{micros:>9.2f} {str(accepted):>8}")
+        print(" | ".join(row))
+
+    print()
+    for name, (accepted, bad, micros) in totals.items():
+        print(
+            f"{name}: mean {micros / len(CORPUS):.2f} us/parse, "
+            f"accepted {accepted}/{len(CORPUS)}, implausible accepted {bad}"
+        )
+
+    # With responseSchema the model only emits schema_json-style replies
+    micros = time_parser(schema_parse, CORPUS[0][1], args.iterations)
+    legacy_micros = time_parser(legacy_parse, CORPUS[0][1], args.iterations)
+    print(f"schema-constrained reply: legacy {legacy_micros:.2f} us, schema {micros:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
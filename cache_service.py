@@ -0,0 +1,566 @@
+# cache_service.py
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config_service import get_config
+
+# Disk cache lives next to the app so it survives Streamlit restarts
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+DEFAULT_DB_PATH = os.path.join(CACHE_DIR, "nutrimind_cache.db")
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+# Scan types served only from exact byte matches: two labels with the same layout
+# hash alike however different the printed numbers are
+EXACT_ONLY_SCOPES = {"nutrition label"}
+
+
+def normalize_food_name(food_name):
+    """
+    Normalize a food name so trivial variants share one cache key.
+
+    Args:
+        food_name (str): Raw text typed by the user.
+
+    Returns:
+        str: Lowercased name with punctuation removed and whitespace collapsed.
+    """
+    if not food_name:
+        return ""
+    name = food_name.lower()
+    name = re.sub(r"[^\w\s]", " ", name)
+    return " ".join(name.split())
+
+
+def image_digest(image_bytes):
+    """
+    Exact fingerprint of an uploaded file, computed before any decoding.
+
+    Args:
+        image_bytes (bytes): Raw bytes of the uploaded file.
+
+    Returns:
+        str: SHA-256 hex digest.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image, hash_size=8):
+    """
+    Difference hash (dHash) of an image.
+
+    Photos of the same dish or packaged product taken moments apart
+    differ in bytes but produce hashes only a few bits apart.
+
+    Args:
+        image (PIL.Image.Image): Decoded image.
+        hash_size (int): Hash edge length; the result has hash_size**2 bits.
+
+    Returns:
+        int: The perceptual hash as an integer.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size))
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two perceptual hashes."""
+    return bin(a ^ b).count("1")
+
+
+class AnalysisCache:
+    """
+    Two-tier cache for AI nutrition analyses.
+
+    Tier 1 is an in-process LRU (microsecond lookups, shared by every
+    Streamlit session in the process). Tier 2 is a SQLite table that
+    survives restarts. Both tiers honour the same TTL; each tier is
+    bounded by its own entry limit and evicts least recently used items.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, max_memory_entries=512,
+                 max_disk_entries=20000, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+        self._db = self._open_db()
+
+    def _open_db(self):
+        """Open the SQLite store, or return None to run memory-only."""
+        if not self.db_path:
+            return None
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS analyses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_analyses_accessed ON analyses(accessed_at)")
+            db.commit()
+            return db
+        except sqlite3.Error as e:
+            print(f"Analysis cache: disk tier disabled ({e})")
+            return None
+
+    def _is_expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key):
+        """
+        Look up a cached analysis.
+
+        Args:
+            key (str): Normalized cache key.
+
+        Returns:
+            dict or None: A copy of the cached nutrition data, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if not self._is_expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return dict(value)
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            value = self._get_from_disk(key, now)
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+
+            created_at, value = value
+            self._stats["disk_hits"] += 1
+            self._remember(key, created_at, value)
+            return dict(value)
+
+    def _get_from_disk(self, key, now):
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT value, created_at FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self._is_expired(row[1], now):
+                self._db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                self._db.commit()
+                self._stats["expired"] += 1
+                return None
+            self._db.execute("UPDATE analyses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return row[1], json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Analysis cache read error: {e}")
+            return None
+
+    def set(self, key, value):
+        """
+        Store an analysis in both tiers.
+
+        Args:
+            key (str): Normalized cache key.
+            value (dict): Nutrition data to cache.
+        """
+        if not key:
+            return
+        now = time.time()
+        value = dict(value)
+        with self._lock:
+            self._stats["writes"] += 1
+            self._remember(key, now, value)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analyses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now)
+                )
+                # Keep only the most recently used rows
+                cursor = self._db.execute(
+                    """DELETE FROM analyses WHERE key IN (
+                        SELECT key FROM analyses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )""",
+                    (self.max_disk_entries,)
+                )
+                self._stats["evictions"] += max(0, cursor.rowcount)
+                self._db.commit()
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                print(f"Analysis cache write error: {e}")
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM analyses")
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"Analysis cache clear error: {e}")
+
+    def stats(self):
+        """
+        Report cache effectiveness.
+
+        Returns:
+            dict: Hit/miss counters, hit rate and current size of each tier.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = 0
+            if self._db is not None:
+                try:
+                    stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+class ImageAnalysisCache:
+    """
+    Cache for photo and label analyses keyed by image fingerprints.
+
+    Lookups first try the exact byte digest (no decode needed), then fall
+    back to the nearest perceptual hash within max_distance bits (except
+    for EXACT_ONLY_SCOPES such as nutrition labels). Entries
+    are scoped ("uploaded food image" vs "nutrition label") because the
+    same picture yields different analyses per scan type. Memory and disk
+    tiers are each bounded by a byte budget and evict least recently used
+    entries first.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, max_memory_bytes=2 * 1024 * 1024,
+                 max_disk_bytes=50 * 1024 * 1024, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_distance=5):
+        self.db_path = db_path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+
+        # (scope, digest) -> (created_at, phash, value, size)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # (scope, digest) -> phash for every disk row, for near-duplicate scans
+        self._disk_hashes = {}
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "exact_hits": 0,
+            "perceptual_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+        self._db = self._open_db()
+
+    def _open_db(self):
+        """Open the SQLite store and load its hash index, or return None."""
+        if not self.db_path:
+            return None
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS image_analyses (
+                    scope TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    phash TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (scope, digest)
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_image_accessed ON image_analyses(accessed_at)")
+            db.commit()
+            for scope, digest, phash, size in db.execute(
+                "SELECT scope, digest, phash, size FROM image_analyses"
+            ):
+                self._disk_hashes[(scope, digest)] = int(phash, 16)
+                self._disk_bytes += size
+            return db
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Image cache: disk tier disabled ({e})")
+            return None
+
+    def _is_expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get_by_digest(self, digest, scope):
+        """
+        Exact lookup by byte digest; call this before decoding the upload.
+
+        Args:
+            digest (str): Result of image_digest().
+            scope (str): Scan type the analysis belongs to.
+
+        Returns:
+            dict or None: A copy of the cached nutrition data.
+        """
+        value = self._lookup((scope, digest))
+        if value is not None:
+            with self._lock:
+                self._stats["exact_hits"] += 1
+        return value
+
+    def get_similar(self, phash, scope):
+        """
+        Near-duplicate lookup by perceptual hash.
+
+        Args:
+            phash (int): Result of perceptual_hash().
+            scope (str): Scan type the analysis belongs to.
+
+        Returns:
+            dict or None: A copy of the closest cached analysis, or None
+                (always None for EXACT_ONLY_SCOPES).
+        """
+        if scope in EXACT_ONLY_SCOPES:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            candidates = [(key, entry[1]) for key, entry in self._memory.items()]
+            candidates.extend(self._disk_hashes.items())
+            for key, candidate in candidates:
+                if key[0] != scope:
+                    continue
+                distance = hamming_distance(phash, candidate)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+        if best_key is not None:
+            value = self._lookup(best_key)
+            if value is not None:
+                with self._lock:
+                    self._stats["perceptual_hits"] += 1
+                return value
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def _lookup(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._is_expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    return dict(entry[2])
+                self._forget(key)
+                self._stats["expired"] += 1
+
+            if self._db is None or key not in self._disk_hashes:
+                return None
+            try:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM image_analyses WHERE scope = ? AND digest = ?", key
+                ).fetchone()
+                if row is None:
+                    self._disk_hashes.pop(key, None)
+                    return None
+                if self._is_expired(row[1], now):
+                    self._delete_from_disk([key])
+                    self._stats["expired"] += 1
+                    return None
+                self._db.execute(
+                    "UPDATE image_analyses SET accessed_at = ? WHERE scope = ? AND digest = ?",
+                    (now,) + key
+                )
+                self._db.commit()
+                value = json.loads(row[0])
+            except (sqlite3.Error, ValueError) as e:
+                print(f"Image cache read error: {e}")
+                return None
+            self._remember(key, row[1], self._disk_hashes[key], value)
+            return dict(value)
+
+    def set(self, digest, phash, scope, value):
+        """
+        Store an analysis under both fingerprints.
+
+        Args:
+            digest (str): Exact byte digest of the upload.
+            phash (int): Perceptual hash of the decoded image.
+            scope (str): Scan type the analysis belongs to.
+            value (dict): Nutrition data to cache.
+        """
+        now = time.time()
+        key = (scope, digest)
+        value = dict(value)
+        with self._lock:
+            self._stats["writes"] += 1
+            self._remember(key, now, phash, value)
+            if self._db is None:
+                return
+            try:
+                encoded = json.dumps(value)
+                size = len(encoded)
+                self._delete_from_disk([key], commit=False)
+                self._db.execute(
+                    "INSERT INTO image_analyses (scope, digest, phash, value, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (scope, digest, format(phash, "x"), encoded, size, now, now)
+                )
+                self._disk_hashes[key] = phash
+                self._disk_bytes += size
+                self._evict_disk()
+                self._db.commit()
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                print(f"Image cache write error: {e}")
+
+    def _remember(self, key, created_at, phash, value):
+        if key in self._memory:
+            self._forget(key)
+        size = len(json.dumps(value))
+        self._memory[key] = (created_at, phash, value, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            oldest = next(iter(self._memory))
+            self._forget(oldest)
+            self._stats["evictions"] += 1
+
+    def _forget(self, key):
+        entry = self._memory.pop(key)
+        self._memory_bytes -= entry[3]
+
+    def _evict_disk(self):
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        victims = []
+        freed = 0
+        for scope, digest, size in self._db.execute(
+            "SELECT scope, digest, size FROM image_analyses ORDER BY accessed_at ASC"
+        ):
+            if self._disk_bytes - freed <= self.max_disk_bytes:
+                break
+            victims.append((scope, digest))
+            freed += size
+        self._delete_from_disk(victims, commit=False)
+        self._stats["evictions"] += len(victims)
+
+    def _delete_from_disk(self, keys, commit=True):
+        for key in keys:
+            row = self._db.execute(
+                "SELECT size FROM image_analyses WHERE scope = ? AND digest = ?", key
+            ).fetchone()
+            if row is None:
+                continue
+            self._db.execute("DELETE FROM image_analyses WHERE scope = ? AND digest = ?", key)
+            self._disk_bytes -= row[0]
+            self._disk_hashes.pop(key, None)
+        if commit:
+            self._db.commit()
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM image_analyses")
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"Image cache clear error: {e}")
+                self._disk_hashes.clear()
+                self._disk_bytes = 0
+
+    def stats(self):
+        """
+        Report cache effectiveness and budget usage.
+
+        Returns:
+            dict: Hit/miss counters, hit rate, entry counts and bytes per tier.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["disk_entries"] = len(self._disk_hashes)
+            stats["disk_bytes"] = self._disk_bytes
+        hits = stats["exact_hits"] + stats["perceptual_hits"]
+        lookups = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+_analysis_cache = None
+_image_cache = None
+_analysis_cache_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    """Return the process-wide text analysis cache (CACHE_DB_PATH, ":memory:" for none)."""
+    global _analysis_cache
+    if _analysis_cache is None:
+        with _analysis_cache_lock:
+            if _analysis_cache is None:
+                _analysis_cache = AnalysisCache(db_path=get_config()["cache_db_path"] or DEFAULT_DB_PATH)
+    return _analysis_cache
+
+
+def get_image_cache():
+    """Return the process-wide image analysis cache, creating it on first use."""
+    global _image_cache
+    if _image_cache is None:
+        with _analysis_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageAnalysisCache(db_path=get_config()["cache_db_path"] or DEFAULT_DB_PATH)
+    return _image_cache
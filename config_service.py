@@ -0,0 +1,134 @@
+# config_service.py
+import os
+import threading
+import time
+
+try:
+    from dotenv import dotenv_values
+except ImportError:
+    dotenv_values = None
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = "gemini-2.5-flash-lite"
+
+
+def _parse_bool(raw):
+    """Accept real booleans (secrets.toml) and "1/true/yes/on" or "0/false/no/off" strings."""
+    if isinstance(raw, bool):
+        return raw
+    value = str(raw).strip().lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(raw)
+
+
+# Every setting, its default and how to parse it; names match the secret/env variable
+SETTINGS = {
+    "GEMINI_API_KEY": (None, str),
+    "GEMINI_MODEL": (DEFAULT_MODEL, str),
+    "GEMINI_MODELS": (None, str),
+    "GEMINI_API_BASE": (GEMINI_API_BASE, str),
+    "GEMINI_CONNECT_TIMEOUT": (5.0, float),
+    "GEMINI_READ_TIMEOUT": (30.0, float),
+    "GEMINI_POOL_SIZE": (10, int),
+    "GEMINI_MAX_RETRIES": (2, int),
+    "GEMINI_REQUESTS_PER_MINUTE": (15, int),
+    "GEMINI_TOKENS_PER_MINUTE": (250000, int),
+    "GEMINI_HEDGE": (False, _parse_bool),
+    "GEMINI_HEDGE_PERCENTILE": (95.0, float),
+    "GEMINI_HEDGE_BUDGET": (0.05, float),
+    "GEMINI_HEDGE_MIN_DELAY": (0.25, float),
+    "CACHE_DB_PATH": (None, str),
+    "UPLOAD_CACHE_MB": (64.0, float),
+    "FOOD_STORE_PATH": (None, str),
+    "ANALYSIS_WORKERS": (4, int),
+    "ANALYSIS_QUEUE_LENGTH": (16, int),
+    "ANALYSIS_BUDGET_SECONDS": (0.8, float),
+    "PREFETCH_DEBOUNCE_SECONDS": (0.2, float),
+    "PREFETCH_MAX_PER_HOUR": (20, int),
+    "METRICS_HOST": ("127.0.0.1", str),
+    "METRICS_PORT": (None, int),
+    "METRICS_FILE": (None, str),
+    "METRICS_FILE_INTERVAL": (15.0, float),
+}
+
+
+def _read_secrets():
+    """Streamlit secrets as a plain dict (empty outside Streamlit or without secrets.toml)."""
+    try:
+        import streamlit as st
+        return {name: st.secrets[name] for name in SETTINGS if name in st.secrets}
+    except Exception:
+        return {}
+
+
+def _read_dotenv(path):
+    """Values from a .env file, without touching os.environ."""
+    if dotenv_values is None or not os.path.exists(path):
+        return {}
+    return {name: value for name, value in dotenv_values(path).items() if value is not None}
+
+
+def load_config(dotenv_path=".env"):
+    """
+    Resolve every setting once: Streamlit secrets, then environment, then .env.
+
+    Args:
+        dotenv_path (str): Location of the optional .env file.
+
+    Returns:
+        dict: Lower-case setting names (e.g. "gemini_api_key") to parsed values,
+            plus "api_key_source" and "loaded_at".
+    """
+    sources = [("secrets", _read_secrets()), ("environment", os.environ), (".env", _read_dotenv(dotenv_path))]
+
+    config = {"api_key_source": None, "loaded_at": time.time()}
+    for name, (default, parse) in SETTINGS.items():
+        value = default
+        for source_name, source in sources:
+            raw = source.get(name)
+            if raw in (None, ""):
+                continue
+            try:
+                value = parse(raw)
+            except (TypeError, ValueError):
+                print(f"Ignoring invalid {name}={raw!r} from {source_name}")
+                continue
+            if name == "GEMINI_API_KEY":
+                config["api_key_source"] = source_name
+            break
+        config[name.lower()] = value
+    return config
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config():
+    """Return the process-wide configuration, resolving it on first use."""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = load_config()
+    return _config
+
+
+def reload_config():
+    """
+    Re-read secrets, environment and .env, e.g. after rotating the API key.
+
+    Callers holding the old dict keep a consistent snapshot; clients built
+    from it (see gemini_client.get_gemini_client) notice the new object and
+    rebuild themselves.
+
+    Returns:
+        dict: The new configuration.
+    """
+    global _config
+    with _config_lock:
+        _config = load_config()
+    return _config
@@ -4,6 +4,12 @@ from firebase_admin import credentials, firestore
 from datetime import datetime
 import json
 
+from metrics_service import get_metrics_registry
+
+FIRESTORE_WRITE_SECONDS = get_metrics_registry().histogram(
+    "nutrimind_firestore_write_seconds", "Firestore write time, including demo-mode no-ops",
+    ["operation", "outcome"])
+
 def init_firebase():
     """Initialize Firebase with service account"""
     try:
@@ -14,6 +20,7 @@ def init_firebase():
         # For testing, use mock data
         return False
 
+@FIRESTORE_WRITE_SECONDS.time(operation="save_user_data")
 def save_user_data(user_id, name, age, email):
     """Save user profile to Firestore"""
     if not init_firebase():
@@ -40,34 +47,37 @@ def save_user_data(user_id, name, age, email):
 
 def save_food_log(user_id, food_data):
     """Save food intake to Firestore"""
-    if not init_firebase():
-        return {"status": "demo", "data": food_data}
-    
-    db = firestore.client()
-    today = datetime.now().strftime("%Y-%m-%d")
-    
-    log_ref = db.collection('users').document(user_id)\
-                .collection('daily_logs').document(today)
-    
-    # Get existing logs or create new
-    existing = log_ref.get()
-    if existing.exists:
-        logs = existing.to_dict().get('foods', [])
-    else:
-        logs = []
-    
-    logs.append({
-        **food_data,
-        'timestamp': datetime.now()
-    })
-    
-    log_ref.set({'foods': logs}, merge=True)
+    # Timed apart from update_daily_totals, which records its own write
+    with FIRESTORE_WRITE_SECONDS.time(operation="save_food_log"):
+        if not init_firebase():
+            return {"status": "demo", "data": food_data}
+        
+        db = firestore.client()
+        today = datetime.now().strftime("%Y-%m-%d")
+        
+        log_ref = db.collection('users').document(user_id)\
+                    .collection('daily_logs').document(today)
+        
+        # Get existing logs or create new
+        existing = log_ref.get()
+        if existing.exists:
+            logs = existing.to_dict().get('foods', [])
+        else:
+            logs = []
+        
+        logs.append({
+            **food_data,
+            'timestamp': datetime.now()
+        })
+        
+        log_ref.set({'foods': logs}, merge=True)
     
     # Update daily totals
     update_daily_totals(user_id, food_data)
     
     return {"status": "success"}
 
+@FIRESTORE_WRITE_SECONDS.time(operation="update_daily_totals")
 def update_daily_totals(user_id, food_data):
     """Update daily nutrition totals"""
     db = firestore.client()
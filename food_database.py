@@ -0,0 +1,755 @@
+# food_database.py
+import gc
+import hashlib
+import json
+import math
+import os
+import pickle
+import re
+import threading
+import time
+
+import numpy as np
+
+from cache_service import CACHE_DIR
+from food_store import get_food_store
+from metrics_service import get_metrics_registry
+from nutrition_parser import NUTRIENT_FIELDS
+
+
+GENERIC_INSIGHT = "General food item with moderate nutrition"
+
+# Keys are matched anywhere in the lower-cased food name; the longest key found wins
+FOOD_DB = {
+    "dosa": {"food_name": "Masala Dosa", "calories": 200, "protein": 4, "carbs": 30, "fats": 6, "insight": "South Indian fermented crepe with potato filling"},
+    "plain dosa": {"food_name": "Plain Dosa", "calories": 150, "protein": 4, "carbs": 25, "fats": 4, "insight": "Fermented rice and lentil crepe"},
+    "idli": {"food_name": "Idli", "calories": 60, "protein": 2, "carbs": 12, "fats": 0.5, "insight": "Steamed rice cake, easily digestible"},
+    "vada": {"food_name": "Medu Vada", "calories": 150, "protein": 3, "carbs": 20, "fats": 7, "insight": "Lentil doughnut, deep fried"},
+    "poha": {"food_name": "Poha", "calories": 250, "protein": 6, "carbs": 45, "fats": 5, "insight": "Flattened rice breakfast dish"},
+    "upma": {"food_name": "Upma", "calories": 200, "protein": 5, "carbs": 35, "fats": 6, "insight": "Semolina breakfast porridge"},
+    "chapati": {"food_name": "Chapati", "calories": 120, "protein": 3.5, "carbs": 20, "fats": 2.5, "insight": "Whole wheat flatbread (40 g); fiber for sustained energy"},
+    "paratha": {"food_name": "Aloo Paratha", "calories": 300, "protein": 8, "carbs": 45, "fats": 10, "insight": "Stuffed flatbread with potatoes"},
+    "rice": {"food_name": "Steamed Rice", "calories": 205, "protein": 4.3, "carbs": 45, "fats": 0.4, "insight": "Good source of carbohydrates"},
+    "biryani": {"food_name": "Chicken Biryani", "calories": 500, "protein": 25, "carbs": 60, "fats": 20, "insight": "Flavorful rice dish with meat and spices"},
+    "pulao": {"food_name": "Vegetable Pulao", "calories": 300, "protein": 6, "carbs": 55, "fats": 8, "insight": "Vegetable rice pilaf"},
+    "butter chicken": {"food_name": "Butter Chicken", "calories": 450, "protein": 30, "carbs": 15, "fats": 30, "insight": "Creamy tomato-based chicken curry"},
+    "paneer butter": {"food_name": "Paneer Butter Masala", "calories": 400, "protein": 22, "carbs": 20, "fats": 25, "insight": "Creamy cottage cheese curry"},
+    "chicken curry": {"food_name": "Chicken Curry", "calories": 350, "protein": 25, "carbs": 10, "fats": 20, "insight": "Spicy chicken in gravy"},
+    "dal": {"food_name": "Dal Tadka", "calories": 150, "protein": 9, "carbs": 22, "fats": 4, "insight": "Tempered lentil soup, rich in protein"},
+    "sambar": {"food_name": "Sambar", "calories": 100, "protein": 5, "carbs": 18, "fats": 3, "insight": "South Indian lentil stew with vegetables"},
+    "banana": {"food_name": "Banana", "calories": 105, "protein": 1.3, "carbs": 27, "fats": 0.4, "insight": "Rich in potassium and quick energy"},
+    "apple": {"food_name": "Apple", "calories": 95, "protein": 0.5, "carbs": 25, "fats": 0.3, "insight": "High in fiber and antioxidants"},
+    "orange": {"food_name": "Orange", "calories": 62, "protein": 1.2, "carbs": 15, "fats": 0.2, "insight": "Excellent source of Vitamin C"},
+    "mango": {"food_name": "Mango", "calories": 150, "protein": 1.1, "carbs": 40, "fats": 0.6, "insight": "Rich in Vitamin A and C"},
+    "grapes": {"food_name": "Grapes", "calories": 69, "protein": 0.7, "carbs": 18, "fats": 0.2, "insight": "Natural sugars with antioxidants"},
+    "egg": {"food_name": "Egg (Boiled)", "calories": 78, "protein": 6, "carbs": 0.6, "fats": 5, "insight": "Complete protein with all essential amino acids"},
+    "chicken": {"food_name": "Chicken Breast", "calories": 165, "protein": 31, "carbs": 0, "fats": 3.6, "insight": "Lean protein for muscle building"},
+    "fish": {"food_name": "Fish (Grilled)", "calories": 206, "protein": 22, "carbs": 0, "fats": 12, "insight": "Rich in Omega-3 fatty acids"},
+    "paneer": {"food_name": "Paneer", "calories": 265, "protein": 18, "carbs": 1.2, "fats": 20, "insight": "Indian cottage cheese, high in calcium"},
+    "tofu": {"food_name": "Tofu", "calories": 76, "protein": 8, "carbs": 2, "fats": 4, "insight": "Plant-based protein from soy"},
+    "pizza": {"food_name": "Pizza Slice", "calories": 285, "protein": 12, "carbs": 36, "fats": 10, "insight": "Contains carbs, protein and fats"},
+    "burger": {"food_name": "Cheese Burger", "calories": 354, "protein": 15, "carbs": 29, "fats": 20, "insight": "Fast food with moderate protein"},
+    "samosa": {"food_name": "Samosa", "calories": 300, "protein": 4, "carbs": 35, "fats": 16, "insight": "Fried pastry with potato filling"},
+    "pakora": {"food_name": "Pakora", "calories": 200, "protein": 5, "carbs": 20, "fats": 10, "insight": "Vegetable fritters, deep fried"},
+    "milk": {"food_name": "Milk (1 cup)", "calories": 150, "protein": 8, "carbs": 12, "fats": 8, "insight": "Rich in calcium and protein"},
+    "curd": {"food_name": "Curd/Yogurt", "calories": 150, "protein": 8, "carbs": 11, "fats": 8, "insight": "Probiotic-rich for gut health"},
+    "cheese": {"food_name": "Cheese", "calories": 113, "protein": 7, "carbs": 1, "fats": 9, "insight": "High in calcium and protein"},
+    "smoothie": {"food_name": "Fruit Smoothie", "calories": 200, "protein": 8, "carbs": 30, "fats": 5, "insight": "Blended fruits with nutrients"},
+    "juice": {"food_name": "Orange Juice", "calories": 112, "protein": 2, "carbs": 26, "fats": 0.5, "insight": "Vitamin C rich beverage"},
+    "coffee": {"food_name": "Coffee", "calories": 2, "protein": 0.3, "carbs": 0, "fats": 0, "insight": "Low calorie caffeine source"},
+    "tea": {"food_name": "Tea", "calories": 2, "protein": 0, "carbs": 0.5, "fats": 0, "insight": "Low calorie beverage with antioxidants"},
+    "bread": {"food_name": "Bread Slice", "calories": 79, "protein": 3, "carbs": 15, "fats": 1, "insight": "Basic carbohydrate source"},
+    "pasta": {"food_name": "Pasta", "calories": 220, "protein": 8, "carbs": 43, "fats": 1, "insight": "Carb-rich Italian dish"},
+    "sandwich": {"food_name": "Vegetable Sandwich", "calories": 250, "protein": 8, "carbs": 40, "fats": 6, "insight": "Quick meal with vegetables"},
+    "salad": {"food_name": "Green Salad", "calories": 100, "protein": 4, "carbs": 15, "fats": 3, "insight": "Healthy vegetable mix"},
+    "rice bowl": {"food_name": "Steamed Rice Bowl", "calories": 240, "protein": 4.5, "carbs": 53, "fats": 0.5, "insight": "Simple carbohydrates for energy"},
+    "chicken salad": {"food_name": "Chicken Salad", "calories": 320, "protein": 35, "carbs": 12, "fats": 15, "insight": "Lean protein with vegetables"},
+    "protein shake": {"food_name": "Protein Shake", "calories": 180, "protein": 25, "carbs": 12, "fats": 3, "insight": "Quick protein supplement"},
+    "oatmeal": {"food_name": "Oatmeal", "calories": 150, "protein": 5, "carbs": 27, "fats": 3, "insight": "High fiber breakfast"},
+    "fried rice": {"food_name": "Vegetable Fried Rice", "calories": 380, "protein": 8, "carbs": 60, "fats": 12, "insight": "Stir-fried rice with vegetables"},
+    "mac and cheese": {"food_name": "Mac and Cheese", "calories": 350, "protein": 13, "carbs": 40, "fats": 15, "insight": "Pasta in cheese sauce, calorie dense"},
+    "bread and butter": {"food_name": "Bread and Butter", "calories": 230, "protein": 6, "carbs": 30, "fats": 10, "insight": "Two buttered slices; mostly refined carbs and fat"},
+}
+
+# Plain ingredients: in "chicken biryani" or "paneer wrap" the dish decides, not the ingredient
+INGREDIENT_KEYS = {"chicken", "paneer", "egg", "fish", "rice", "milk", "cheese", "bread", "tofu", "curd"}
+
+# Main ingredients a dish can be made with; a dish naming a different one than the
+# input ("Vegetable Pulao" for "chicken pulao") is not an answer for it
+MAIN_INGREDIENTS = INGREDIENT_KEYS | {"vegetable", "veg", "mutton", "lamb", "prawn", "beef", "pork"}
+
+# Curry words that, with a main ingredient, make a known curry ("chicken tikka", "egg curry")
+CURRY_TERMS = {"curry", "masala", "tikka", "korma"}
+
+# Words that describe a plain ingredient rather than make it a different dish ("boiled egg")
+SERVING_WORDS = {"plain", "boiled", "grilled", "steamed", "fresh", "raw", "cooked", "homemade",
+                 "with", "of", "a", "bowl", "cup", "glass", "plate", "piece", "slice",
+                 "small", "medium", "large"}
+
+# Regional names and alternate spellings -> FOOD_DB key; matched like the keys themselves
+FOOD_ALIASES = {
+    "roti": "chapati",
+    "phulka": "chapati",
+    "pulav": "pulao",
+    "pilaf": "pulao",
+    "daal": "dal",
+    "dhal": "dal",
+    "lentil soup": "dal",
+    "pakoda": "pakora",
+    "bhajji": "pakora",
+    "dahi": "curd",
+    "yogurt": "curd",
+    "yoghurt": "curd",
+    "cottage cheese": "paneer",
+    "chawal": "rice",
+    "murgh": "chicken",
+    "chai": "tea",
+    "porridge": "oatmeal",
+}
+
+FOOD_WORD = re.compile(r"[a-z]+")
+
+# Compiled lookup indexes, shared by processes that start after the first one built them
+SNAPSHOT_PATH = os.path.join(CACHE_DIR, "food_knowledge.pickle")
+SNAPSHOT_VERSION = 3
+
+# Unknown foods are estimated from the nearest dishes by name; below this similarity
+# the name says too little and a fixed generic estimate is used instead
+SIMILARITY_MIN_SCORE = 0.2
+SIMILAR_DISHES = 3
+
+# A misspelled name must be this similar (1 - edits / length, per word) to resolve to a dish
+FUZZY_MIN_SCORE = 0.8
+
+
+def _food_words(text):
+    """Words of a lower-case text, each also without a plural "s"/"es" ("eggs" -> "egg")."""
+    words = set()
+    for word in FOOD_WORD.findall(text):
+        words.add(word)
+        if word.endswith("es"):
+            words.add(word[:-2])
+        if word.endswith("s"):
+            words.add(word[:-1])
+    return words
+
+
+class FoodMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of lower-case keys.
+
+    Built once, it finds every key occurring in a text in a single pass,
+    so a lookup costs time proportional to the text, not the number of
+    keys. Keys only match whole words (a plural "s"/"es" is allowed), so
+    "steak" does not contain "tea". Of the keys found, find() prefers the
+    highest priority, then the longest, then the last one in the text (the
+    head noun, as in "chicken pulao"), so "fried rice" beats "rice" and a
+    dish beats an ingredient whatever order the keys were added in.
+    """
+
+    def __init__(self, entries, priorities=None):
+        """
+        Args:
+            entries (dict): Lower-case key -> value, kept in .entries.
+            priorities (dict): Key -> int, higher wins; missing keys are 0.
+        """
+        self.entries = dict(entries)
+        self.priorities = {key: (priorities or {}).get(key, 0) for key in self.entries}
+        self._goto = [{}]
+        # Per state: the key ending exactly here, and the next state along the
+        # suffix links that ends a key (so every key ending at a position is visited)
+        self._key = [None]
+        for key in self.entries:
+            state = 0
+            for char in key:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._key.append(None)
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._key[state] = key
+
+        # Breadth-first: a state's suffix link is always resolved before its children's
+        self._fail = [0] * len(self._goto)
+        self._output = [0] * len(self._goto)
+        pending = list(self._goto[0].values())
+        for state in pending:
+            for char, child in self._goto[state].items():
+                pending.append(child)
+                fallback = self._fail[state]
+                while char not in self._goto[fallback] and fallback:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                suffix = self._fail[child]
+                self._output[child] = suffix if self._key[suffix] is not None else self._output[suffix]
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _whole_word(text, start, end):
+        """True if text[start:end] is a word, optionally followed by a plural "s" or "es"."""
+        if start > 0 and text[start - 1].isalnum():
+            return False
+        for suffix in ("", "s", "es"):
+            stop = end + len(suffix)
+            if text.startswith(suffix, end) and (stop == len(text) or not text[stop].isalnum()):
+                return True
+        return False
+
+    def find(self, text):
+        """
+        Best whole-word key occurring in text.
+
+        Args:
+            text (str): Lower-case text to search.
+
+        Returns:
+            str or None: The matched key, or None if no key occurs in text.
+        """
+        goto, fail, keys, output = self._goto, self._fail, self._key, self._output
+        state, best, best_rank = 0, None, None
+        for end, char in enumerate(text, start=1):
+            while char not in goto[state] and state:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            match = state if keys[state] is not None else output[state]
+            while match:
+                key = keys[match]
+                rank = (self.priorities[key], len(key), end)
+                if (best_rank is None or rank > best_rank) and self._whole_word(text, end - len(key), end):
+                    best, best_rank = key, rank
+                match = output[match]
+        return best
+
+
+def _trigrams(word):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a, b):
+    """Optimal string alignment distance: insertions, deletions, substitutions and swaps."""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+
+def _word_similarity(typed, word, prefix=False):
+    if typed == word:
+        return 1.0
+    if prefix and word.startswith(typed):
+        # An unfinished word is a strong hint even when short
+        return 0.75 + 0.25 * len(typed) / len(word)
+    return max(0.0, 1 - _edit_distance(typed, word) / max(len(typed), len(word)))
+
+
+class FuzzyFoodIndex:
+    """
+    Typo-tolerant search over food names and aliases.
+
+    The distinct words of all names are indexed by their trigrams. Each
+    query word is compared (by edit distance) only with the words sharing
+    a trigram with it, and names are scored from those word similarities,
+    so "chapatti", "biriyani" or "panner" still find their dish in a small
+    fraction of a millisecond.
+    """
+
+    def __init__(self, names):
+        """
+        Args:
+            names (dict): Searchable name -> value (several names may share a value).
+        """
+        self.names = []
+        self._words = []
+        self._names_by_word = {}
+        self._postings = {}
+        for name, value in names.items():
+            words = tuple(dict.fromkeys(FOOD_WORD.findall(name.lower())))
+            if not words:
+                continue
+            self.names.append((name, value, words))
+            for word in words:
+                if word not in self._names_by_word:
+                    self._names_by_word[word] = []
+                    for gram in _trigrams(word):
+                        self._postings.setdefault(gram, []).append(word)
+                self._names_by_word[word].append(len(self.names) - 1)
+
+    def _similarities(self, words, prefix_last):
+        """Per query word, {indexed word: similarity} for the words sharing a trigram with it."""
+        similarities = []
+        for position, typed in enumerate(words):
+            prefix = prefix_last and position == len(words) - 1
+            nearby = {word for gram in _trigrams(typed) for word in self._postings.get(gram, ())}
+            if prefix:
+                # Too short to share a trigram yet ("chicken s" -> "salad")
+                nearby.update(word for word in self._names_by_word if word.startswith(typed))
+            similarities.append({word: _word_similarity(typed, word, prefix) for word in nearby})
+        return similarities
+
+    def _scored(self, text, prefix_last):
+        """(name index, coverage of the name, coverage of the text) for every candidate name."""
+        words = FOOD_WORD.findall((text or "").lower())
+        similarities = self._similarities(words, prefix_last)
+        candidates = {index for scores in similarities for word in scores for index in self._names_by_word[word]}
+        for index in candidates:
+            name_words = self.names[index][2]
+            covered = sum(max(scores.get(word, 0.0) for scores in similarities) for word in name_words) / len(name_words)
+            matched = sum(max(scores.get(word, 0.0) for word in name_words) for scores in similarities) / len(words)
+            yield index, covered, matched
+
+    def search(self, query, limit=5, min_score=0.5):
+        """
+        Names ranked by similarity to what has been typed so far.
+
+        The last query word may be unfinished ("chick" -> "chicken"), and a
+        name scores highest when it covers all of the query and nothing
+        more, so "chicken salad" ranks above "chicken" for that query.
+
+        Args:
+            query (str): Text as typed.
+            limit (int): Maximum number of results.
+            min_score (float): Drop results scoring below this (0-1).
+
+        Returns:
+            list: Dicts with "name", "value" and "score", best first; one per value.
+        """
+        best = {}
+        for index, covered, matched in self._scored(query, prefix_last=True):
+            name, value, _ = self.names[index]
+            score = (covered + matched) / 2
+            if score >= min_score and score > best.get(value, (0.0, None))[0]:
+                best[value] = (score, name)
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], len(item[1][1]), item[1][1]))
+        return [{"name": name, "value": value, "score": round(score, 3)} for value, (score, name) in ranked[:limit]]
+
+    def best_match(self, text, min_score=FUZZY_MIN_SCORE):
+        """
+        The name that most closely occurs in text, allowing typos.
+
+        Like FoodMatcher.find, extra words in text are ignored: a name
+        matches when each of its words is close to some word of the text,
+        and the longest of the best-scoring names wins.
+
+        Returns:
+            The matched name's value, or None when nothing scores min_score.
+        """
+        best_key, best_value = None, None
+        for index, covered, _ in self._scored(text, prefix_last=False):
+            name, value, words = self.names[index]
+            key = (covered, len(words), len(name), name)
+            if covered >= min_score and (best_key is None or key > best_key):
+                best_key, best_value = key, value
+        return best_value
+
+
+def _char_ngrams(text):
+    """3- and 4-character n-grams of each word, padded so word starts and ends count."""
+    grams = []
+    for word in FOOD_WORD.findall(text.lower()):
+        padded = f" {word} "
+        for size in (3, 4):
+            grams.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+    return grams
+
+
+class SimilarityIndex:
+    """
+    Character n-gram TF-IDF vectors of food names, for estimating unknown foods.
+
+    Each name is an L2-normalized TF-IDF vector over its 3- and 4-character
+    n-grams, stored column by column (n-gram -> rows and weights) in NumPy
+    arrays. Cosine similarity to a query is one np.bincount over the
+    postings of the query's n-grams, so it stays fast and small with
+    thousands of names, and is fully deterministic.
+    """
+
+    def __init__(self, names):
+        """
+        Args:
+            names (dict): Name -> value (several names may share a value).
+        """
+        self.names = list(names)
+        self.values = list(names.values())
+        counts = [{} for _ in self.names]
+        document_frequency = {}
+        for row, name in enumerate(self.names):
+            for gram in _char_ngrams(name):
+                counts[row][gram] = counts[row].get(gram, 0) + 1
+            for gram in counts[row]:
+                document_frequency[gram] = document_frequency.get(gram, 0) + 1
+
+        # Smoothed idf; n-grams no name contains get the highest weight
+        self._unseen_idf = math.log(1 + len(self.names)) + 1
+        self._idf = {gram: math.log((1 + len(self.names)) / (1 + df)) + 1 for gram, df in document_frequency.items()}
+
+        postings = {}
+        for row, grams in enumerate(counts):
+            weights = {gram: (1 + math.log(count)) * self._idf[gram] for gram, count in grams.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            for gram, weight in weights.items():
+                postings.setdefault(gram, []).append((row, weight / norm))
+
+        self._columns = {}
+        rows, weights, starts = [], [], [0]
+        for column, (gram, entries) in enumerate(sorted(postings.items())):
+            self._columns[gram] = column
+            rows.extend(row for row, _ in entries)
+            weights.extend(weight for _, weight in entries)
+            starts.append(len(rows))
+        self._rows = np.array(rows, dtype=np.int32)
+        self._weights = np.array(weights, dtype=np.float32)
+        self._starts = np.array(starts, dtype=np.int64)
+
+    def nearest(self, text, limit=SIMILAR_DISHES):
+        """
+        Names most similar to text.
+
+        Args:
+            text (str): Food name to compare.
+            limit (int): Maximum number of results.
+
+        Returns:
+            list: Dicts with "name", "value" and "score" (cosine similarity,
+                0-1), best first; one per value.
+        """
+        counts = {}
+        for gram in _char_ngrams(text or ""):
+            counts[gram] = counts.get(gram, 0) + 1
+        if not counts or not self.names:
+            return []
+
+        # n-grams no name has still count towards the query's norm, lowering the score
+        weights = {gram: (1 + math.log(count)) * self._idf.get(gram, self._unseen_idf) for gram, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        known = [(self._columns[gram], weight / norm) for gram, weight in weights.items() if gram in self._columns]
+        if not known:
+            return []
+        rows = np.concatenate([self._rows[self._starts[column]:self._starts[column + 1]] for column, _ in known])
+        contributions = np.concatenate([self._weights[self._starts[column]:self._starts[column + 1]] * weight
+                                        for column, weight in known])
+        scores = np.bincount(rows, weights=contributions, minlength=len(self.names))
+
+        results, seen = [], set()
+        # Stable sort: equal scores keep name order, so results never vary between runs
+        for row in np.argsort(-scores, kind="stable"):
+            if scores[row] <= 0 or len(results) == limit:
+                break
+            if self.values[row] not in seen:
+                seen.add(self.values[row])
+                results.append({"name": self.names[row], "value": self.values[row], "score": round(float(scores[row]), 3)})
+        return results
+
+
+class FoodKnowledge:
+    """
+    Every food the app knows, indexed for lookup.
+
+    Combines FOOD_DB and FOOD_ALIASES with the names and aliases of the
+    compiled food store (food_store.py), if one is installed, into one
+    whole-word automaton, one fuzzy index and one similarity index. Each
+    maps a name to a target: a FOOD_DB key, or "store:<row>" for a store row.
+    """
+
+    def __init__(self, foods, aliases, store=None):
+        self.foods = foods
+        self.store = store
+        targets = {}
+        if store is not None:
+            targets.update((key.decode("utf-8"), f"store:{row}") for key, row in zip(store.keys, store.key_rows))
+        targets.update((key, key) for key in foods)
+        targets.update(aliases)
+        self.matcher = FoodMatcher(targets, {term: 0 if target in INGREDIENT_KEYS else 1
+                                             for term, target in targets.items()})
+
+        # Display names ("Masala Dosa") are searchable too, but only for suggestions and typos
+        names = dict(targets)
+        for key, nutrition in foods.items():
+            names.setdefault(" ".join(FOOD_WORD.findall(nutrition["food_name"].lower())), key)
+        self.index = FuzzyFoodIndex(names)
+        self.similar = SimilarityIndex(names)
+
+    def __getstate__(self):
+        # The store is memory-mapped and reattached after loading a snapshot
+        return dict(self.__dict__, store=None)
+
+    def nutrition(self, target):
+        """A copy of the nutrition for a target, safe for callers to annotate."""
+        if target.startswith("store:"):
+            return self.store.nutrition_at(int(target[6:]))
+        return dict(self.foods[target])
+
+    def find(self, food_lower):
+        """Target of the longest known name contained in food_lower, or None."""
+        term = self.matcher.find(food_lower)
+        return None if term is None else self.matcher.entries[term]
+
+    def contradicts(self, food_lower, target):
+        """True if the target's dish is made with a main ingredient other than the one food_lower names."""
+        if target.startswith("store:"):
+            name = self.store.names[int(target[6:])].decode("utf-8").lower()
+        else:
+            name = f"{target} {self.foods[target]['food_name'].lower()}"
+        named = _food_words(food_lower) & MAIN_INGREDIENTS
+        made_with = _food_words(name) & MAIN_INGREDIENTS
+        return bool(named - made_with) and bool(made_with - named)
+
+
+def _fingerprint(store):
+    """Changes whenever the data or the code a snapshot was compiled from changes."""
+    # The index classes live in this module; hashing its file (inspect.getsource costs
+    # ~90 ms) means a change to matching code can't be served a stale snapshot
+    with open(__file__, "rb") as f:
+        code = hashlib.sha256(f.read()).hexdigest()
+    source = json.dumps([SNAPSHOT_VERSION, FOOD_DB, FOOD_ALIASES, sorted(INGREDIENT_KEYS), code,
+                         store.meta if store else None, store.path if store else None], sort_keys=True)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _snapshot_trusted(path):
+    """
+    True if path was written by this user and nobody else can modify it.
+
+    Unpickling runs code, so a snapshot is only loaded from a file only
+    the app's own user could have written (snapshots are saved 0600).
+    """
+    info = os.stat(path)
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        return False
+    return not info.st_mode & 0o022
+
+
+def _load_snapshot(path, fingerprint):
+    # Unpickling tens of thousands of small dicts triggers repeated, useless GC passes
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if not _snapshot_trusted(path):
+            print(f"Food knowledge snapshot {path} is writable by other users, ignoring it")
+            return None
+        with open(path, "rb") as f:
+            saved_fingerprint, knowledge = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Food knowledge snapshot unreadable, rebuilding: {e}")
+        return None
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return knowledge if saved_fingerprint == fingerprint else None
+
+
+def _save_snapshot(path, fingerprint, knowledge):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            pickle.dump((fingerprint, knowledge), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not write food knowledge snapshot: {e}")
+
+
+_knowledge = None
+_knowledge_lock = threading.Lock()
+
+
+def get_food_knowledge():
+    """
+    Return the process-wide FoodKnowledge, loading or building it once.
+
+    The compiled indexes are pickled to SNAPSHOT_PATH, so later processes
+    (other Streamlit workers, restarts) start from the snapshot in a few
+    milliseconds instead of rebuilding; a snapshot whose data or index
+    code changed is rebuilt and replaced. The snapshot is trusted only if
+    the app's own user wrote it (see _snapshot_trusted); keep .cache/ out
+    of reach of other accounts.
+    """
+    global _knowledge
+    if _knowledge is None:
+        with _knowledge_lock:
+            if _knowledge is None:
+                store = get_food_store()
+                fingerprint = _fingerprint(store)
+                knowledge = _load_snapshot(SNAPSHOT_PATH, fingerprint)
+                if knowledge is None:
+                    knowledge = FoodKnowledge(FOOD_DB, FOOD_ALIASES, store)
+                    _save_snapshot(SNAPSHOT_PATH, fingerprint, knowledge)
+                knowledge.store = store
+                _knowledge = knowledge
+    return _knowledge
+
+_metrics = get_metrics_registry()
+FALLBACK_LOOKUPS = _metrics.counter(
+    "nutrimind_fallback_lookups_total", "Built-in database lookups by result", ["result"])
+FALLBACK_LOOKUP_SECONDS = _metrics.histogram(
+    "nutrimind_fallback_lookup_seconds", "Time spent in get_fallback_nutrition")
+
+
+def get_fallback_nutrition(food_name, allow_generic=True):
+    """
+    Look a food up in the built-in database used when the AI is unavailable.
+
+    Args:
+        food_name (str): Name as typed or detected.
+        allow_generic (bool): Return an estimate for unknown foods (from
+            the most similar known dishes, else a fixed generic one)
+            instead of None.
+
+    Returns:
+        dict or None: Nutrition dict, or None for unknown foods when
+            allow_generic is False.
+    """
+    started = time.perf_counter()
+    nutrition = _lookup_fallback(food_name, allow_generic)
+    FALLBACK_LOOKUP_SECONDS.observe(time.perf_counter() - started)
+    if nutrition is None:
+        result = "none"
+    elif nutrition["insight"] == GENERIC_INSIGHT:
+        result = "generic"
+    elif "confidence" in nutrition:
+        result = "similar"
+    else:
+        result = "known"
+    FALLBACK_LOOKUPS.inc(result=result)
+    return nutrition
+
+
+def search_foods(query, limit=5):
+    """
+    Autocomplete suggestions from the food database, tolerant of typos.
+
+    Args:
+        query (str): Food name as typed so far.
+        limit (int): Maximum number of suggestions.
+
+    Returns:
+        list: Dicts with "key" (for get_food), "food_name", "calories",
+            "matched" (the name or alias that matched) and "score", best first.
+    """
+    knowledge = get_food_knowledge()
+    suggestions = []
+    for match in knowledge.index.search(query, limit):
+        nutrition = knowledge.nutrition(match["value"])
+        suggestions.append({"key": match["value"], "food_name": nutrition["food_name"],
+                            "calories": nutrition["calories"], "matched": match["name"], "score": match["score"]})
+    return suggestions
+
+
+def get_food(key):
+    """Copy of the database entry for a key returned by search_foods, or None."""
+    try:
+        return get_food_knowledge().nutrition(key)
+    except (KeyError, ValueError, AttributeError):
+        return None
+
+
+def _lookup_fallback(food_name, allow_generic):
+    if not food_name or food_name == "":
+        if not allow_generic:
+            return None
+        return {
+            "food_name": "Food Item",
+            "calories": 250,
+            "protein": 12,
+            "carbs": 30,
+            "fats": 8,
+            "insight": GENERIC_INSIGHT
+        }
+    
+    food_lower = food_name.lower()
+    
+    knowledge = get_food_knowledge()
+    
+    # Exact name in the compiled food composition tables (food_store.py), when installed
+    if knowledge.store is not None:
+        nutrition = knowledge.store.nutrition(food_lower)
+        if nutrition is not None:
+            return nutrition
+    
+    # Best known dish named in the input
+    # A dish made with something else ("chicken pulao" -> Vegetable Pulao) is no answer;
+    # near-misses would only find it again, so only an estimate or the AI remains
+    target = knowledge.find(food_lower)
+    contradicted = target is not None and knowledge.contradicts(food_lower, target)
+    if contradicted:
+        target = None
+    if target is not None and target not in INGREDIENT_KEYS:
+        return knowledge.nutrition(target)
+    
+    # Only ingredients, curry words and serving words: the ingredient or a known curry.
+    # Anything else ("paneer tikka wrap") names a dish the similarity index reads better
+    ingredient = target
+    known_words = CURRY_TERMS | MAIN_INGREDIENTS | SERVING_WORDS
+    if all(_food_words(word) & known_words for word in FOOD_WORD.findall(food_lower)):
+        # Check for specific Indian food terms (whole words: "eggplant curry" is not egg curry);
+        # "chicken tikka" is a curry, not the plain ingredient
+        words = _food_words(food_lower)
+        if words & CURRY_TERMS:
+            if "chicken" in words:
+                return dict(FOOD_DB["chicken curry"])
+            elif "paneer" in words:
+                return dict(FOOD_DB["paneer butter"])
+            elif "egg" in words:
+                return {"food_name": "Egg Curry", "calories": 200, "protein": 15, "carbs": 8, "fats": 12, "insight": "Eggs cooked in spicy gravy"}
+        
+        if ingredient is not None:
+            return knowledge.nutrition(ingredient)
+    
+    # Misspellings such as "chapatti" or "panner" (re-finding the ingredient explains nothing)
+    target = None if contradicted else knowledge.index.best_match(food_lower)
+    if target is not None and target != ingredient and not knowledge.contradicts(food_lower, target):
+        return knowledge.nutrition(target)
+    
+    if not allow_generic:
+        return None
+    
+    # Unknown dish: estimate from the most similar known dishes
+    estimate = _estimate_from_similar(knowledge, food_name)
+    if estimate is not None:
+        return estimate
+    
+    if ingredient is not None:
+        return knowledge.nutrition(ingredient)
+    
+    # Generic fallback
+    return {
+        "food_name": food_name.title(),
+        "calories": 250,
+        "protein": 12,
+        "carbs": 30,
+        "fats": 8,
+        "insight": GENERIC_INSIGHT
+    }
+
+
+def _estimate_from_similar(knowledge, food_name):
+    """
+    Similarity-weighted average of the nearest known dishes, or None.
+
+    The result carries "confidence", the best cosine similarity (0-1), and
+    is the same for the same name every time, so it can be cached.
+    """
+    neighbours = knowledge.similar.nearest(food_name)
+    if not neighbours or neighbours[0]["score"] < SIMILARITY_MIN_SCORE:
+        return None
+    # Distant runners-up ("bowl" -> "boiled") would only blur the estimate
+    dishes = [(knowledge.nutrition(match["value"]), match["score"]) for match in neighbours
+              if match["score"] >= neighbours[0]["score"] / 2]
+    total = sum(score for _, score in dishes)
+    nutrition = {"food_name": food_name.strip().title()}
+    for field in NUTRIENT_FIELDS:
+        amount = sum(dish[field] * score for dish, score in dishes) / total
+        nutrition[field] = int(round(amount)) if field == "calories" else round(amount, 1)
+    names = ", ".join(dish["food_name"] for dish, _ in dishes)
+    nutrition["insight"] = f"Estimated from similar dishes: {names} ({neighbours[0]['score']:.0%} name match)"
+    nutrition["confidence"] = neighbours[0]["score"]
+    return nutrition
@@ -0,0 +1,283 @@
+# food_store.py
+"""
+Columnar nutrition store for large food catalogs.
+
+Compile CSV sources (e.g. an export of the Indian Food Composition
+Tables) once, offline:
+
+    python food_store.py ifct_2017.csv house_foods.csv --out data/food_store
+
+Each CSV needs a "name" column and numeric nutrient columns per 100 g:
+"calories", "protein", "carbs" and "fats", plus any others ("fibre",
+"iron", ...). Optional columns are "aliases" ("|" separated), "portion_g"
+(typical serving, default 100) and "insight". A later file overrides
+earlier rows with the same name; empty cells are stored as missing.
+
+The store is a directory of .npy files opened with mmap_mode="r": every
+Streamlit worker process on the machine reads the same page-cache pages
+instead of holding its own copy, and opening it costs almost nothing.
+Names are found by binary search over a sorted key array, so the
+string-to-row index is memory-mapped too.
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from cache_service import normalize_food_name
+from config_service import get_config
+from nutrition_parser import NUTRIENT_FIELDS
+
+FORMAT_VERSION = 1
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "food_store")
+
+TEXT_COLUMNS = ("name", "aliases", "portion_g", "insight")
+
+DEFAULT_PORTION_G = 100.0
+
+
+def _string_array(values):
+    """UTF-8 encoded fixed-width bytes; numpy can memory-map these, unlike object arrays."""
+    encoded = [value.encode("utf-8") for value in values]
+    return np.array(encoded, dtype=f"S{max([len(value) for value in encoded] + [1])}")
+
+
+def _read_csv(path, foods, nutrients):
+    """Add the rows of one CSV to foods (normalized name -> record) and new columns to nutrients."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        if "name" not in (reader.fieldnames or []):
+            raise ValueError(f"{path}: no 'name' column")
+        for column in reader.fieldnames:
+            if column not in TEXT_COLUMNS and column not in nutrients:
+                nutrients.append(column)
+
+        for line, row in enumerate(reader, start=2):
+            name = (row.get("name") or "").strip()
+            if not name:
+                continue
+            values = {}
+            for column in reader.fieldnames:
+                raw = (row.get(column) or "").strip()
+                if column in TEXT_COLUMNS or not raw:
+                    continue
+                try:
+                    values[column] = float(raw)
+                except ValueError:
+                    raise ValueError(f"{path}:{line}: {column}={raw!r} is not a number") from None
+            portion = (row.get("portion_g") or "").strip()
+            foods[normalize_food_name(name)] = {
+                "name": name,
+                "aliases": [alias.strip() for alias in (row.get("aliases") or "").split("|") if alias.strip()],
+                "portion_g": float(portion) if portion else DEFAULT_PORTION_G,
+                "insight": (row.get("insight") or "").strip(),
+                "values": values,
+            }
+
+
+def build_food_store(csv_paths, out_dir=DEFAULT_STORE_PATH):
+    """
+    Compile CSV files into a store directory, replacing any existing one.
+
+    Args:
+        csv_paths (list): CSV files, later ones overriding earlier rows.
+        out_dir (str): Store directory to write.
+
+    Returns:
+        dict: The store's metadata (rows, nutrients, sources).
+
+    Raises:
+        ValueError: A file has no "name" column or a non-numeric nutrient.
+    """
+    foods = {}
+    nutrients = list(NUTRIENT_FIELDS)
+    for path in csv_paths:
+        _read_csv(path, foods, nutrients)
+    records = list(foods.values())
+
+    # Column-major: each nutrient is contiguous, rows of one food are gathered by fancy indexing
+    values = np.full((len(records), len(nutrients)), np.nan, dtype=np.float32, order="F")
+    column = {nutrient: index for index, nutrient in enumerate(nutrients)}
+    for row, record in enumerate(records):
+        for nutrient, value in record["values"].items():
+            values[row, column[nutrient]] = value
+
+    # Names win over aliases when both spell the same key
+    key_rows = {key: row for row, key in enumerate(foods)}
+    for row, record in enumerate(records):
+        for alias in record["aliases"]:
+            key_rows.setdefault(normalize_food_name(alias), row)
+    keys = sorted(key.encode("utf-8") for key in key_rows)
+
+    meta = {
+        "format": FORMAT_VERSION,
+        "rows": len(records),
+        "keys": len(keys),
+        "nutrients": nutrients,
+        "sources": [os.path.basename(path) for path in csv_paths],
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    # Write next to the target and swap it in, so running apps never see a half-built store
+    temp_dir = f"{out_dir.rstrip(os.sep)}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    np.save(os.path.join(temp_dir, "values.npy"), values)
+    np.save(os.path.join(temp_dir, "portion_g.npy"), np.array([record["portion_g"] for record in records], dtype=np.float32))
+    np.save(os.path.join(temp_dir, "names.npy"), _string_array(record["name"] for record in records))
+    np.save(os.path.join(temp_dir, "insights.npy"), _string_array(record["insight"] for record in records))
+    np.save(os.path.join(temp_dir, "keys.npy"), np.array(keys, dtype=f"S{max([len(key) for key in keys] + [1])}"))
+    np.save(os.path.join(temp_dir, "key_rows.npy"), np.array([key_rows[key.decode("utf-8")] for key in keys], dtype=np.int32))
+    with open(os.path.join(temp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    old_dir = f"{out_dir.rstrip(os.sep)}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(temp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return meta
+
+
+class FoodStore:
+    """
+    Read-only, memory-mapped view of a store built by build_food_store().
+
+    lookup_many() and scale() work on arrays of rows so a whole meal, or
+    a whole catalog, is resolved and scaled in a few NumPy operations.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported food store format {self.meta.get('format')}")
+        self.path = path
+        self.nutrients = self.meta["nutrients"]
+        self._columns = {nutrient: index for index, nutrient in enumerate(self.nutrients)}
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        self.values = load("values")
+        self.portion_g = load("portion_g")
+        self.names = load("names")
+        self.insights = load("insights")
+        self.keys = load("keys")
+        self.key_rows = load("key_rows")
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def lookup_many(self, food_names):
+        """
+        Rows for several names at once (exact match after normalization).
+
+        Args:
+            food_names (list): Names or aliases.
+
+        Returns:
+            numpy.ndarray: int32 row per name, -1 where the name is unknown.
+        """
+        queries = np.array([normalize_food_name(name).encode("utf-8") for name in food_names] or [b""])
+        if not len(self.keys):
+            return np.full(len(food_names), -1, dtype=np.int32)
+        positions = np.minimum(np.searchsorted(self.keys, queries), len(self.keys) - 1)
+        rows = np.where(self.keys[positions] == queries, self.key_rows[positions], -1).astype(np.int32)
+        return rows[:len(food_names)]
+
+    def lookup(self, food_name):
+        """Row of one name or alias, or None."""
+        row = int(self.lookup_many([food_name])[0])
+        return row if row >= 0 else None
+
+    def scale(self, rows, grams=None, nutrients=None):
+        """
+        Nutrient amounts for the given rows and portion weights.
+
+        Args:
+            rows (array-like): Rows from lookup_many() (no -1 entries).
+            grams (float or array-like): Portion weight per row; defaults to
+                each food's typical portion.
+            nutrients (list): Columns to return; defaults to all.
+
+        Returns:
+            numpy.ndarray: float32 array of shape (len(rows), len(nutrients));
+                NaN where the source had no value.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        columns = [self._columns[nutrient] for nutrient in nutrients] if nutrients else slice(None)
+        if grams is None:
+            grams = self.portion_g[rows]
+        grams = np.broadcast_to(np.asarray(grams, dtype=np.float32), rows.shape)
+        return self.values[rows][:, columns] * (grams / 100.0)[:, np.newaxis]
+
+    def nutrition(self, food_name, grams=None):
+        """
+        One food in the app's nutrition dict format, for a typical portion by default.
+
+        Returns:
+            dict or None: food_name, calories, protein, carbs, fats and
+                insight, or None if the name is not in the store.
+        """
+        row = self.lookup(food_name)
+        return None if row is None else self.nutrition_at(row, grams)
+
+    def nutrition_at(self, row, grams=None):
+        """nutrition() for a row already looked up."""
+        amounts = np.nan_to_num(self.scale([row], grams, NUTRIENT_FIELDS)[0])
+        portion = float(self.portion_g[row]) if grams is None else float(grams)
+        nutrition = {"food_name": self.names[row].decode("utf-8")}
+        for field, amount in zip(NUTRIENT_FIELDS, amounts):
+            nutrition[field] = int(round(float(amount))) if field == "calories" else round(float(amount), 1)
+        nutrition["insight"] = self.insights[row].decode("utf-8") or f"Typical {portion:g} g portion"
+        return nutrition
+
+
+_store = None
+_store_loaded = False
+_store_lock = threading.Lock()
+
+
+def get_food_store():
+    """
+    Return the process-wide food store, or None if none has been built.
+
+    Opened once from FOOD_STORE_PATH (default data/food_store).
+    """
+    global _store, _store_loaded
+    if not _store_loaded:
+        with _store_lock:
+            if not _store_loaded:
+                path = get_config()["food_store_path"] or DEFAULT_STORE_PATH
+                if os.path.exists(os.path.join(path, "meta.json")):
+                    try:
+                        _store = FoodStore(path)
+                        print(f"Food store: {len(_store)} foods, {len(_store.nutrients)} nutrients from {path}")
+                    except (OSError, ValueError) as e:
+                        print(f"Food store at {path} not loaded: {e}")
+                _store_loaded = True
+    return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile CSV nutrition tables into a memory-mapped food store")
+    parser.add_argument("csv", nargs="+", help="CSV files with a name column and nutrients per 100 g")
+    parser.add_argument("--out", help="store directory (default: FOOD_STORE_PATH or data/food_store)")
+    args = parser.parse_args()
+
+    out_dir = args.out or get_config()["food_store_path"] or DEFAULT_STORE_PATH
+    meta = build_food_store(args.csv, out_dir)
+    print(f"Built {out_dir}: {meta['rows']} foods, {meta['keys']} names and aliases, "
+          f"{len(meta['nutrients'])} nutrients from {', '.join(meta['sources'])}")
+
+
+if __name__ == "__main__":
+    main()
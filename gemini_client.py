@@ -0,0 +1,395 @@
+# gemini_client.py
+import json
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config_service import DEFAULT_MODEL, GEMINI_API_BASE, get_config
+
+# Statuses worth retrying: quota (429) and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# Gemini bills an inline image as a fixed number of input tokens
+IMAGE_TOKENS = 258
+
+
+def estimate_tokens(payload):
+    """
+    Rough input-token estimate for quota accounting.
+
+    Args:
+        payload (dict): generateContent request body.
+
+    Returns:
+        int: About one token per four characters of text plus a fixed cost per image.
+    """
+    total = 0
+    for content in payload.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                total += len(part["text"]) // 4 + 1
+            elif "inline_data" in part:
+                total += IMAGE_TOKENS
+    return total
+
+
+def has_image(payload):
+    """True when a generateContent request carries an inline image."""
+    return any(
+        "inline_data" in part
+        for content in payload.get("contents", [])
+        for part in content.get("parts", [])
+    )
+
+
+class GeminiAPIError(Exception):
+    """Raised when the Gemini API returns a non-200 response after retries."""
+
+    def __init__(self, status_code, message="", retry_after=None, timing=None):
+        super().__init__(f"Gemini API error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+        self.timing = timing
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header.
+
+    Args:
+        value (str): Header value, either delta-seconds or an HTTP date.
+
+    Returns:
+        float or None: Seconds to wait, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def classify_error(error):
+    """
+    Decide how a failed call should count towards service health.
+
+    Args:
+        error (Exception): Raised by GeminiClient.generate_content().
+
+    Returns:
+        str: "fatal" for an invalid/expired key, "ignore" for quota and
+            request problems that say nothing about service health, and
+            "failure" for server errors, timeouts and network failures.
+    """
+    if isinstance(error, GeminiAPIError):
+        if error.status_code in (401, 403):
+            return "fatal"
+        if error.status_code in (400, 404, 429):
+            return "ignore"
+        return "failure"
+    if isinstance(error, requests.exceptions.RequestException):
+        return "failure"
+    return "ignore"
+
+
+class GeminiClient:
+    """
+    Process-wide HTTP client for the Gemini generateContent endpoints.
+
+    One keep-alive requests.Session is shared by every Streamlit session,
+    so TLS handshakes are paid once per pooled connection instead of once
+    per analysis. Retryable failures back off exponentially with full
+    jitter, honouring Retry-After when the server sends it.
+    """
+
+    def __init__(self, base_url=GEMINI_API_BASE, pool_size=10, connect_timeout=5.0,
+                 read_timeout=30.0, max_retries=2, backoff_base=0.5, backoff_cap=8.0,
+                 max_retry_after=10.0):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_retry_after = max_retry_after
+
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=0
+        )
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+        self._session.headers.update({"Content-Type": "application/json"})
+
+        self._lock = threading.Lock()
+        self._timings = deque(maxlen=200)
+        self._stats = {
+            "requests": 0,
+            "attempts": 0,
+            "retries": 0,
+            "errors": 0,
+            "new_connections": 0,
+        }
+
+    def endpoint(self, model, method="generateContent"):
+        """Full URL for a model method, e.g. models/gemini-2.5-flash-lite:generateContent."""
+        return f"{self.base_url}/models/{model}:{method}"
+
+    def backoff_delay(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt (0-based)."""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def _connection_count(self):
+        """Connections opened so far across the adapter's pools."""
+        pools = self._adapter.poolmanager.pools
+        total = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+        return total
+
+    def _new_timing(self, model):
+        return {
+            "model": model,
+            "attempts": 0,
+            "new_connection": False,
+            "ttfb_ms": 0.0,
+            "download_ms": 0.0,
+            "backoff_ms": 0.0,
+            "total_ms": 0.0,
+            "status_code": None,
+        }
+
+    def _post(self, url, payload, api_key, timing, read_body=True, retry_quota=True):
+        """
+        POST with retries; returns the first 200 response.
+
+        With read_body=False the body of a successful response is left
+        unread so the caller can consume it as a stream. With
+        retry_quota=False a 429 is raised at once instead of retried.
+        """
+        attempt = 0
+        while True:
+            timing["attempts"] += 1
+            connections_before = self._connection_count()
+            attempt_started = time.perf_counter()
+            try:
+                response = self._session.post(
+                    url,
+                    json=payload,
+                    headers={"x-goog-api-key": api_key},
+                    timeout=(self.connect_timeout, self.read_timeout),
+                    stream=True
+                )
+                # elapsed covers connect + TLS (if any) + server time to first byte
+                timing["ttfb_ms"] = response.elapsed.total_seconds() * 1000
+                if read_body or response.status_code != 200:
+                    response.content
+                    timing["download_ms"] = (time.perf_counter() - attempt_started) * 1000 - timing["ttfb_ms"]
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout):
+                # Nothing reached the model, so retrying is safe and cheap
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                timing["backoff_ms"] += delay * 1000
+                time.sleep(delay)
+                attempt += 1
+                continue
+            finally:
+                if self._connection_count() > connections_before:
+                    timing["new_connection"] = True
+
+            timing["status_code"] = response.status_code
+            if response.status_code == 200:
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            retryable = response.status_code in RETRYABLE_STATUS_CODES and (retry_quota or response.status_code != 429)
+            if retryable and attempt < self.max_retries:
+                delay = retry_after if retry_after is not None else self.backoff_delay(attempt)
+                if delay <= self.max_retry_after:
+                    timing["backoff_ms"] += delay * 1000
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+
+            raise GeminiAPIError(
+                response.status_code,
+                response.content[:200].decode("utf-8", errors="replace"),
+                retry_after=retry_after,
+                timing=timing
+            )
+
+    def _record(self, timing, started, failed):
+        timing["total_ms"] = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["attempts"] += timing["attempts"]
+            self._stats["retries"] += timing["attempts"] - 1
+            if failed:
+                self._stats["errors"] += 1
+            if timing["new_connection"]:
+                self._stats["new_connections"] += 1
+            self._timings.append(dict(timing))
+
+    def generate_content(self, payload, api_key, model=DEFAULT_MODEL, retry_quota=True):
+        """
+        Call generateContent with pooling, timeouts and retries.
+
+        Args:
+            payload (dict): Request body (contents, generationConfig, ...).
+            api_key (str): Gemini API key.
+            model (str): Model name.
+            retry_quota (bool): Retry 429s here; False when a caller such as
+                model_router fails over to another model instead.
+
+        Returns:
+            tuple: (response JSON dict, timing dict for this request).
+
+        Raises:
+            GeminiAPIError: Non-200 response once retries are exhausted.
+            requests.exceptions.RequestException: Network failure or read timeout.
+        """
+        timing = self._new_timing(model)
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = self._post(self.endpoint(model), payload, api_key, timing, retry_quota=retry_quota)
+            result = response.json()
+            failed = False
+            return result, timing
+        finally:
+            self._record(timing, started, failed)
+
+    def stream_generate_content(self, payload, api_key, model=DEFAULT_MODEL, on_text=None, should_stop=None,
+                                retry_quota=True):
+        """
+        Call streamGenerateContent (server-sent events) and accumulate the text.
+
+        Retries apply only until the stream starts. The connection is
+        closed as soon as should_stop() returns True, so the rest of the
+        answer is never generated or downloaded.
+
+        Args:
+            payload (dict): Request body.
+            api_key (str): Gemini API key.
+            model (str): Model name.
+            on_text (callable): Called with the accumulated text after every chunk.
+            should_stop (callable): Called with the accumulated text; True cancels the stream.
+            retry_quota (bool): As for generate_content().
+
+        Returns:
+            tuple: (generateContent-shaped response dict holding the accumulated
+                text, timing dict with "first_chunk_ms" and "cancelled").
+
+        Raises:
+            GeminiAPIError: Non-200 response once retries are exhausted.
+            requests.exceptions.RequestException: Network failure or read timeout.
+        """
+        timing = self._new_timing(model)
+        timing["first_chunk_ms"] = None
+        timing["cancelled"] = False
+        started = time.perf_counter()
+        failed = True
+        url = self.endpoint(model, "streamGenerateContent") + "?alt=sse"
+        try:
+            response = self._post(url, payload, api_key, timing, read_body=False, retry_quota=retry_quota)
+            text = ""
+            try:
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    chunk = json.loads(line[5:].strip())
+                    for candidate in chunk.get("candidates", [])[:1]:
+                        for part in candidate.get("content", {}).get("parts", []):
+                            text += part.get("text", "")
+                    if timing["first_chunk_ms"] is None:
+                        timing["first_chunk_ms"] = (time.perf_counter() - started) * 1000
+                    if on_text:
+                        on_text(text)
+                    if should_stop and should_stop(text):
+                        timing["cancelled"] = True
+                        break
+            finally:
+                response.close()
+            timing["download_ms"] = (time.perf_counter() - started) * 1000 - timing["ttfb_ms"]
+            failed = False
+            return {"candidates": [{"content": {"parts": [{"text": text}]}}]}, timing
+        finally:
+            self._record(timing, started, failed)
+
+    def recent_timings(self):
+        """Timing dicts for the most recent requests, oldest first."""
+        with self._lock:
+            return list(self._timings)
+
+    def stats(self):
+        """
+        Summarise client activity.
+
+        Time to first byte is split by whether the request opened a new
+        connection, so the gap between the two averages is the handshake cost.
+
+        Returns:
+            dict: Counters plus average total, new-connection and reused-connection latency in ms.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            timings = list(self._timings)
+
+        def average(values):
+            return sum(values) / len(values) if values else 0.0
+
+        stats["avg_total_ms"] = average([t["total_ms"] for t in timings])
+        stats["avg_ttfb_new_connection_ms"] = average([t["ttfb_ms"] for t in timings if t["new_connection"]])
+        stats["avg_ttfb_reused_connection_ms"] = average([t["ttfb_ms"] for t in timings if not t["new_connection"]])
+        return stats
+
+    def close(self):
+        """Close pooled connections."""
+        self._session.close()
+
+
+_client = None
+_client_config = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client():
+    """Return the process-wide Gemini client, rebuilding it after a config reload."""
+    global _client, _client_config
+    config = get_config()
+    if _client is None or _client_config is not config:
+        with _client_lock:
+            if _client is None or _client_config is not config:
+                # The old client is left to finish any in-flight requests
+                _client = GeminiClient(
+                    base_url=config["gemini_api_base"],
+                    pool_size=config["gemini_pool_size"],
+                    connect_timeout=config["gemini_connect_timeout"],
+                    read_timeout=config["gemini_read_timeout"],
+                    max_retries=config["gemini_max_retries"]
+                )
+                _client_config = config
+    return _client
@@ -1,29 +1,56 @@
 # gemini_service.py
+from functools import partial
+
 import google.generativeai as genai
-import os
-from dotenv import load_dotenv
+from google.api_core import exceptions as google_exceptions
+
+from config_service import GEMINI_API_BASE, get_config
+from food_database import get_fallback_nutrition
+from gemini_client import GeminiAPIError
+from model_router import get_model_router
 
-# Load environment variables (for local .env file)
-load_dotenv()
+# (key, endpoint) the SDK is currently configured with, so genai.configure runs once
+_configured = None
 
 def init_gemini():
     """Initialize the Gemini API client with the API key."""
-    # Try to get API key from environment variable
-    api_key = os.getenv("GEMINI_API_KEY")
+    global _configured
+    # Key and endpoint are resolved once per process from secrets, environment or .env
+    config = get_config()
+    api_key = config["gemini_api_key"]
+    api_base = config["gemini_api_base"]
     
     if not api_key:
         print("Warning: GEMINI_API_KEY not found in environment.")
         print("The app will use demo nutrition data.")
         return False
     
+    if (api_key, api_base) == _configured:
+        return True
+    
     try:
         # Configure the API key for the library
-        genai.configure(api_key=api_key)
+        options = {}
+        if api_base != GEMINI_API_BASE:
+            # Overridden endpoint (e.g. benchmarks/mock_gemini.py); the SDK adds the version path
+            endpoint = api_base.rstrip("/").rsplit("/v1", 1)[0]
+            options = {"transport": "rest", "client_options": {"api_endpoint": endpoint}}
+        genai.configure(api_key=api_key, **options)
+        _configured = (api_key, api_base)
         return True
     except Exception as e:
         print(f"Error configuring Gemini API: {e}")
         return False
 
+def _generate(prompt, model_name):
+    """Run one SDK call, reporting quota and unknown-model errors the way model_router expects."""
+    try:
+        return genai.GenerativeModel(model_name).generate_content(prompt)
+    except google_exceptions.ResourceExhausted as e:
+        raise GeminiAPIError(429, str(e)) from e
+    except google_exceptions.NotFound as e:
+        raise GeminiAPIError(404, str(e)) from e
+
 def analyze_food_text(food_name):
     """
     Analyze a food item using Gemini AI based on text description.
@@ -37,9 +64,6 @@ def analyze_food_text(food_name):
     # First, try to use the actual Gemini API
     if init_gemini():
         try:
-            # Initialize the model (using a text model since we have no image)
-            model = genai.GenerativeModel('gemini-pro')
-            
             # Create a detailed prompt for Indian food context
             prompt = f"""
             Analyze this food item for nutrition: "{food_name}"
@@ -69,8 +93,8 @@ def analyze_food_text(food_name):
             Ensure all values are numbers (not strings) for calories, protein, carbs, and fats.
             """
             
-            # Generate the response
-            response = model.generate_content(prompt)
+            # Generate the response on the fastest text model with quota left
+            response = get_model_router().call("text", partial(_generate, prompt))
             response_text = response.text
             
             # Extract JSON from the response (it might have markdown or extra text)
@@ -98,71 +122,18 @@ def analyze_food_text(food_name):
 
 def get_demo_nutrition(food_name):
     """
-    Provide demo nutrition data for common foods when Gemini API is unavailable.
+    Provide nutrition data for common foods when Gemini API is unavailable.
+    
+    Uses the same food database as the app (food_database), so both
+    report the same values for the same food.
     
     Args:
         food_name (str): The name of the food.
         
     Returns:
-        dict: Predefined nutrition information.
+        dict: Nutrition information from the food database.
     """
-    food_db = {
-        "apple": {"calories": 95, "protein": 0.5, "carbs": 25, "fats": 0.3, 
-                  "insight": "Low calorie fruit rich in fiber and vitamins."},
-        "banana": {"calories": 105, "protein": 1.3, "carbs": 27, "fats": 0.4,
-                   "insight": "Good source of potassium and quick energy."},
-        "rice": {"calories": 200, "protein": 4, "carbs": 45, "fats": 1,
-                 "insight": "Primary carbohydrate source, provides sustained energy."},
-        "chapati": {"calories": 120, "protein": 3, "carbs": 20, "fats": 2,
-                    "insight": "Whole wheat provides fiber and sustained energy."},
-        "dal": {"calories": 150, "protein": 8, "carbs": 25, "fats": 3,
-                "insight": "Excellent plant-based protein and fiber source."},
-        "chicken curry": {"calories": 350, "protein": 25, "carbs": 10, "fats": 20,
-                          "insight": "High quality protein, watch portion size for fats."},
-        "paneer": {"calories": 280, "protein": 18, "carbs": 8, "fats": 20,
-                   "insight": "Rich in protein and calcium, moderate in fats."},
-        "egg": {"calories": 78, "protein": 6, "carbs": 0.6, "fats": 5,
-                "insight": "Complete protein source with essential nutrients."},
-        "milk": {"calories": 150, "protein": 8, "carbs": 12, "fats": 8,
-                 "insight": "Good source of calcium, protein, and vitamins."},
-        "butter chicken": {"calories": 450, "protein": 30, "carbs": 15, "fats": 30,
-                           "insight": "High in protein but also high in calories and fats."},
-        "biryani": {"calories": 400, "protein": 20, "carbs": 60, "fats": 12,
-                    "insight": "Balanced meal with carbs, protein, but can be calorie-dense."},
-        "idli": {"calories": 80, "protein": 3, "carbs": 15, "fats": 0.5,
-                 "insight": "Light, fermented food that's easy to digest."},
-        "dosa": {"calories": 150, "protein": 4, "carbs": 25, "fats": 4,
-                 "insight": "Fermented crepe, good source of carbohydrates."},
-        "sambar": {"calories": 100, "protein": 5, "carbs": 15, "fats": 3,
-                   "insight": "Lentil-based stew rich in protein and vegetables."}
-    }
-    
-    # Try to find exact or partial match
-    food_lower = food_name.lower()
-    
-    # Check for exact match
-    if food_lower in food_db:
-        result = food_db[food_lower].copy()
-        result["food_name"] = food_name
-        return result
-    
-    # Check for partial matches (e.g., "chicken" in "butter chicken")
-    # FIXED LINE 73: Added the missing colon
-    for key, value in food_db.items():  # ← THIS LINE WAS MISSING THE COLON
-        if key in food_lower or food_lower in key:
-            result = value.copy()
-            result["food_name"] = food_name
-            return result
-    
-    # Default fallback for unknown foods
-    return {
-        "food_name": food_name,
-        "calories": 200,
-        "protein": 10,
-        "carbs": 25,
-        "fats": 8,
-        "insight": "Estimated nutrition values based on typical foods."
-    }
+    return get_fallback_nutrition(food_name)
 
 # For future use: Function to analyze food from image (when you have Storage)
 def analyze_food_image(image_bytes=None, image_url=None):
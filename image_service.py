@@ -0,0 +1,273 @@
+# image_service.py
+import io
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+from config_service import get_config
+
+# Gemini reads food photos and labels fine at this size; phone photos are ~4000 px
+DEFAULT_MAX_EDGE = 1024
+DEFAULT_TARGET_BYTES = 150 * 1024
+MIN_QUALITY = 40
+MAX_QUALITY = 90
+# Display thumbnails are rendered at this multiple of their on-screen width (sharp on HiDPI screens)
+THUMBNAIL_SCALE = 2
+
+
+def load_image(source, max_edge=DEFAULT_MAX_EDGE):
+    """
+    Decode an upload, apply EXIF orientation and downscale it.
+
+    For JPEG bytes, Pillow's draft mode lets the decoder scale by 1/2, 1/4
+    or 1/8 while decoding, so a 12 MP photo never materialises at full size.
+    The remaining reduction uses reduce() + resampling via thumbnail().
+
+    Args:
+        source (bytes or PIL.Image.Image): Raw upload bytes or an already decoded image.
+        max_edge (int): Longest edge of the returned image, in pixels.
+
+    Returns:
+        PIL.Image.Image: RGB image no larger than max_edge on either side.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(source))
+        if image.format == "JPEG":
+            image.draft("RGB", (max_edge, max_edge))
+    else:
+        image = source
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > max_edge:
+        image = image.copy() if image is source else image
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=2.0)
+    return image
+
+
+def _encode(image, quality):
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=quality, optimize=True)
+    return buffered.getvalue()
+
+
+def encode_jpeg(image, target_bytes=DEFAULT_TARGET_BYTES, min_quality=MIN_QUALITY, max_quality=MAX_QUALITY):
+    """
+    Encode an image as JPEG at the highest quality that fits the byte budget.
+
+    Binary-searches the quality setting (usually 3-4 encodes). If even
+    min_quality is over budget, the min_quality encoding is returned.
+
+    Args:
+        image (PIL.Image.Image): RGB image, normally from load_image().
+        target_bytes (int): Payload budget in bytes.
+        min_quality (int): Lowest JPEG quality to consider.
+        max_quality (int): Highest JPEG quality to consider.
+
+    Returns:
+        tuple: (jpeg bytes, chosen quality).
+    """
+    best = _encode(image, max_quality)
+    if len(best) <= target_bytes:
+        return best, max_quality
+
+    best_quality = None
+    low, high = min_quality, max_quality - 1
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(image, quality)
+        if len(data) <= target_bytes:
+            best, best_quality = data, quality
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    if best_quality is None:
+        return _encode(image, min_quality), min_quality
+    return best, best_quality
+
+
+def prepare_image_payload(source, max_edge=DEFAULT_MAX_EDGE, target_bytes=DEFAULT_TARGET_BYTES, input_bytes=None):
+    """
+    Full preprocessing pipeline: orient, downscale, adaptively encode.
+
+    Args:
+        source (bytes or PIL.Image.Image): Raw upload bytes or a decoded image.
+        max_edge (int): Longest edge to send, in pixels.
+        target_bytes (int): JPEG payload budget in bytes.
+        input_bytes (int): Size of the original upload, for the log, when
+            source is an already decoded image.
+
+    Returns:
+        tuple: (jpeg bytes, info dict with sizes, quality and timings).
+    """
+    started = time.perf_counter()
+    if isinstance(source, Image.Image):
+        original_size = source.size
+    else:
+        # Only the header is read here; decoding happens in load_image()
+        original_size = Image.open(io.BytesIO(source)).size
+    image = load_image(source, max_edge)
+    decoded = time.perf_counter()
+    jpeg_bytes, quality = encode_jpeg(image, target_bytes)
+    finished = time.perf_counter()
+
+    info = {
+        "input_bytes": len(source) if isinstance(source, (bytes, bytearray)) else input_bytes,
+        "original_size": original_size,
+        "sent_size": image.size,
+        "quality": quality,
+        "payload_bytes": len(jpeg_bytes),
+        "decode_ms": (decoded - started) * 1000,
+        "encode_ms": (finished - decoded) * 1000,
+    }
+    log_payload(info)
+    return jpeg_bytes, info
+
+
+def log_payload(info):
+    """Print one line per prepared image so size vs. latency can be tuned."""
+    input_size = "n/a" if info["input_bytes"] is None else f"{info['input_bytes'] / 1024:.1f} KB"
+    print(
+        f"Image payload: {info['sent_size'][0]}x{info['sent_size'][1]} q={info['quality']} "
+        f"{info['payload_bytes'] / 1024:.1f} KB (input {input_size}), "
+        f"decode {info['decode_ms']:.1f} ms, encode {info['encode_ms']:.1f} ms"
+    )
+
+
+def _read(data):
+    return data() if callable(data) else data
+
+
+class UploadCache:
+    """
+    Decoded uploads keyed by Streamlit's upload file_id.
+
+    Streamlit reruns the script on every interaction, so without this the
+    same photo is decoded again each time and st.image() ships the
+    full-resolution original to the browser. An entry keeps the original's
+    format/size/mode, small JPEG thumbnails per display width, and the
+    analysis-sized decoded image until release_image() drops it. Entries
+    are evicted least recently used once max_bytes is exceeded.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_edge=DEFAULT_MAX_EDGE):
+        self.max_bytes = max_bytes
+        self.max_edge = max_edge
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {"decodes": 0, "hits": 0, "evictions": 0, "released": 0}
+
+    @staticmethod
+    def _size(entry):
+        image = entry["image"]
+        pixels = image.width * image.height * len(image.getbands()) if image is not None else 0
+        return pixels + sum(len(data) for data in entry["thumbnails"].values())
+
+    def _store(self, upload_id, entry):
+        """(Re)account an entry and evict the least recently used ones over budget."""
+        with self._lock:
+            old = self._entries.pop(upload_id, None)
+            if old is not None:
+                self._bytes -= old["bytes"]
+            entry["bytes"] = self._size(entry)
+            self._entries[upload_id] = entry
+            self._bytes += entry["bytes"]
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["bytes"]
+                self._stats["evictions"] += 1
+
+    def _entry(self, upload_id, data):
+        """The cached entry, plus the upload bytes if they had to be read (a miss)."""
+        with self._lock:
+            entry = self._entries.get(upload_id)
+            if entry is not None:
+                self._entries.move_to_end(upload_id)
+                self._stats["hits"] += 1
+                return entry, None
+        raw = _read(data)
+        header = Image.open(io.BytesIO(raw))
+        entry = {"format": header.format, "size": header.size, "mode": header.mode, "thumbnails": {},
+                 "image": load_image(raw, self.max_edge)}
+        with self._lock:
+            self._stats["decodes"] += 1
+        self._store(upload_id, entry)
+        return entry, raw
+
+    def info(self, upload_id, data):
+        """
+        Format, size and mode of the original upload.
+
+        Args:
+            upload_id (str): Streamlit UploadedFile.file_id.
+            data (bytes or callable): Upload bytes, or a function returning
+                them (e.g. UploadedFile.getvalue) so they are read only when needed.
+
+        Returns:
+            dict: "format", "size" and "mode".
+        """
+        entry, _ = self._entry(upload_id, data)
+        return {"format": entry["format"], "size": entry["size"], "mode": entry["mode"]}
+
+    def image(self, upload_id, data):
+        """The upload decoded by load_image(), oriented and downscaled to max_edge (again only if released)."""
+        entry, raw = self._entry(upload_id, data)
+        if entry["image"] is None:
+            entry["image"] = load_image(raw if raw is not None else _read(data), self.max_edge)
+            with self._lock:
+                self._stats["decodes"] += 1
+            self._store(upload_id, entry)
+        return entry["image"]
+
+    def thumbnail(self, upload_id, data, width):
+        """
+        JPEG bytes for showing the upload at the given on-screen width.
+
+        Rendered once per width (at THUMBNAIL_SCALE times the width) from
+        the decoded image, or straight from the upload if it was released.
+        """
+        entry, raw = self._entry(upload_id, data)
+        thumbnail = entry["thumbnails"].get(width)
+        if thumbnail is None:
+            if entry["image"] is not None:
+                source = entry["image"]
+            else:
+                source = raw if raw is not None else _read(data)
+            thumbnail = _encode(load_image(source, width * THUMBNAIL_SCALE), 85)
+            entry["thumbnails"][width] = thumbnail
+            self._store(upload_id, entry)
+        return thumbnail
+
+    def release_image(self, upload_id):
+        """Drop the decoded image once the analysis payload has been built; thumbnails stay."""
+        with self._lock:
+            entry = self._entries.get(upload_id)
+            if entry is None or entry["image"] is None:
+                return
+            self._stats["released"] += 1
+        entry["image"] = None
+        self._store(upload_id, entry)
+
+    def stats(self):
+        """Counters plus entry count and approximate bytes held."""
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+
+
+_upload_cache = None
+_upload_cache_lock = threading.Lock()
+
+
+def get_upload_cache():
+    """Return the process-wide upload cache (UPLOAD_CACHE_MB of decoded images and thumbnails)."""
+    global _upload_cache
+    if _upload_cache is None:
+        with _upload_cache_lock:
+            if _upload_cache is None:
+                _upload_cache = UploadCache(max_bytes=int(get_config()["upload_cache_mb"] * 1024 * 1024))
+    return _upload_cache
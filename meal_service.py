@@ -0,0 +1,183 @@
+# meal_service.py
+import json
+import re
+
+from food_database import get_food_knowledge
+from nutrition_parser import (
+    MEAL_RESPONSE_SCHEMA, NUTRIENT_FIELDS, NutritionRecord, NutritionValidationError,
+    schema_generation_config
+)
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "half": 0.5,
+}
+
+# Separators between dishes: commas, semicolons, "+", "&", newlines and the word "and"
+# ("mac and cheese" stays whole when it is a known dish)
+ITEM_SEPARATORS = re.compile(r"\s*(,|;|\+|&|\n|\band\b)\s*", re.IGNORECASE)
+
+# Weights and volumes: "200g rice" is an amount of one dish, not 200 servings
+UNITS = r"(?:g|gm|gms|grams?|kg|kgs|ml|l|ltr|litres?|liters?|cups?|oz)"
+
+# "2 idli", "2x idli", "1/2 cup dal"; a number run into a word ("7up") is part of the name
+QUANTITY_PATTERN = re.compile(
+    rf"^(\d+/\d+|\d+(?:\.\d+)?)(?:\s*(?:x\b|×)\s*|\s*({UNITS})\b\s*(?:of\s+)?|\s+)(.*)$",
+    re.IGNORECASE
+)
+
+# A bare number above this is an amount ("500 rice" means grams), not a serving count
+MAX_SERVINGS = 20
+
+
+def _joins_dish(left, right):
+    """True if a known dish name runs across "left and right", as in "mac and cheese"."""
+    left, right = left.lower(), right.lower()
+    term = get_food_knowledge().matcher.find(f"{left} and {right}")
+    return term is not None and " and " in term and term not in left and term not in right
+
+
+def _split_items(text):
+    pieces = ITEM_SEPARATORS.split(text)
+    parts = [pieces[0]]
+    for separator, piece in zip(pieces[1::2], pieces[2::2]):
+        if separator.lower() in ("and", "&") and _joins_dish(parts[-1], piece):
+            parts[-1] = f"{parts[-1]} {separator} {piece}"
+        else:
+            parts.append(piece)
+    return parts
+
+
+def parse_meal_description(meal_input):
+    """
+    Split a meal description into individual food items with quantities.
+
+    A leading count ("2 chapati", "half plate poha") becomes the quantity.
+    A weight or volume ("200g rice", "1 cup milk") is not a count: the item
+    keeps quantity 1, its name keeps the amount and "amount" holds it.
+
+    Args:
+        meal_input (str or list): e.g. "2 chapati, dal tadka, rice and curd",
+            or a list of food names.
+
+    Returns:
+        list: Dicts with "name" (str), "quantity" (float) and, for weighed
+            items, "amount" (str), in input order.
+    """
+    if isinstance(meal_input, (list, tuple)):
+        parts = [str(part) for part in meal_input]
+    else:
+        parts = _split_items(meal_input or "")
+
+    items = []
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+
+        quantity = 1.0
+        amount = None
+        match = QUANTITY_PATTERN.match(part)
+        if match and match.group(3):
+            number, unit = match.group(1), match.group(2)
+            if "/" in number:
+                numerator, denominator = number.split("/")
+                value = float(numerator) / float(denominator) if float(denominator) else 1.0
+            else:
+                value = float(number)
+            if unit:
+                amount = f"{number} {unit}"
+            elif value > MAX_SERVINGS:
+                amount = number
+            else:
+                quantity, part = value, match.group(3)
+        else:
+            words = part.split(None, 1)
+            if len(words) == 2 and words[0].lower() in NUMBER_WORDS:
+                quantity = float(NUMBER_WORDS[words[0].lower()])
+                part = words[1]
+
+        item = {"name": part.strip(), "quantity": quantity}
+        if amount:
+            item["amount"] = amount
+        items.append(item)
+    return items
+
+
+def build_meal_payload(food_names):
+    """
+    Build one generateContent payload that analyzes several foods at once.
+
+    Args:
+        food_names (list): Food names still needing AI analysis.
+
+    Returns:
+        dict: Request body for the Gemini REST API.
+    """
+    numbered = "\n".join(f"{i + 1}. {name}" for i, name in enumerate(food_names))
+    prompt = f"""Analyze each of these foods separately, assuming one typical Indian portion of each
+            unless an amount is given:
+            {numbered}
+
+            Return exactly {len(food_names)} nutrition objects, in the same order,
+            with a brief nutritional insight for each."""
+
+    return {
+        "contents": [{
+            "parts": [{"text": prompt}]
+        }],
+        "generationConfig": schema_generation_config(MEAL_RESPONSE_SCHEMA, 200 + 150 * len(food_names))
+    }
+
+
+def parse_meal_response(response_text, expected_count):
+    """
+    Strictly parse and validate the JSON array returned for a batched meal request.
+
+    Args:
+        response_text (str): Text of the first candidate.
+        expected_count (int): Number of foods that were sent.
+
+    Returns:
+        list or None: One nutrition dict per food, or None if the reply is unusable.
+    """
+    try:
+        items = json.loads(response_text)
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != expected_count:
+        return None
+
+    try:
+        return [NutritionRecord.from_dict(item).to_dict() for item in items]
+    except NutritionValidationError:
+        return None
+
+
+def scale_nutrition(nutrition, quantity):
+    """Return a copy of a per-portion nutrition dict multiplied by quantity."""
+    scaled = dict(nutrition)
+    for field in NUTRIENT_FIELDS:
+        scaled[field] = round(nutrition.get(field, 0) * quantity, 1)
+    return scaled
+
+
+def combine_meal(meal_description, items):
+    """
+    Combine per-item nutrition into a single loggable meal entry.
+
+    Args:
+        meal_description (str): Original text, used as the meal name.
+        items (list): Scaled per-item nutrition dicts, each with "quantity" and "source".
+
+    Returns:
+        dict: Meal totals plus the item breakdown under "items".
+    """
+    totals = {field: int(round(sum(item.get(field, 0) for item in items))) for field in NUTRIENT_FIELDS}
+    names = ", ".join(item["food_name"] for item in items)
+    return {
+        "food_name": meal_description.strip().title() if isinstance(meal_description, str) else names,
+        **totals,
+        "insight": f"Meal of {len(items)} items: {names}",
+        "items": items,
+    }
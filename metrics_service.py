@@ -0,0 +1,280 @@
+# metrics_service.py
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config_service import get_config
+
+# Seconds; spans a cache hit (~1 ms) to a slow Gemini call with retries
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, one series per label combination."""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """Latency distribution with cumulative buckets, _sum and _count."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # One slot per bucket plus a last one for observations above the top bound
+                series = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series["counts"][index] += 1
+                    break
+            else:
+                series["counts"][-1] += 1
+            series["sum"] += seconds
+            series["count"] += 1
+
+    def time(self, **labels):
+        """
+        Context manager / decorator observing the elapsed time.
+
+        If the histogram has an "outcome" label it is filled in as "ok",
+        or "error" when the block raises.
+        """
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, dict(series, counts=list(series["counts"]))) for key, series in self._values.items())
+        lines = self.header()
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                labels = key + (("le", _format_value(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        labels = dict(self.labels)
+        if "outcome" in self.histogram.labelnames and "outcome" not in labels:
+            labels["outcome"] = "error" if exc_type else "ok"
+        self.histogram.observe(time.perf_counter() - self._started, **labels)
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class _CallbackMetric:
+    """Values read at scrape time from a function returning [(labels dict, value), ...]."""
+
+    def __init__(self, name, help_text, type_name, fn):
+        self.name = name
+        self.help_text = help_text
+        self.type_name = type_name
+        self.fn = fn
+
+    def render(self):
+        try:
+            samples = self.fn()
+        except Exception as e:
+            print(f"Metric {self.name} failed: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide collection of metrics rendered in Prometheus text format.
+
+    counter() / histogram() return the existing metric when called again
+    with the same name, so definitions survive Streamlit reruns of app.py.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(name, lambda: Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(name, lambda: Histogram(name, help_text, labelnames, buckets))
+
+    def register_callback(self, name, help_text, fn, type_name="gauge"):
+        """Expose values computed at scrape time (e.g. existing stats() dicts); replaces any earlier fn."""
+        with self._lock:
+            self._metrics[name] = _CallbackMetric(name, help_text, type_name, fn)
+
+    def render(self):
+        """All metrics in Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """Write render() atomically, e.g. for node_exporter's textfile collector."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = get_metrics_registry().render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_registry = None
+_exporter_started = False
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry():
+    """Return the process-wide metrics registry."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry()
+    return _registry
+
+
+def start_metrics_exporter():
+    """
+    Start the configured exporters once per process; later calls do nothing.
+
+    METRICS_PORT serves /metrics over HTTP on that port; METRICS_FILE is
+    rewritten every METRICS_FILE_INTERVAL seconds. Both are off by default.
+    """
+    global _exporter_started
+    if _exporter_started:
+        return
+    with _registry_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+
+    config = get_config()
+    if config["metrics_port"]:
+        try:
+            server = ThreadingHTTPServer((config["metrics_host"], config["metrics_port"]), _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"Metrics: http://{config['metrics_host']}:{config['metrics_port']}/metrics")
+        except OSError as e:
+            print(f"Metrics server not started: {e}")
+
+    if config["metrics_file"]:
+        def write_periodically():
+            while True:
+                try:
+                    get_metrics_registry().write_file(config["metrics_file"])
+                except OSError as e:
+                    print(f"Could not write metrics file: {e}")
+                time.sleep(config["metrics_file_interval"])
+
+        threading.Thread(target=write_periodically, name="metrics-file", daemon=True).start()
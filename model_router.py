@@ -0,0 +1,195 @@
+# model_router.py
+import threading
+import time
+from collections import deque
+
+from config_service import get_config
+from gemini_client import GeminiAPIError
+
+# Tried after the configured GEMINI_MODEL when GEMINI_MODELS is not set; each
+# model has its own quota, so these keep the AI path alive when one runs out
+FALLBACK_MODELS = ("gemini-2.5-flash", "gemini-2.0-flash")
+
+# Older text-only model families; everything else Gemini ships accepts images
+TEXT_ONLY_PREFIXES = ("gemini-pro", "gemini-1.0-pro", "gemma")
+
+# How long a model is skipped after a 429 without Retry-After, and after a 404
+QUOTA_COOLDOWN_SECONDS = 60
+UNAVAILABLE_COOLDOWN_SECONDS = 3600
+
+
+def supports_vision(model):
+    """True if the model accepts inline images."""
+    name = model.split("/")[-1]
+    return "vision" in name or not name.startswith(TEXT_ONLY_PREFIXES)
+
+
+class _ModelState:
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True for a failed call
+        self.skip_until = 0.0
+        self.requests = 0
+        self.failovers = 0
+
+
+class ModelRouter:
+    """
+    Pick a Gemini model per request from an ordered list of candidates.
+
+    Healthy models with measured latency come first, fastest (median of
+    recent successes) first; unmeasured ones follow in list order, and
+    models with a high recent error rate are kept as a last resort. Image
+    and label scans only go to vision-capable models. A 429 (quota) or
+    404 (unknown model) skips that model for a cooldown and the request
+    fails over to the next candidate; other errors are raised as usual.
+    """
+
+    def __init__(self, models, window=50, min_samples=3, max_error_rate=0.5):
+        self.models = list(dict.fromkeys(models))
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self._lock = threading.Lock()
+        self._states = {model: _ModelState(window) for model in self.models}
+
+    def _median_latency(self, state):
+        if len(state.latencies) < self.min_samples:
+            return None
+        latencies = sorted(state.latencies)
+        return latencies[len(latencies) // 2]
+
+    def _error_rate(self, state):
+        return sum(state.outcomes) / len(state.outcomes) if state.outcomes else 0.0
+
+    def candidates(self, kind="text"):
+        """
+        Models to try for one request, best first.
+
+        Args:
+            kind (str): "text", or "image" to restrict to vision-capable models.
+
+        Returns:
+            list: Model names; empty when every suitable model is cooling down.
+        """
+        now = time.monotonic()
+        measured, unmeasured, unhealthy = [], [], []
+        with self._lock:
+            for index, model in enumerate(self.models):
+                state = self._states[model]
+                if kind == "image" and not supports_vision(model):
+                    continue
+                if state.skip_until > now:
+                    continue
+                median = self._median_latency(state)
+                if len(state.outcomes) >= self.min_samples and self._error_rate(state) > self.max_error_rate:
+                    unhealthy.append((index, model))
+                elif median is None:
+                    unmeasured.append((index, model))
+                else:
+                    measured.append((median, index, model))
+        return [entry[-1] for entry in sorted(measured) + unmeasured + unhealthy]
+
+    def record(self, model, seconds=None, failed=False):
+        """Record one call's outcome; seconds is the latency of a success."""
+        with self._lock:
+            state = self._states.setdefault(model, _ModelState(self.window))
+            state.requests += 1
+            state.outcomes.append(failed)
+            if not failed and seconds is not None:
+                state.latencies.append(seconds)
+
+    def skip(self, model, seconds):
+        """Leave the model out of candidates() for the given time."""
+        with self._lock:
+            state = self._states.setdefault(model, _ModelState(self.window))
+            state.skip_until = max(state.skip_until, time.monotonic() + seconds)
+            state.failovers += 1
+
+    def call(self, kind, fn):
+        """
+        Run fn(model) on the best candidate, failing over on quota errors.
+
+        Args:
+            kind (str): "text" or "image".
+            fn (callable): Takes a model name and performs the request.
+
+        Returns:
+            The value of the first call that succeeds.
+
+        Raises:
+            GeminiAPIError: Every candidate is out of quota (the last 429), a
+                non-quota API error from the chosen model, or (400) no
+                configured model can serve the kind.
+            Exception: Whatever fn() raised for other failures.
+        """
+        models = self.candidates(kind)
+        if not models:
+            # Everything is cooling down; let the preferred model answer for itself
+            models = [model for model in self.models if kind != "image" or supports_vision(model)][:1]
+        if not models:
+            raise GeminiAPIError(400, f"no {'vision-capable ' if kind == 'image' else ''}model configured in GEMINI_MODELS")
+        last_error = None
+        for model in models:
+            started = time.perf_counter()
+            try:
+                result = fn(model)
+            except GeminiAPIError as e:
+                if e.status_code == 429:
+                    # Out of quota says nothing about the model's health
+                    self.skip(model, e.retry_after or QUOTA_COOLDOWN_SECONDS)
+                elif e.status_code == 404:
+                    self.record(model, failed=True)
+                    self.skip(model, UNAVAILABLE_COOLDOWN_SECONDS)
+                else:
+                    self.record(model, failed=True)
+                    raise
+                print(f"Gemini model {model} unavailable ({e.status_code}); trying the next one")
+                last_error = e
+                continue
+            except Exception:
+                self.record(model, failed=True)
+                raise
+            self.record(model, time.perf_counter() - started)
+            return result
+        raise last_error
+
+    def stats(self):
+        """Per-model requests, median latency (ms), error rate, cooldown and failovers."""
+        now = time.monotonic()
+        with self._lock:
+            stats = {}
+            for model, state in self._states.items():
+                median = self._median_latency(state)
+                stats[model] = {
+                    "requests": state.requests,
+                    "median_ms": median * 1000 if median is not None else None,
+                    "error_rate": self._error_rate(state),
+                    "cooldown": max(0.0, state.skip_until - now),
+                    "failovers": state.failovers,
+                    "vision": supports_vision(model),
+                }
+        return stats
+
+
+_router = None
+_router_config = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """
+    Return the process-wide model router.
+
+    Candidates come from GEMINI_MODELS (comma separated), else GEMINI_MODEL
+    followed by FALLBACK_MODELS; the router is rebuilt after a config reload.
+    """
+    global _router, _router_config
+    config = get_config()
+    if _router is None or _router_config is not config:
+        with _router_lock:
+            if _router is None or _router_config is not config:
+                models = [name.strip() for name in (config["gemini_models"] or "").split(",") if name.strip()]
+                _router = ModelRouter(models or [config["gemini_model"], *FALLBACK_MODELS])
+                _router_config = config
+    return _router
@@ -0,0 +1,224 @@
+# nutrition_parser.py
+import json
+import re
+from dataclasses import dataclass
+
+NUTRIENT_FIELDS = ["calories", "protein", "carbs", "fats"]
+REQUIRED_FIELDS = ["food_name"] + NUTRIENT_FIELDS + ["insight"]
+
+# Structured output: Gemini returns exactly this JSON, fields in this order
+NUTRITION_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "food_name": {"type": "STRING"},
+        "calories": {"type": "NUMBER"},
+        "protein": {"type": "NUMBER"},
+        "carbs": {"type": "NUMBER"},
+        "fats": {"type": "NUMBER"},
+        "insight": {"type": "STRING"},
+    },
+    "required": REQUIRED_FIELDS,
+    "propertyOrdering": REQUIRED_FIELDS,
+}
+
+MEAL_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": NUTRITION_RESPONSE_SCHEMA,
+}
+
+# Plausible range for one serving; anything outside is treated as a bad reply
+NUTRIENT_RANGES = {
+    "calories": (0, 3000),
+    "protein": (0, 300),
+    "carbs": (0, 500),
+    "fats": (0, 300),
+}
+
+# Energy from macros (4/4/9 kcal per g) must roughly agree with the calorie figure
+ENERGY_RATIO_RANGE = (0.35, 2.0)
+ENERGY_CHECK_MIN_CALORIES = 50
+
+# A string value counts only once its closing quote has arrived
+STRING_FIELD = r'"{}"\s*:\s*"((?:[^"\\]|\\.)*)"'
+# A number counts only once a delimiter after it has arrived ("12" may still become "120")
+NUMBER_FIELD = r'"{}"\s*:\s*"?(-?\d+(?:\.\d+)?)"?\s*[,}}\n]'
+
+
+class NutritionValidationError(ValueError):
+    """Raised when a model reply is malformed or nutritionally implausible."""
+
+
+@dataclass
+class NutritionRecord:
+    """One validated nutrition analysis."""
+
+    food_name: str
+    calories: int
+    protein: float
+    carbs: float
+    fats: float
+    insight: str
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a record from parsed JSON, enforcing types and plausible ranges.
+
+        Args:
+            data (dict): Decoded model output.
+
+        Returns:
+            NutritionRecord: The validated record.
+
+        Raises:
+            NutritionValidationError: A field is missing, mistyped or out of range.
+        """
+        if not isinstance(data, dict):
+            raise NutritionValidationError("expected a JSON object")
+
+        food_name = data.get("food_name")
+        if not isinstance(food_name, str) or not food_name.strip() or len(food_name) > 100:
+            raise NutritionValidationError("food_name must be a non-empty string")
+
+        values = {}
+        for field in NUTRIENT_FIELDS:
+            value = data.get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise NutritionValidationError(f"{field} must be a number")
+            low, high = NUTRIENT_RANGES[field]
+            if not low <= value <= high:
+                raise NutritionValidationError(f"{field}={value} outside {low}-{high}")
+            values[field] = value
+
+        # Zero macros with calories is legitimate for spirits (alcohol is 7 kcal/g)
+        if values["calories"] >= ENERGY_CHECK_MIN_CALORIES and any(values[field] for field in NUTRIENT_FIELDS[1:]):
+            macro_energy = 4 * values["protein"] + 4 * values["carbs"] + 9 * values["fats"]
+            ratio = macro_energy / values["calories"]
+            if not ENERGY_RATIO_RANGE[0] <= ratio <= ENERGY_RATIO_RANGE[1]:
+                raise NutritionValidationError(
+                    f"macros give {macro_energy:.0f} kcal but calories={values['calories']}"
+                )
+
+        insight = data.get("insight")
+        if not isinstance(insight, str) or not insight.strip():
+            insight = "Nutrition information provided by AI analysis"
+
+        return cls(
+            food_name=food_name.strip(),
+            insight=insight.strip(),
+            calories=int(round(values["calories"])),
+            **{field: round(float(values[field]), 1) for field in NUTRIENT_FIELDS[1:]}
+        )
+
+    def to_dict(self):
+        """Plain dict in the shape the rest of the app stores and displays."""
+        # Built by hand: dataclasses.asdict() deep-copies and dominates parse time
+        return {
+            "food_name": self.food_name,
+            "calories": self.calories,
+            "protein": self.protein,
+            "carbs": self.carbs,
+            "fats": self.fats,
+            "insight": self.insight,
+        }
+
+
+def response_text(result):
+    """
+    Text of the first candidate of a generateContent response.
+
+    Raises:
+        NutritionValidationError: The response has no candidate text (e.g. it was blocked).
+    """
+    try:
+        return result["candidates"][0]["content"]["parts"][0]["text"]
+    except (KeyError, IndexError, TypeError):
+        raise NutritionValidationError("response has no candidate text")
+
+
+def parse_nutrition_json(text):
+    """
+    Single strict parse of a schema-constrained reply.
+
+    Args:
+        text (str): JSON text produced under NUTRITION_RESPONSE_SCHEMA.
+
+    Returns:
+        NutritionRecord: The validated record.
+
+    Raises:
+        NutritionValidationError: Not valid JSON, or failed validation.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise NutritionValidationError(f"invalid JSON: {e}")
+    return NutritionRecord.from_dict(data)
+
+
+def parse_nutrition_response(result):
+    """Validated NutritionRecord from a full generateContent response dict."""
+    return parse_nutrition_json(response_text(result))
+
+
+def schema_generation_config(schema, max_output_tokens=500):
+    """generationConfig asking Gemini for JSON matching the given schema."""
+    return {
+        "temperature": 0.1,
+        "maxOutputTokens": max_output_tokens,
+        "responseMimeType": "application/json",
+        "responseSchema": schema,
+    }
+
+
+class IncrementalNutritionParser:
+    """
+    Pull nutrition fields out of a JSON answer while it is still streaming.
+
+    Each call to feed() receives the text accumulated so far and returns
+    every field whose value is already complete, so the UI can show the
+    food name before the macros arrive and stop the stream once all
+    required fields are known.
+    """
+
+    def __init__(self, required_fields=REQUIRED_FIELDS):
+        self.required_fields = list(required_fields)
+        self.fields = {}
+        self._patterns = {
+            "food_name": re.compile(STRING_FIELD.format("food_name")),
+            "insight": re.compile(STRING_FIELD.format("insight")),
+        }
+        for field in NUTRIENT_FIELDS:
+            self._patterns[field] = re.compile(NUMBER_FIELD.format(field))
+
+    def feed(self, text):
+        """
+        Scan the accumulated text for newly completed fields.
+
+        Args:
+            text (str): Everything streamed so far.
+
+        Returns:
+            dict: All fields parsed so far (calories as int, macros to one
+                decimal, strings unescaped).
+        """
+        for field, pattern in self._patterns.items():
+            if field in self.fields:
+                continue
+            match = pattern.search(text)
+            if not match:
+                continue
+            value = match.group(1)
+            if field == "calories":
+                self.fields[field] = int(round(float(value)))
+            elif field in NUTRIENT_FIELDS:
+                self.fields[field] = round(float(value), 1)
+            else:
+                self.fields[field] = value.replace('\\"', '"').replace("\\\\", "\\")
+        return self.fields
+
+    def is_complete(self, text=None):
+        """True once every required field has been parsed (optionally feeding text first)."""
+        if text is not None:
+            self.feed(text)
+        return all(field in self.fields for field in self.required_fields)
@@ -0,0 +1,652 @@
+# resilience.py
+import threading
+import time
+from collections import deque
+from queue import Empty, Queue
+
+from config_service import get_config
+
+
+class FlightTimeout(TimeoutError):
+    """Raised to a waiter when the shared in-flight call does not finish in time."""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls into one.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is still running wait for the same outcome instead of
+    issuing their own request. A result is returned to every waiter and an
+    exception is re-raised in every waiter. Nothing is remembered once the
+    call finishes - caching is the job of cache_service.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"executions": 0, "coalesced": 0, "timeouts": 0, "errors": 0}
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run fn() once per key across all concurrent callers.
+
+        Args:
+            key (str): Identity of the call, e.g. "text:dal tadka".
+            fn (callable): Zero-argument function performing the work.
+            timeout (float): Seconds a waiter will wait for the leader; None waits
+                as long as the leader runs.
+
+        Returns:
+            The value returned by fn().
+
+        Raises:
+            FlightTimeout: A waiter gave up before the leader finished.
+            Exception: Whatever fn() raised, in the leader and every waiter.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+                self._stats["executions"] += 1
+            else:
+                call.waiters += 1
+                leader = False
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise FlightTimeout(f"Timed out waiting for in-flight call '{key}'")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self):
+        """Number of distinct calls currently running."""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        """Counters for executions, coalesced waiters, waiter timeouts and errors."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call would wait longer than its latency budget for quota."""
+
+    def __init__(self, estimated_wait):
+        super().__init__(f"Rate limit: estimated wait {estimated_wait:.1f}s exceeds budget")
+        self.estimated_wait = estimated_wait
+
+
+class _Ticket:
+    def __init__(self, user_id, tokens):
+        self.user_id = user_id
+        self.tokens = tokens
+
+
+class RateLimiter:
+    """
+    Process-wide token buckets for requests/minute and tokens/minute.
+
+    Every Streamlit session draws from the same two buckets, mirroring the
+    quota of the shared API key. Waiting callers are served round-robin
+    across users (FIFO within a user), so one user queueing many analyses
+    cannot starve everyone else. A call whose estimated wait already
+    exceeds its latency budget is rejected up front instead of queued, so
+    the UI can fall back immediately.
+    """
+
+    def __init__(self, requests_per_minute=15, tokens_per_minute=250000, max_wait_seconds=3.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait_seconds = max_wait_seconds
+
+        self._request_level = float(requests_per_minute)
+        self._token_level = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+        self._cond = threading.Condition()
+        self._queues = {}      # user_id -> deque of waiting tickets
+        self._order = deque()  # users with waiting tickets, in round-robin order
+        self._waits = deque(maxlen=200)
+        self._stats = {"granted": 0, "rejected": 0, "timeouts": 0, "max_queue_depth": 0}
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._request_level = min(
+            self.requests_per_minute, self._request_level + elapsed * self.requests_per_minute / 60
+        )
+        self._token_level = min(
+            self.tokens_per_minute, self._token_level + elapsed * self.tokens_per_minute / 60
+        )
+
+    def _queue_depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _estimate_wait(self, user_id, tokens, now):
+        """Seconds until a new call from user_id would run under round-robin order."""
+        own = len(self._queues.get(user_id, ()))
+        queued = []
+        for other, queue in self._queues.items():
+            # Another user gets one turn per turn of ours, including the new ticket
+            queued.extend(queue if other == user_id else list(queue)[:own + 1])
+        missing_requests = len(queued) + 1 - self._request_level
+        missing_tokens = sum(ticket.tokens for ticket in queued) + tokens - self._token_level
+        return max(
+            0.0,
+            missing_requests * 60 / self.requests_per_minute,
+            missing_tokens * 60 / self.tokens_per_minute,
+            self._paused_until - now
+        )
+
+    def _is_next(self, ticket):
+        return bool(self._order) and self._order[0] == ticket.user_id \
+            and self._queues[ticket.user_id][0] is ticket
+
+    def _dequeue(self, ticket):
+        queue = self._queues.get(ticket.user_id)
+        if queue is None or ticket not in queue:
+            return
+        was_next = self._is_next(ticket)
+        queue.remove(ticket)
+        if was_next:
+            # Served: move this user to the back of the round-robin order
+            self._order.popleft()
+            if queue:
+                self._order.append(ticket.user_id)
+        if not queue:
+            del self._queues[ticket.user_id]
+            if ticket.user_id in self._order:
+                self._order.remove(ticket.user_id)
+
+    def acquire(self, user_id, tokens=1, max_wait=None):
+        """
+        Wait for quota for one request.
+
+        Args:
+            user_id (str): Caller identity used for fair queueing.
+            tokens (int): Estimated tokens the request will consume.
+            max_wait (float): Latency budget in seconds; defaults to max_wait_seconds.
+
+        Returns:
+            float: Seconds spent waiting.
+
+        Raises:
+            RateLimitExceeded: The wait would exceed, or did exceed, the budget.
+        """
+        max_wait = self.max_wait_seconds if max_wait is None else max_wait
+        tokens = min(max(1, int(tokens)), self.tokens_per_minute)
+
+        with self._cond:
+            started = time.monotonic()
+            self._refill(started)
+            estimated = self._estimate_wait(user_id, tokens, started)
+            if estimated > max_wait:
+                self._stats["rejected"] += 1
+                raise RateLimitExceeded(estimated)
+
+            ticket = _Ticket(user_id, tokens)
+            self._queues.setdefault(user_id, deque()).append(ticket)
+            if user_id not in self._order:
+                self._order.append(user_id)
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue_depth())
+            deadline = started + max_wait
+
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._is_next(ticket):
+                        ready_in = max(
+                            0.0,
+                            (1 - self._request_level) * 60 / self.requests_per_minute,
+                            (tokens - self._token_level) * 60 / self.tokens_per_minute,
+                            self._paused_until - now
+                        )
+                        if ready_in == 0.0:
+                            self._request_level -= 1
+                            self._token_level -= tokens
+                            self._dequeue(ticket)
+                            waited = now - started
+                            self._waits.append(waited)
+                            self._stats["granted"] += 1
+                            self._cond.notify_all()
+                            return waited
+                    else:
+                        ready_in = deadline - now
+
+                    if now >= deadline:
+                        self._stats["timeouts"] += 1
+                        raise RateLimitExceeded(ready_in)
+                    self._cond.wait(min(ready_in, deadline - now))
+            finally:
+                self._dequeue(ticket)
+                self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Stop granting quota for a while, e.g. after the server answered 429."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        """
+        Queue and wait-time metrics.
+
+        Returns:
+            dict: Current/max queue depth, granted/rejected/timed-out counts,
+                average and max wait in ms, and current bucket levels.
+        """
+        with self._cond:
+            self._refill(time.monotonic())
+            stats = dict(self._stats)
+            stats["queue_depth"] = self._queue_depth()
+            waits = list(self._waits)
+            stats["request_level"] = self._request_level
+            stats["token_level"] = self._token_level
+        stats["avg_wait_ms"] = sum(waits) / len(waits) * 1000 if waits else 0.0
+        stats["max_wait_ms"] = max(waits) * 1000 if waits else 0.0
+        return stats
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency while its circuit is open."""
+
+    def __init__(self, retry_in):
+        super().__init__(f"Circuit open; next probe in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker driven by error rate and latency.
+
+    While closed, outcomes of the last window_size calls are tracked; the
+    circuit opens when, over at least min_calls, the error rate or the
+    share of calls slower than slow_call_seconds crosses its threshold. A
+    "fatal" outcome (e.g. an expired API key) opens it immediately. After
+    open_seconds the circuit goes half-open and lets a single probe
+    through: success closes it, failure reopens it for twice as long (up
+    to max_open_seconds).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window_size=20, min_calls=5, failure_rate_threshold=0.5,
+                 slow_call_seconds=10.0, slow_rate_threshold=0.8, open_seconds=30.0,
+                 max_open_seconds=300.0):
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._outcomes = deque(maxlen=window_size)  # (failed, slow) per call
+        self._opened_at = 0.0
+        self._current_open_seconds = open_seconds
+        self._probe_in_flight = False
+        self._stats = {"opened": 0, "short_circuited": 0, "probes": 0, "successes": 0, "failures": 0}
+
+    def _update_state(self, now):
+        if self._state == self.OPEN and now - self._opened_at >= self._current_open_seconds:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+    def _open(self, now):
+        if self._state == self.HALF_OPEN:
+            self._current_open_seconds = min(self.max_open_seconds, self._current_open_seconds * 2)
+        else:
+            self._current_open_seconds = self.open_seconds
+        self._state = self.OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        self._stats["opened"] += 1
+
+    def _close(self):
+        self._state = self.CLOSED
+        self._outcomes.clear()
+        self._current_open_seconds = self.open_seconds
+        self._probe_in_flight = False
+
+    def _retry_in(self, now):
+        return max(0.0, self._opened_at + self._current_open_seconds - now)
+
+    def check(self):
+        """
+        Fail fast if a call would be rejected right now.
+
+        Does not reserve the half-open probe, so callers can check before
+        spending rate-limiter quota and still go through call() afterwards.
+
+        Raises:
+            CircuitOpenError: The circuit is open or its probe is already running.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._update_state(now)
+            if self._state == self.OPEN or (self._state == self.HALF_OPEN and self._probe_in_flight):
+                self._stats["short_circuited"] += 1
+                raise CircuitOpenError(self._retry_in(now))
+
+    def _allow(self):
+        now = time.monotonic()
+        with self._lock:
+            self._update_state(now)
+            if self._state == self.CLOSED:
+                return True, False
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self._stats["probes"] += 1
+                return True, True
+            self._stats["short_circuited"] += 1
+            raise CircuitOpenError(self._retry_in(now))
+
+    def call(self, fn, classify=None):
+        """
+        Run fn() through the breaker.
+
+        Args:
+            fn (callable): Zero-argument function calling the dependency.
+            classify (callable): Maps a raised exception to "failure", "fatal"
+                or "ignore" (neither success nor failure). Defaults to "failure".
+
+        Returns:
+            The value returned by fn().
+
+        Raises:
+            CircuitOpenError: The circuit is open (or a probe is already running).
+            Exception: Whatever fn() raised.
+        """
+        _, probe = self._allow()
+        started = time.monotonic()
+        try:
+            result = fn()
+        except BaseException as e:
+            outcome = classify(e) if classify else "failure"
+            self._record(outcome, time.monotonic() - started, probe)
+            raise
+        self._record("success", time.monotonic() - started, probe)
+        return result
+
+    def _record(self, outcome, latency, probe):
+        now = time.monotonic()
+        with self._lock:
+            if outcome == "ignore":
+                if probe:
+                    self._probe_in_flight = False
+                return
+
+            failed = outcome in ("failure", "fatal")
+            slow = latency > self.slow_call_seconds
+            self._stats["failures" if failed else "successes"] += 1
+
+            if probe or self._state == self.HALF_OPEN:
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self._close()
+                return
+
+            if self._state != self.CLOSED:
+                return
+            if outcome == "fatal":
+                self._open(now)
+                return
+
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) >= self.min_calls:
+                failure_rate = sum(1 for f, _ in self._outcomes if f) / len(self._outcomes)
+                slow_rate = sum(1 for _, s in self._outcomes if s) / len(self._outcomes)
+                if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_rate_threshold:
+                    self._open(now)
+
+    def state(self):
+        """Current state: "closed", "open" or "half_open"."""
+        with self._lock:
+            self._update_state(time.monotonic())
+            return self._state
+
+    def stats(self):
+        """
+        Breaker state and counters.
+
+        Returns:
+            dict: State, window error/slow rates, seconds until the next probe
+                and counters for openings, short-circuits, probes and outcomes.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._update_state(now)
+            stats = dict(self._stats)
+            stats["state"] = self._state
+            outcomes = list(self._outcomes)
+            stats["retry_in"] = self._retry_in(now) if self._state == self.OPEN else 0.0
+        stats["window_calls"] = len(outcomes)
+        stats["failure_rate"] = sum(1 for f, _ in outcomes if f) / len(outcomes) if outcomes else 0.0
+        stats["slow_rate"] = sum(1 for _, s in outcomes if s) / len(outcomes) if outcomes else 0.0
+        return stats
+
+
+class Hedger:
+    """
+    Hedged requests for cutting tail latency.
+
+    If a call has not finished after the chosen percentile of recent
+    latency for its key, one duplicate is started and whichever succeeds
+    first wins. The loser is not cancelled; its result is discarded.
+    Duplicates are paid from a budget that grows by budget_ratio per call,
+    so at most about budget_ratio extra requests are sent (5% by default)
+    no matter how slow the service gets.
+    """
+
+    def __init__(self, percentile=95.0, budget_ratio=0.05, min_delay=0.25, min_samples=20,
+                 max_burst=3.0, window=200):
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_burst = max_burst
+        self.window = window
+
+        self._lock = threading.Lock()
+        self._latencies = {}  # key -> deque of recent successful call durations
+        self._budget = 0.0
+        self._stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "skipped_budget": 0, "skipped_quota": 0}
+
+    def record(self, key, seconds):
+        """Add one successful call duration to the key's latency window."""
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, key):
+        """
+        Seconds to wait before hedging a call for this key.
+
+        Returns:
+            float or None: The configured percentile of recent latency (at
+                least min_delay), or None until min_samples calls have been seen.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+        return max(self.min_delay, latencies[index])
+
+    def _take_budget(self):
+        with self._lock:
+            if self._budget < 1.0:
+                self._stats["skipped_budget"] += 1
+                return False
+            self._budget -= 1.0
+            return True
+
+    def call(self, key, fn, can_hedge=None):
+        """
+        Run fn(), issuing one duplicate if it is slower than usual.
+
+        Args:
+            key (str): Latency class, e.g. "gemini-2.5-flash-lite:image".
+            fn (callable): Zero-argument call; may run twice, on worker threads.
+            can_hedge (callable): Asked just before the duplicate is sent (e.g.
+                to claim rate-limit quota); False skips the hedge.
+
+        Returns:
+            The value of the first call that succeeds.
+
+        Raises:
+            Exception: The first error, once no call is left that could succeed.
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            self._budget = min(self.max_burst, self._budget + self.budget_ratio)
+        delay = self.hedge_delay(key)
+        if delay is None:
+            started = time.perf_counter()
+            result = fn()
+            self.record(key, time.perf_counter() - started)
+            return result
+
+        results = Queue()
+
+        def attempt(hedge):
+            started = time.perf_counter()
+            try:
+                value = fn()
+            except Exception as e:
+                results.put((hedge, False, e))
+                return
+            self.record(key, time.perf_counter() - started)
+            results.put((hedge, True, value))
+
+        threading.Thread(target=attempt, args=(False,), name="hedge-primary", daemon=True).start()
+        pending = 1
+        try:
+            outcome = results.get(timeout=delay)
+        except Empty:
+            outcome = None
+            if self._take_budget():
+                if can_hedge is None or can_hedge():
+                    with self._lock:
+                        self._stats["hedged"] += 1
+                    threading.Thread(target=attempt, args=(True,), name="hedge-duplicate", daemon=True).start()
+                    pending += 1
+                else:
+                    with self._lock:
+                        self._budget += 1.0
+                        self._stats["skipped_quota"] += 1
+
+        error = None
+        while True:
+            hedge, ok, value = outcome if outcome is not None else results.get()
+            outcome = None
+            pending -= 1
+            if ok:
+                if hedge:
+                    with self._lock:
+                        self._stats["hedge_wins"] += 1
+                return value
+            error = error or value
+            if pending == 0:
+                raise error
+
+    def stats(self):
+        """Counters plus the current hedge delay per key (None while warming up)."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["budget"] = self._budget
+            keys = list(self._latencies)
+        stats["delays"] = {key: self.hedge_delay(key) for key in keys}
+        return stats
+
+
+_single_flight = None
+_rate_limiter = None
+_circuit_breaker = None
+_hedger = None
+_singleton_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Return the process-wide single-flight group for Gemini calls."""
+    global _single_flight
+    if _single_flight is None:
+        with _singleton_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
+
+
+def get_rate_limiter():
+    """Return the process-wide Gemini rate limiter, sized from the configured quota."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _singleton_lock:
+            if _rate_limiter is None:
+                config = get_config()
+                _rate_limiter = RateLimiter(
+                    requests_per_minute=config["gemini_requests_per_minute"],
+                    tokens_per_minute=config["gemini_tokens_per_minute"]
+                )
+    return _rate_limiter
+
+
+def get_circuit_breaker():
+    """Return the process-wide circuit breaker guarding the Gemini API."""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        with _singleton_lock:
+            if _circuit_breaker is None:
+                _circuit_breaker = CircuitBreaker()
+    return _circuit_breaker
+
+
+def get_hedger():
+    """Return the process-wide request hedger (GEMINI_HEDGE_PERCENTILE / _BUDGET / _MIN_DELAY)."""
+    global _hedger
+    if _hedger is None:
+        with _singleton_lock:
+            if _hedger is None:
+                config = get_config()
+                _hedger = Hedger(
+                    percentile=config["gemini_hedge_percentile"],
+                    budget_ratio=config["gemini_hedge_budget"],
+                    min_delay=config["gemini_hedge_min_delay"]
+                )
+    return _hedger